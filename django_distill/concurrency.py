@@ -0,0 +1,192 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+from django.db import connections
+from django_distill.errors import DistillError
+
+
+logger = logging.getLogger(__name__)
+
+
+def default_max_parallel_render():
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+class AdaptiveConcurrency(object):
+    '''
+        Limits how many pages are rendered at once and adjusts the limit, between
+        minimum and maximum, by hill climbing on throughput. Each window of
+        completed renders measures the throughput at the current limit. The limit
+        climbs one step at a time while each step improves throughput by more
+        than tolerance and then settles on the lowest limit within tolerance of
+        the best throughput measured around it. Every probe_every windows the
+        neighbouring limits are measured again in case conditions changed. A step
+        up is undone, and not tried again until the next probe, if the average
+        render latency, or the average database query latency if track_db is
+        set, grew by more than latency_factor as that means something, usually
+        the database, is overloaded.
+    '''
+
+    def __init__(self, minimum=1, maximum=None, initial=None, window_time=1.0,
+                 latency_factor=2.0, tolerance=0.05, probe_every=10, track_db=False):
+        self.maximum = maximum if maximum else default_max_parallel_render()
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = min(max(initial or self.minimum, self.minimum), self.maximum)
+        self.window_time = window_time
+        self.latency_factor = latency_factor
+        self.tolerance = tolerance
+        self.probe_every = probe_every
+        self.track_db = track_db
+        # throughput measured at each limit and the highest limit not overloaded
+        self.throughputs = {}
+        self.ceiling = self.maximum
+        # (limit, throughput, latency, db_latency) of every completed window
+        self.history = []
+        self._steady = 0
+        self._running = 0
+        self._condition = threading.Condition()
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_started = time.monotonic()
+        self._completed = 0
+        self._latency = 0.0
+        self._queries = 0
+        self._query_time = 0.0
+
+    @contextmanager
+    def slot(self):
+        '''
+            Blocks until fewer than limit renders are running, then times the
+            render run inside it.
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self._running < self.limit)
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            if self.track_db:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(self._time_query))
+                    yield
+            else:
+                yield
+        finally:
+            latency = time.perf_counter() - started
+            with self._condition:
+                self._running -= 1
+                self._completed += 1
+                self._latency += latency
+                self._end_window()
+                self._condition.notify_all()
+
+    def _time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._condition:
+                self._queries += 1
+                self._query_time += elapsed
+
+    def _end_window(self):
+        elapsed = time.monotonic() - self._window_started
+        # windows need enough renders at the current limit to measure it
+        if elapsed < self.window_time or self._completed < self.limit * 2:
+            return
+        throughput = self._completed / elapsed
+        latency = self._latency / self._completed
+        db_latency = self._query_time / self._queries if self._queries else None
+        self.adjust(throughput, latency, db_latency)
+        self._reset_window()
+
+    def adjust(self, throughput, latency, db_latency=None):
+        limit = self.limit
+        overloaded = False
+        if self.history:
+            previous_limit, previous_throughput, previous_latency, previous_db = self.history[-1]
+            if limit > previous_limit:
+                overloaded = latency > previous_latency * self.latency_factor
+                if db_latency is not None and previous_db:
+                    overloaded = overloaded or db_latency > previous_db * self.latency_factor
+        self.history.append((limit, throughput, latency, db_latency))
+        measured = self.throughputs.get(limit)
+        self.throughputs[limit] = throughput if measured is None else (measured + throughput) / 2
+        if overloaded:
+            self.ceiling = previous_limit
+            self._set_limit(previous_limit, throughput)
+            return
+        up = limit + 1 if limit < min(self.maximum, self.ceiling) else None
+        down = limit - 1 if limit > self.minimum else None
+        current = self.throughputs[limit]
+        if up is not None and up not in self.throughputs and (
+                down not in self.throughputs or
+                current > self.throughputs[down] * (1 + self.tolerance)):
+            new_limit = up
+        elif down is not None and down not in self.throughputs and (
+                up is None or up in self.throughputs):
+            new_limit = down
+        else:
+            candidates = [l for l in (down, limit, up) if l in self.throughputs]
+            best = max(self.throughputs[l] for l in candidates)
+            # the fewest threads doing as much work as the most productive limit
+            new_limit = min(l for l in candidates
+                            if self.throughputs[l] >= best * (1 - self.tolerance))
+        if new_limit == limit:
+            self._steady += 1
+            if self._steady >= self.probe_every:
+                self._steady = 0
+                self.ceiling = self.maximum
+                self.throughputs.pop(limit - 1, None)
+                self.throughputs.pop(limit + 1, None)
+        else:
+            self._steady = 0
+        self._set_limit(new_limit, throughput)
+
+    def _set_limit(self, limit, throughput):
+        if limit != self.limit:
+            logger.debug('Render concurrency %d -> %d (%.1f pages/s)', self.limit, limit,
+                         throughput)
+        self.limit = limit
+
+    def settled(self):
+        '''
+            Returns the limit used most often over the last few windows, the
+            concurrency hill climbing settled on, or the current limit.
+        '''
+        recent = [limit for limit, throughput, latency, db_latency in self.history[-6:]]
+        if not recent:
+            return self.limit
+        return Counter(recent).most_common(1)[0][0]
+
+    def describe(self):
+        settled = self.settled()
+        throughputs = [h[1] for h in self.history if h[0] == settled]
+        msg = 'Adaptive render concurrency settled on {} (bounds {}-{})'.format(
+            settled, self.minimum, self.maximum)
+        if throughputs:
+            msg += ', {:.1f} pages/s'.format(sum(throughputs) / len(throughputs))
+        return msg
+
+
+def parse_parallel_render(value, minimum=1, maximum=None, track_db=False):
+    '''
+        Parses a --parallel-render value, a number of threads or "auto". Returns
+        the number of render threads to start and an AdaptiveConcurrency if the
+        number running at once should be adjusted automatically, or None.
+    '''
+    if str(value).lower() == 'auto':
+        concurrency = AdaptiveConcurrency(minimum=minimum or 1, maximum=maximum,
+                                          track_db=track_db)
+        return concurrency.maximum, concurrency
+    try:
+        parallel_render = int(value)
+    except (TypeError, ValueError):
+        raise DistillError(f'Invalid --parallel-render "{value}", expected a number '
+                           f'of threads or "auto"')
+    return parallel_render, None
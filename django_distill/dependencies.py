@@ -0,0 +1,200 @@
+import os
+import re
+from hashlib import sha256
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from django.apps import apps as django_apps
+from django.db import connections
+from django.db.models import Count, Max, IntegerField
+from django.template.base import Template, UNKNOWN_SOURCE
+
+
+_recorder = ContextVar('distill_dependency_recorder', default=None)
+_table_pattern = None
+
+
+def get_models_by_table():
+    models = {}
+    for model in django_apps.get_models(include_auto_created=True):
+        models.setdefault(model._meta.db_table, model)
+    return models
+
+
+def get_table_pattern():
+    global _table_pattern
+    if _table_pattern is None:
+        tables = sorted(get_models_by_table(), key=len, reverse=True)
+        if tables:
+            _table_pattern = re.compile(r'\b({})\b'.format('|'.join(map(re.escape, tables))))
+        else:
+            _table_pattern = re.compile(r'(?!)')
+    return _table_pattern
+
+
+class DependencyRecorder(object):
+    '''
+        Records the database tables queried and the templates rendered while a
+        single page is rendered. Used as a database execute wrapper for every
+        connection in the rendering thread.
+    '''
+
+    def __init__(self):
+        self.tables = set()
+        self.templates = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.tables.update(get_table_pattern().findall(sql))
+        return execute(sql, params, many, context)
+
+    def record_template(self, origin):
+        name = getattr(origin, 'name', UNKNOWN_SOURCE)
+        if name and name != UNKNOWN_SOURCE:
+            self.templates.add(str(name))
+
+    def dependencies(self):
+        return sorted(self.tables), sorted(self.templates)
+
+
+def install_template_hook():
+    '''
+        Wraps Template._render so every template rendered, including extended
+        and included templates, is recorded by the current DependencyRecorder.
+        Installed once per process, templates rendered outside of a page render
+        are not affected.
+    '''
+    if getattr(Template._render, 'distill_hook', False):
+        return
+    original_render = Template._render
+    def _render(self, context):
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.record_template(self.origin)
+        return original_render(self, context)
+    _render.distill_hook = True
+    Template._render = _render
+
+
+@contextmanager
+def record_dependencies():
+    install_template_hook()
+    recorder = DependencyRecorder()
+    token = _recorder.set(recorder)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def row_value(value):
+    if isinstance(value, memoryview):
+        # binary fields, the repr of a memoryview includes its address
+        return bytes(value)
+    return value
+
+
+def table_fingerprint(model, chunk_size=2000):
+    '''
+        Returns a fingerprint of the rows in a model's table, the row count, the
+        highest integer primary key and a hash of the contents of every row in
+        primary key order. Rows being added, removed or edited in any way, by
+        this process or any other, change the fingerprint. Hashing the rows
+        reads the whole table so it is only done for tables pages depend on.
+    '''
+    aggregates = {'count': Count('pk')}
+    if isinstance(model._meta.pk, IntegerField):
+        aggregates['max_pk'] = Max('pk')
+    values = model._base_manager.aggregate(**aggregates)
+    rows = sha256()
+    fields = [field.attname for field in model._meta.concrete_fields]
+    queryset = model._base_manager.order_by('pk').values_list(*fields)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        rows.update(repr(tuple(row_value(v) for v in row)).encode('utf-8'))
+        rows.update(b'\n')
+    values['rows'] = rows.hexdigest()
+    return [str(values[k]) for k in sorted(values)]
+
+
+class DependencyState(object):
+    '''
+        The current state of the tables and templates pages depend on, table
+        fingerprints and template modification times. Each is looked up once.
+    '''
+
+    def __init__(self):
+        self.models = get_models_by_table()
+        self.tables = {}
+        self.templates = {}
+
+    def table_fingerprint(self, table):
+        if table not in self.tables:
+            model = self.models.get(table)
+            self.tables[table] = table_fingerprint(model) if model else None
+        return self.tables[table]
+
+    def template_mtime(self, template):
+        if template not in self.templates:
+            try:
+                self.templates[template] = os.path.getmtime(template)
+            except OSError:
+                self.templates[template] = None
+        return self.templates[template]
+
+    def preload(self, dependencies):
+        '''
+            Looks up the state of everything recorded by a previous build before
+            rendering starts, so changes made during the build are seen by the
+            next build.
+        '''
+        for table in dependencies.get('tables', {}):
+            self.table_fingerprint(table)
+        for template in dependencies.get('templates', {}):
+            self.template_mtime(template)
+
+    def changed(self, dependencies):
+        tables = dependencies.get('tables', {})
+        templates = dependencies.get('templates', {})
+        changed_tables = set(t for t, fp in tables.items()
+                             if fp is None or self.table_fingerprint(t) != fp)
+        changed_templates = set(t for t, mtime in templates.items()
+                                if mtime is None or self.template_mtime(t) != mtime)
+        return changed_tables, changed_templates
+
+    def snapshot(self, files):
+        '''
+            Returns the state of every table and template the pages in files
+            depend on, in the form stored in the build manifest.
+        '''
+        tables, templates = set(), set()
+        for entry in files.values():
+            tables.update(entry.get('tables', ()))
+            templates.update(entry.get('templates', ()))
+        return {'tables': {t: self.table_fingerprint(t) for t in sorted(tables)},
+                'templates': {t: self.template_mtime(t) for t in sorted(templates)}}
+
+
+def unchanged_uris(manifest, state):
+    '''
+        Returns the URIs of pages in the previous build recorded in manifest
+        whose dependencies have not changed since. Pages rendered without their
+        dependencies being recorded are never included.
+    '''
+    dependencies = manifest.dependencies
+    changed_tables, changed_templates = state.changed(dependencies)
+    known_tables = dependencies.get('tables', {})
+    known_templates = dependencies.get('templates', {})
+    uris = set()
+    for local_path, entry in manifest.files.items():
+        if 'uri' not in entry or 'tables' not in entry:
+            continue
+        tables, templates = set(entry['tables']), set(entry.get('templates', ()))
+        if tables & changed_tables or templates & changed_templates:
+            continue
+        if not tables.issubset(known_tables) or not templates.issubset(known_templates):
+            continue
+        if not os.path.isfile(os.path.join(manifest.output_dir, *local_path.split('/'))):
+            continue
+        uris.add(entry['uri'])
+    return uris
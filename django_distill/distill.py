@@ -1,7 +1,81 @@
+from collections import namedtuple
+from datetime import timedelta
 from django_distill.errors import DistillError
 
 
-urls_to_distill = []
+DistillURL = namedtuple('DistillURL', ('url', 'distill_func', 'distill_file',
+                                       'status_codes', 'name', 'args', 'kwargs'))
+
+
+class DistillRegistry(list):
+    '''
+        All URLs registered with distill_url(), distill_path() and distill_re_path()
+        in registration order. Entries are indexed by view name and URL pattern
+        as they are registered. Namespaces are only known once the URLs
+        have been included so they are indexed by index_namespaces(). The
+        distill_revalidate interval and distill_timeout of each URL, in seconds,
+        and its distill_max_concurrency are kept in revalidate, timeouts and
+        max_concurrency keyed by URL.
+    '''
+
+    def __init__(self, *a, **k):
+        super().__init__()
+        self.revalidate = {}
+        self.timeouts = {}
+        self.max_concurrency = {}
+        self.by_name = {}
+        self.by_url = {}
+        self.by_namespaced_name = {}
+        self._namespaces_indexed = 0
+        for entry in list(*a, **k):
+            self.append(entry)
+
+    def append(self, entry):
+        entry = DistillURL(*entry)
+        super().append(entry)
+        # the first URL registered with a name wins, as with a linear search
+        self.by_name.setdefault(entry.name, entry)
+        self.by_url.setdefault(entry.url, entry)
+
+    def index_namespaces(self, namespace_map):
+        if self._namespaces_indexed == len(self):
+            return
+        self.by_namespaced_name = {}
+        for entry in self:
+            namespace = namespace_map.get(entry.url)
+            if namespace:
+                self.by_namespaced_name.setdefault(f'{namespace}:{entry.name}', entry)
+        self._namespaces_indexed = len(self)
+
+    def get_revalidate(self, entry):
+        return self.revalidate.get(entry[0])
+
+    def get_timeout(self, entry):
+        return self.timeouts.get(entry[0])
+
+    def get_max_concurrency(self, entry):
+        return self.max_concurrency.get(entry[0])
+
+    def get(self, view_name, default=None):
+        '''
+            Returns the entry for a view name, which may include its namespace
+            such as 'some-namespace:view-name'.
+        '''
+        entry = self.by_name.get(view_name)
+        if entry is None:
+            entry = self.by_namespaced_name.get(view_name, default)
+        return entry
+
+
+urls_to_distill = DistillRegistry()
+
+
+def _get_seconds(name, value):
+    if isinstance(value, timedelta):
+        value = value.total_seconds()
+    if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+        raise DistillError(f'Invalid {name}, expected a timedelta or seconds: {value}')
+    return value
 
 
 def _distill_url(func, *a, **k):
@@ -12,6 +86,9 @@ def _distill_url(func, *a, **k):
         distill_func = lambda: None
     distill_file = k.get('distill_file')
     distill_status_codes = k.get('distill_status_codes')
+    distill_revalidate = _get_seconds('distill_revalidate', k.pop('distill_revalidate', None))
+    distill_timeout = _get_seconds('distill_timeout', k.pop('distill_timeout', None))
+    distill_max_concurrency = k.pop('distill_max_concurrency', None)
     if distill_file:
         del k['distill_file']
     if distill_status_codes:
@@ -24,9 +101,19 @@ def _distill_url(func, *a, **k):
     if not callable(distill_func):
         err = 'Distill function not callable: {}'
         raise DistillError(err.format(distill_func))
+    if distill_max_concurrency is not None and (not isinstance(distill_max_concurrency, int)
+                                                or distill_max_concurrency < 1):
+        err = 'Invalid distill_max_concurrency, expected a number of pages: {}'
+        raise DistillError(err.format(distill_max_concurrency))
     url = func(*a, **k)
-    urls_to_distill.append((url, distill_func, distill_file, distill_status_codes,
-                            name, a, k))
+    urls_to_distill.append(DistillURL(url, distill_func, distill_file, distill_status_codes,
+                                      name, a, k))
+    if distill_revalidate is not None:
+        urls_to_distill.revalidate[url] = distill_revalidate
+    if distill_timeout is not None:
+        urls_to_distill.timeouts[url] = distill_timeout
+    if distill_max_concurrency is not None:
+        urls_to_distill.max_concurrency[url] = distill_max_concurrency
     return url
 
 
@@ -0,0 +1,99 @@
+import json
+import os
+import time
+from hashlib import sha256
+from django_distill.manifest import content_hash
+
+
+JOURNAL_NAME = '.distill-journal'
+
+
+class BuildJournal(object):
+    '''
+        An append-only record of every page a build has finished writing, one
+        JSON line per page with its URI, language, output path and content hash.
+        Records are buffered and flushed to disk every flush_every pages or
+        flush_interval seconds so a build which is killed part way through can
+        be resumed, skipping the pages it had already written.
+    '''
+
+    def __init__(self, output_dir, path=None, flush_every=100, flush_interval=5):
+        self.output_dir = output_dir
+        self.path = path if path else os.path.join(output_dir, JOURNAL_NAME)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # pages recorded by a previous, interrupted, build
+        self.entries = {}
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    @classmethod
+    def load(cls, output_dir, path=None, **kwargs):
+        journal = cls(output_dir, path, **kwargs)
+        try:
+            with open(journal.path, 'rt') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete if the build was killed
+                        continue
+                    journal.entries[entry['uri']] = entry
+        except FileNotFoundError:
+            pass
+        return journal
+
+    def local_path(self, full_path):
+        return os.path.relpath(full_path, self.output_dir).replace(os.sep, '/')
+
+    def get(self, uri):
+        return self.entries.get(uri)
+
+    def is_intact(self, entry):
+        full_path = os.path.join(self.output_dir, *entry['path'].split('/'))
+        try:
+            with open(full_path, 'rb') as f:
+                digest = sha256()
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+        except OSError:
+            return False
+        return digest.hexdigest() == entry['hash']
+
+    def completed_uris(self):
+        '''
+            Returns the URIs of pages recorded by the previous build whose output
+            files are still intact.
+        '''
+        return set(uri for uri, entry in self.entries.items() if self.is_intact(entry))
+
+    def record(self, uri, lang, full_path, digest, size):
+        self._buffer.append({'uri': uri, 'lang': lang, 'path': self.local_path(full_path),
+                             'hash': digest, 'size': size})
+        if (len(self._buffer) >= self.flush_every or
+                time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def record_content(self, uri, lang, full_path, content):
+        self.record(uri, lang, full_path, content_hash(content), len(content))
+
+    def flush(self):
+        if self._buffer:
+            with open(self.path, 'at') as f:
+                for entry in self._buffer:
+                    f.write(json.dumps(entry, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def remove(self):
+        '''
+            Removes the journal once a build has completed.
+        '''
+        self._buffer = []
+        self.entries = {}
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
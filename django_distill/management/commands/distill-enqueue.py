@@ -0,0 +1,76 @@
+import os
+from django.core.management.base import (BaseCommand, CommandError)
+from django.conf import settings
+from django_distill.distill import urls_to_distill
+from django_distill.renderer import (allow_all_hosts, get_renderer, load_urls, load_url_list,
+                                     copy_static_and_media_files)
+from django_distill.workqueue import WorkQueue, enqueue_site
+from django_distill.errors import DistillError
+
+
+class Command(BaseCommand):
+
+    help = 'Adds every page of the site to a work queue for distill-worker to render'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue_path', type=str)
+        parser.add_argument('output_dir', nargs='?', type=str)
+        parser.add_argument('--quiet', dest='quiet', action='store_true')
+        parser.add_argument('--reset', dest='reset', action='store_true')
+        parser.add_argument('--exclude-staticfiles', dest='exclude_staticfiles', action='store_true')
+        parser.add_argument('--only-view', dest='only_views', action='append', default=None)
+        parser.add_argument('--only-url-glob', dest='only_url_globs', action='append',
+                            default=None)
+        parser.add_argument('--urls-from-file', dest='urls_from_file', type=str, default=None)
+
+    def _quiet(self, *args, **kwargs):
+        pass
+
+    def handle(self, *args, **options):
+        allow_all_hosts()
+        queue_path = os.path.abspath(os.path.expanduser(options.get('queue_path')))
+        output_dir = options.get('output_dir')
+        quiet = options.get('quiet')
+        reset = options.get('reset')
+        exclude_staticfiles = options.get('exclude_staticfiles')
+        only_views = options.get('only_views')
+        only_url_globs = options.get('only_url_globs')
+        urls_from_file = options.get('urls_from_file')
+        if quiet:
+            stdout = self._quiet
+        else:
+            stdout = self.stdout.write
+        if not output_dir:
+            output_dir = getattr(settings, 'DISTILL_DIR', None)
+            if not output_dir:
+                e = 'Usage: ./manage.py distill-enqueue [queue file] [directory]'
+                raise CommandError(e)
+        if not exclude_staticfiles and not os.path.isdir(settings.STATIC_ROOT):
+            e = 'Static source directory does not exist, run collectstatic'
+            raise CommandError(e)
+        output_dir = os.path.abspath(os.path.expanduser(output_dir))
+        work_queue = WorkQueue(queue_path)
+        try:
+            only_urls = load_url_list(urls_from_file) if urls_from_file else None
+            if reset:
+                stdout('Removing all tasks from the work queue')
+                work_queue.reset()
+            work_queue.set_meta('output_dir', output_dir)
+            load_urls(stdout)
+            renderer = get_renderer(urls_to_distill, only_views=only_views,
+                                    only_urls=only_urls, only_url_globs=only_url_globs)
+            added = enqueue_site(work_queue, renderer)
+            stdout('Added {} page(s) to the work queue: {}'.format(added, queue_path))
+            if not exclude_staticfiles:
+                if not os.path.isdir(output_dir):
+                    os.makedirs(output_dir)
+                copy_static_and_media_files(output_dir, stdout)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        finally:
+            work_queue.close()
+        stdout('')
+        stdout('Start any number of workers to render the pages with:')
+        stdout('')
+        stdout('    ./manage.py distill-worker {}'.format(queue_path))
+        stdout('')
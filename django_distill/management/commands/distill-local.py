@@ -3,8 +3,14 @@ from shutil import rmtree
 from django.core.management.base import (BaseCommand, CommandError)
 from django.conf import settings
 from django_distill.distill import urls_to_distill
-from django_distill.renderer import (run_collectstatic, render_to_dir,
-                                     copy_static_and_media_files, render_redirects)
+from django_distill.renderer import (allow_all_hosts, run_collectstatic,
+                                     render_to_dir, copy_static_and_media_files,
+                                     render_redirects, load_url_list, RENDER_ENGINES, SCHEDULES)
+from django_distill.manifest import BuildManifest
+from django_distill.dependencies import DependencyState, unchanged_uris
+from django_distill.journal import BuildJournal
+from django_distill.shards import parse_shard
+from django_distill.concurrency import parse_parallel_render
 from django_distill.errors import DistillError
 
 
@@ -19,12 +25,40 @@ class Command(BaseCommand):
         parser.add_argument('--force', dest='force', action='store_true')
         parser.add_argument('--exclude-staticfiles', dest='exclude_staticfiles', action='store_true')
         parser.add_argument('--generate-redirects', dest='generate_redirects', action='store_true')
-        parser.add_argument('--parallel-render', dest='parallel_render', type=int, default=1)
+        parser.add_argument('--parallel-render', dest='parallel_render', type=str, default='1')
+        parser.add_argument('--min-parallel-render', dest='min_parallel_render', type=int,
+                            default=1)
+        parser.add_argument('--max-parallel-render', dest='max_parallel_render', type=int,
+                            default=None)
+        parser.add_argument('--watch-db-latency', dest='watch_db_latency', action='store_true')
+        parser.add_argument('--render-engine', dest='render_engine', type=str,
+                            choices=RENDER_ENGINES, default='thread')
+        parser.add_argument('--max-tasks-per-worker', dest='max_tasks_per_worker', type=int,
+                            default=None)
+        parser.add_argument('--render-unordered', dest='render_unordered', action='store_true')
+        parser.add_argument('--max-pending-renders', dest='max_pending_renders', type=int,
+                            default=None)
+        parser.add_argument('--keep-going', dest='keep_going', action='store_true')
+        parser.add_argument('--canary', dest='canary', action='store_true')
+        parser.add_argument('--incremental', dest='incremental', action='store_true')
+        parser.add_argument('--manifest', dest='manifest', type=str, default=None)
+        parser.add_argument('--changed-only', dest='changed_only', action='store_true')
+        parser.add_argument('--conditional-requests', dest='conditional_requests',
+                            action='store_true')
+        parser.add_argument('--resume', dest='resume', action='store_true')
+        parser.add_argument('--only-view', dest='only_views', action='append', default=None)
+        parser.add_argument('--only-url-glob', dest='only_url_globs', action='append',
+                            default=None)
+        parser.add_argument('--urls-from-file', dest='urls_from_file', type=str, default=None)
+        parser.add_argument('--shard', dest='shard', type=str, default=None)
+        parser.add_argument('--schedule', dest='schedule', type=str, choices=SCHEDULES,
+                            default='registration')
 
     def _quiet(self, *args, **kwargs):
         pass
 
     def handle(self, *args, **options):
+        allow_all_hosts()
         output_dir = options.get('output_dir')
         collectstatic = options.get('collectstatic')
         quiet = options.get('quiet')
@@ -32,6 +66,45 @@ class Command(BaseCommand):
         exclude_staticfiles = options.get('exclude_staticfiles')
         generate_redirects = options.get('generate_redirects')
         parallel_render = options.get('parallel_render')
+        min_parallel_render = options.get('min_parallel_render')
+        max_parallel_render = options.get('max_parallel_render')
+        watch_db_latency = options.get('watch_db_latency')
+        render_engine = options.get('render_engine')
+        max_tasks_per_worker = options.get('max_tasks_per_worker')
+        render_unordered = options.get('render_unordered')
+        max_pending_renders = options.get('max_pending_renders')
+        keep_going = options.get('keep_going')
+        canary = options.get('canary')
+        incremental = options.get('incremental')
+        manifest_path = options.get('manifest')
+        changed_only = options.get('changed_only')
+        conditional_requests = options.get('conditional_requests')
+        resume = options.get('resume')
+        only_views = options.get('only_views')
+        only_url_globs = options.get('only_url_globs')
+        urls_from_file = options.get('urls_from_file')
+        shard = options.get('shard')
+        schedule = options.get('schedule')
+        only_urls = None
+        if resume and (only_views or only_url_globs or urls_from_file):
+            # the journal records a full build, a selective build can neither
+            # resume it nor complete it
+            e = ('--resume cannot be used with --only-view, --only-url-glob or '
+                 '--urls-from-file')
+            raise CommandError(e)
+        try:
+            if urls_from_file:
+                only_urls = load_url_list(urls_from_file)
+            if shard:
+                shard = parse_shard(shard)
+            parallel_render, concurrency = parse_parallel_render(
+                parallel_render, min_parallel_render, max_parallel_render, watch_db_latency)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        # static files and redirects are the same for every shard so only the
+        # first shard writes them
+        first_shard = not shard or shard[0] == 1
+        selective = bool(only_views or only_url_globs or urls_from_file)
         if quiet:
             stdout = self._quiet
         else:
@@ -41,6 +114,13 @@ class Command(BaseCommand):
             if not output_dir:
                 e = 'Usage: ./manage.py distill-local [directory]'
                 raise CommandError(e)
+        if changed_only or conditional_requests:
+            # only rendering changed pages requires updating the output in place
+            incremental = True
+        if incremental and render_engine == 'async':
+            e = ('--incremental, --changed-only and --conditional-requests record page '
+                 'dependencies, which the async render engine does not support')
+            raise CommandError(e)
         if collectstatic:
             run_collectstatic(stdout)
         if not exclude_staticfiles and not os.path.isdir(settings.STATIC_ROOT):
@@ -53,8 +133,34 @@ class Command(BaseCommand):
         stdout('')
         stdout('    Source static path:  {}'.format(settings.STATIC_ROOT))
         stdout('    Distill output path: {}'.format(output_dir))
+        if shard:
+            stdout('    Shard:               {} of {}'.format(*shard))
         stdout('')
-        if os.path.isdir(output_dir):
+        manifest = None
+        journal = None
+        durations = None
+        if schedule == 'longest-first':
+            # read before the output directory is recreated
+            try:
+                durations = BuildManifest.load(output_dir, manifest_path).render_durations()
+            except DistillError:
+                durations = {}
+            stdout('Rendering the slowest pages first using the durations of {} page(s) '
+                   'from the previous build'.format(len(durations)))
+        if (incremental or resume or selective) and os.path.isdir(output_dir):
+            stdout('Distill output directory exists, updating it in place')
+            if selective:
+                stdout('Only the selected pages will be rendered')
+            if incremental:
+                try:
+                    manifest = BuildManifest.load(output_dir, manifest_path)
+                except DistillError as err:
+                    raise CommandError(str(err)) from err
+                stdout('Only changed files will be written and orphaned files removed')
+            if resume:
+                journal = BuildJournal.load(output_dir)
+                stdout('Resuming the previous build, pages it completed will be skipped')
+        elif os.path.isdir(output_dir):
             stdout('Distill output directory exists, clean up?')
             stdout('This will delete and recreate all files in the output dir')
             stdout('')
@@ -78,17 +184,71 @@ class Command(BaseCommand):
                 os.makedirs(output_dir)
             else:
                 raise CommandError('Aborting...')
+        if (incremental or schedule == 'longest-first') and manifest is None:
+            # the manifest records render durations for the next build
+            manifest = BuildManifest(output_dir, manifest_path)
+        if journal is None and not selective:
+            # selective builds leave any journal from an interrupted full build
+            journal = BuildJournal(output_dir)
+        skip_uris = set()
+        if manifest is not None:
+            dependency_state = DependencyState()
+            dependency_state.preload(manifest.dependencies)
+            if changed_only:
+                unchanged = unchanged_uris(manifest, dependency_state)
+                stdout('{} page(s) from the previous build have no changed '
+                       'dependencies and will not be rendered'.format(len(unchanged)))
+                skip_uris.update(unchanged)
+        if resume:
+            completed = journal.completed_uris()
+            stdout('{} page(s) were completed by the interrupted build and will not '
+                   'be rendered'.format(len(completed)))
+            skip_uris.update(completed)
+        uri_filter = (lambda uri: uri not in skip_uris) if skip_uris else None
         stdout('')
         stdout('Generating static site into directory: {}'.format(output_dir))
         try:
-            render_to_dir(output_dir, urls_to_distill, stdout, parallel_render=parallel_render)
-            if not exclude_staticfiles:
-                copy_static_and_media_files(output_dir, stdout)
+            render_to_dir(output_dir, urls_to_distill, stdout,
+                          parallel_render=parallel_render,
+                          concurrency=concurrency,
+                          render_engine=render_engine,
+                          max_tasks_per_worker=max_tasks_per_worker,
+                          queue_size=max_pending_renders,
+                          ordered=not render_unordered,
+                          continue_on_error=keep_going,
+                          canary=canary,
+                          manifest=manifest,
+                          journal=journal,
+                          track_dependencies=incremental,
+                          uri_filter=uri_filter,
+                          conditional_headers=(manifest.conditional_headers
+                                               if conditional_requests else None),
+                          only_views=only_views,
+                          only_urls=only_urls,
+                          only_url_globs=only_url_globs,
+                          shard=shard,
+                          schedule=schedule,
+                          durations=durations)
+            if not exclude_staticfiles and first_shard:
+                copy_static_and_media_files(output_dir, stdout, manifest)
+            elif manifest is not None:
+                manifest.keep_static()
         except DistillError as err:
             raise CommandError(str(err)) from err
         stdout('')
-        if generate_redirects:
+        if generate_redirects and first_shard:
             stdout('Generating redirects')
-            render_redirects(output_dir, stdout)
+            render_redirects(output_dir, stdout, manifest)
             stdout('')
+        if manifest is not None:
+            if selective:
+                # pages which were not selected are still part of the site
+                manifest.keep_unvisited()
+            manifest.remove_orphans(stdout)
+            manifest.new_dependencies = dependency_state.snapshot(manifest.new_files)
+            manifest.save()
+            stdout('Saved build manifest: {}'.format(manifest.path))
+        # the build is complete so there is nothing left to resume
+        if journal is not None:
+            journal.remove()
         stdout('Site generation complete.')
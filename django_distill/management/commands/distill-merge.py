@@ -0,0 +1,62 @@
+import os
+from shutil import rmtree
+from django.core.management.base import (BaseCommand, CommandError)
+from django_distill.shards import merge_build_dirs
+from django_distill.errors import DistillError
+
+
+class Command(BaseCommand):
+
+    help = 'Merges the output directories of sharded builds into a single site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', type=str)
+        parser.add_argument('shard_dirs', nargs='+', type=str)
+        parser.add_argument('--quiet', dest='quiet', action='store_true')
+        parser.add_argument('--force', dest='force', action='store_true')
+
+    def _quiet(self, *args, **kwargs):
+        pass
+
+    def handle(self, *args, **options):
+        output_dir = os.path.abspath(os.path.expanduser(options.get('output_dir')))
+        shard_dirs = [os.path.abspath(os.path.expanduser(d)) for d in options.get('shard_dirs')]
+        quiet = options.get('quiet')
+        force = options.get('force')
+        if quiet:
+            stdout = self._quiet
+        else:
+            stdout = self.stdout.write
+        for shard_dir in shard_dirs:
+            if not os.path.isdir(shard_dir):
+                raise CommandError('Shard directory does not exist: {}'.format(shard_dir))
+            if shard_dir == output_dir:
+                raise CommandError('The output directory cannot also be a shard directory')
+        stdout('')
+        stdout('You have requested to merge {} shard(s) into the directory:'.format(
+            len(shard_dirs)))
+        stdout('')
+        stdout('    Distill output path: {}'.format(output_dir))
+        stdout('')
+        if os.path.isdir(output_dir):
+            stdout('Distill output directory exists, clean up?')
+            stdout('This will delete and recreate all files in the output dir')
+            stdout('')
+            if force:
+                ans = 'yes'
+            else:
+                ans = input('Type \'yes\' to continue, or \'no\' to cancel: ')
+            if ans.lower() == 'yes':
+                stdout('Recreating output directory...')
+                rmtree(output_dir)
+            else:
+                raise CommandError('Merging shards cancelled.')
+        os.makedirs(output_dir)
+        try:
+            manifest = merge_build_dirs(output_dir, shard_dirs, stdout)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        if manifest is not None:
+            stdout('Saved build manifest: {}'.format(manifest.path))
+        stdout('')
+        stdout('Merging shards complete.')
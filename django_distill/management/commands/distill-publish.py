@@ -5,9 +5,15 @@ from django.core.management.base import (BaseCommand, CommandError)
 from django_distill.backends import get_backend
 from django_distill.distill import urls_to_distill
 from django_distill.errors import DistillError
-from django_distill.renderer import (run_collectstatic, render_to_dir,
-                                     copy_static_and_media_files, render_redirects)
+from django_distill.renderer import (allow_all_hosts, run_collectstatic,
+                                     render_to_dir, copy_static_and_media_files,
+                                     render_redirects, load_url_list, RENDER_ENGINES)
 from django_distill.publisher import publish_dir
+from django_distill.shards import parse_shard
+from django_distill.concurrency import parse_parallel_render
+from django_distill.manifest import MANIFEST_NAME
+from django_distill.journal import JOURNAL_NAME
+from django_distill.middleware import CONTENT_TYPES_NAME
 
 
 class Command(BaseCommand):
@@ -26,12 +32,33 @@ class Command(BaseCommand):
         parser.add_argument('--ignore-remote-content', dest='ignore_remote_content', action='store_true')
         parser.add_argument('--parallel-publish', dest='parallel_publish', type=int, default=1)
         parser.add_argument('--generate-redirects', dest='generate_redirects', action='store_true')
-        parser.add_argument('--parallel-render', dest='parallel_render', type=int, default=1)
+        parser.add_argument('--parallel-render', dest='parallel_render', type=str, default='1')
+        parser.add_argument('--min-parallel-render', dest='min_parallel_render', type=int,
+                            default=1)
+        parser.add_argument('--max-parallel-render', dest='max_parallel_render', type=int,
+                            default=None)
+        parser.add_argument('--watch-db-latency', dest='watch_db_latency', action='store_true')
+        parser.add_argument('--render-engine', dest='render_engine', type=str,
+                            choices=RENDER_ENGINES, default='thread')
+        parser.add_argument('--max-tasks-per-worker', dest='max_tasks_per_worker', type=int,
+                            default=None)
+        parser.add_argument('--render-unordered', dest='render_unordered', action='store_true')
+        parser.add_argument('--max-pending-renders', dest='max_pending_renders', type=int,
+                            default=None)
+        parser.add_argument('--keep-going', dest='keep_going', action='store_true')
+        parser.add_argument('--canary', dest='canary', action='store_true')
+        parser.add_argument('--only-view', dest='only_views', action='append', default=None)
+        parser.add_argument('--only-url-glob', dest='only_url_globs', action='append',
+                            default=None)
+        parser.add_argument('--urls-from-file', dest='urls_from_file', type=str, default=None)
+        parser.add_argument('--shard', dest='shard', type=str, default=None)
+        parser.add_argument('--from-dir', dest='from_dir', type=str, default=None)
 
     def _quiet(self, *args, **kwargs):
         pass
 
     def handle(self, *args, **options):
+        allow_all_hosts()
         publish_target_name = options.get('publish_target_name')
         if not publish_target_name:
             publish_target_name = 'default'
@@ -54,11 +81,46 @@ class Command(BaseCommand):
         force = options.get('force')
         generate_redirects = options.get('generate_redirects')
         parallel_render = options.get('parallel_render')
+        min_parallel_render = options.get('min_parallel_render')
+        max_parallel_render = options.get('max_parallel_render')
+        watch_db_latency = options.get('watch_db_latency')
+        render_engine = options.get('render_engine')
+        max_tasks_per_worker = options.get('max_tasks_per_worker')
+        render_unordered = options.get('render_unordered')
+        max_pending_renders = options.get('max_pending_renders')
+        keep_going = options.get('keep_going')
+        canary = options.get('canary')
+        only_views = options.get('only_views')
+        only_url_globs = options.get('only_url_globs')
+        urls_from_file = options.get('urls_from_file')
+        shard = options.get('shard')
+        from_dir = options.get('from_dir')
+        only_urls = None
+        try:
+            if urls_from_file:
+                only_urls = load_url_list(urls_from_file)
+            if shard:
+                shard = parse_shard(shard)
+            parallel_render, concurrency = parse_parallel_render(
+                parallel_render, min_parallel_render, max_parallel_render, watch_db_latency)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        first_shard = not shard or shard[0] == 1
+        selective = bool(only_views or only_url_globs or urls_from_file or shard)
+        if from_dir:
+            from_dir = os.path.abspath(os.path.expanduser(from_dir))
+            if not os.path.isdir(from_dir):
+                raise CommandError('Directory to publish does not exist: {}'.format(from_dir))
+            if selective:
+                raise CommandError('Pages cannot be selected when publishing an existing '
+                                   'directory with --from-dir')
         if quiet:
             stdout = self._quiet
         else:
             stdout = self.stdout.write
         with tempfile.TemporaryDirectory() as output_dir:
+            if from_dir:
+                output_dir = from_dir
             if not output_dir.endswith(os.sep):
                 output_dir += os.sep
             backend_class = get_backend(publish_engine)
@@ -74,9 +136,10 @@ class Command(BaseCommand):
             stdout('    Username:      {}'.format(username))
             stdout('    Container:     {}'.format(container))
             stdout('')
-            if collectstatic:
+            if collectstatic and not from_dir:
                 run_collectstatic(stdout)
-            if not exclude_staticfiles and not os.path.isdir(settings.STATIC_ROOT):
+            if (not exclude_staticfiles and not from_dir and
+                    not os.path.isdir(settings.STATIC_ROOT)):
                 e = 'Static source directory does not exist, run collectstatic'
                 raise CommandError(e)
             if force:
@@ -88,21 +151,43 @@ class Command(BaseCommand):
             else:
                 raise CommandError('Publishing site cancelled.')
             self.stdout.write('')
-            msg = 'Generating static site into directory: {}'
-            stdout(msg.format(output_dir))
-            try:
-                render_to_dir(output_dir, urls_to_distill, stdout, parallel_render=parallel_render)
-                if not exclude_staticfiles:
-                    copy_static_and_media_files(output_dir, stdout)
-            except DistillError as err:
-                raise CommandError(str(err)) from err
-            stdout('')
-            if generate_redirects:
-                stdout('Generating redirects')
-                render_redirects(output_dir, stdout)
+            if from_dir:
+                stdout('Publishing existing directory: {}'.format(from_dir))
+            else:
+                msg = 'Generating static site into directory: {}'
+                stdout(msg.format(output_dir))
+                try:
+                    render_to_dir(output_dir, urls_to_distill, stdout,
+                                  parallel_render=parallel_render,
+                                  concurrency=concurrency,
+                                  render_engine=render_engine,
+                                  max_tasks_per_worker=max_tasks_per_worker,
+                                  queue_size=max_pending_renders,
+                                  ordered=not render_unordered,
+                                  continue_on_error=keep_going,
+                                  canary=canary,
+                                  only_views=only_views,
+                                  only_urls=only_urls,
+                                  only_url_globs=only_url_globs,
+                                  shard=shard)
+                    if not exclude_staticfiles and first_shard:
+                        copy_static_and_media_files(output_dir, stdout)
+                except DistillError as err:
+                    raise CommandError(str(err)) from err
                 stdout('')
+                if generate_redirects and first_shard:
+                    stdout('Generating redirects')
+                    render_redirects(output_dir, stdout)
+                    stdout('')
             stdout('Publishing site')
             backend.index_local_files()
-            publish_dir(backend, stdout, not skip_verify, parallel_publish, ignore_remote_content)
+            if from_dir:
+                # build metadata is not part of the site
+                for name in (MANIFEST_NAME, JOURNAL_NAME, CONTENT_TYPES_NAME):
+                    backend.local_files.discard(os.path.join(from_dir, name))
+            if selective:
+                stdout('Only part of the site was generated, remote files will not be deleted')
+            publish_dir(backend, stdout, not skip_verify, parallel_publish, ignore_remote_content,
+                        delete_orphans=not selective)
         stdout('')
         stdout('Site generation and publishing complete.')
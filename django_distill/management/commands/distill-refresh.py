@@ -0,0 +1,95 @@
+import os
+from django.core.management.base import (BaseCommand, CommandError)
+from django.conf import settings
+from django_distill.distill import urls_to_distill
+from django_distill.renderer import allow_all_hosts, render_to_dir, RENDER_ENGINES
+from django_distill.manifest import BuildManifest
+from django_distill.dependencies import DependencyState
+from django_distill.errors import DistillError
+
+
+class Command(BaseCommand):
+
+    help = 'Re-renders the pages of a local static site older than their distill_revalidate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', nargs='?', type=str)
+        parser.add_argument('--quiet', dest='quiet', action='store_true')
+        parser.add_argument('--manifest', dest='manifest', type=str, default=None)
+        parser.add_argument('--default-revalidate', dest='default_revalidate', type=float,
+                            default=None)
+        parser.add_argument('--parallel-render', dest='parallel_render', type=int, default=1)
+        # refreshed pages record their dependencies, which async renders cannot
+        parser.add_argument('--render-engine', dest='render_engine', type=str,
+                            choices=[e for e in RENDER_ENGINES if e != 'async'],
+                            default='thread')
+        parser.add_argument('--keep-going', dest='keep_going', action='store_true')
+
+    def _quiet(self, *args, **kwargs):
+        pass
+
+    def get_ttl(self, view_name, default_revalidate):
+        '''
+            Returns the shortest distill_revalidate of the views with this name,
+            or the default if none of them set one.
+        '''
+        ttls = [urls_to_distill.get_revalidate(entry) for entry in urls_to_distill
+                if entry.name == view_name]
+        ttls = [ttl for ttl in ttls if ttl is not None]
+        return min(ttls) if ttls else default_revalidate
+
+    def handle(self, *args, **options):
+        allow_all_hosts()
+        output_dir = options.get('output_dir')
+        quiet = options.get('quiet')
+        manifest_path = options.get('manifest')
+        default_revalidate = options.get('default_revalidate')
+        parallel_render = options.get('parallel_render')
+        render_engine = options.get('render_engine')
+        keep_going = options.get('keep_going')
+        if quiet:
+            stdout = self._quiet
+        else:
+            stdout = self.stdout.write
+        if not output_dir:
+            output_dir = getattr(settings, 'DISTILL_DIR', None)
+            if not output_dir:
+                e = 'Usage: ./manage.py distill-refresh [directory]'
+                raise CommandError(e)
+        output_dir = os.path.abspath(os.path.expanduser(output_dir))
+        try:
+            manifest = BuildManifest.load(output_dir, manifest_path)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        if not manifest.files:
+            e = ('No build manifest found in {}, build the site with '
+                 './manage.py distill-local --incremental first').format(output_dir)
+            raise CommandError(e)
+        stale = manifest.stale_uris(lambda view_name: self.get_ttl(view_name,
+                                                                   default_revalidate))
+        if not stale:
+            stdout('No pages need refreshing.')
+            return
+        views = set(entry.get('view') for entry in manifest.files.values()
+                    if entry.get('uri') in stale)
+        stdout('Refreshing {} page(s) of {} view(s) in: {}'.format(len(stale), len(views),
+                                                                 output_dir))
+        dependency_state = DependencyState()
+        dependency_state.preload(manifest.dependencies)
+        try:
+            render_to_dir(output_dir, urls_to_distill, stdout,
+                          parallel_render=parallel_render,
+                          render_engine=render_engine,
+                          continue_on_error=keep_going,
+                          manifest=manifest,
+                          track_dependencies=True,
+                          # pages recorded without their view need every view
+                          only_views=None if None in views else sorted(views),
+                          uri_filter=lambda uri: uri in stale)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        manifest.keep_unvisited()
+        manifest.new_dependencies = dependency_state.snapshot(manifest.new_files)
+        manifest.save()
+        stdout('')
+        stdout('Site refresh complete.')
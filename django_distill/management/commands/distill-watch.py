@@ -0,0 +1,72 @@
+import os
+from django.core.management.base import (BaseCommand, CommandError)
+from django.conf import settings
+from django_distill.distill import urls_to_distill
+from django_distill.renderer import allow_all_hosts
+from django_distill.watcher import SiteWatcher
+from django_distill.errors import DistillError
+
+
+class Command(BaseCommand):
+
+    help = 'Watches for changes and re-renders the affected pages of a local static site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', nargs='?', type=str)
+        parser.add_argument('--quiet', dest='quiet', action='store_true')
+        parser.add_argument('--interval', dest='interval', type=float, default=1)
+        parser.add_argument('--watch-db', dest='watch_db', action='store_true')
+        parser.add_argument('--db-interval', dest='db_interval', type=float, default=10)
+        parser.add_argument('--collectstatic', dest='collectstatic', action='store_true')
+        parser.add_argument('--exclude-staticfiles', dest='exclude_staticfiles', action='store_true')
+        parser.add_argument('--parallel-render', dest='parallel_render', type=int, default=1)
+        parser.add_argument('--manifest', dest='manifest', type=str, default=None)
+
+    def _quiet(self, *args, **kwargs):
+        pass
+
+    def handle(self, *args, **options):
+        allow_all_hosts()
+        output_dir = options.get('output_dir')
+        quiet = options.get('quiet')
+        interval = options.get('interval')
+        watch_db = options.get('watch_db')
+        db_interval = options.get('db_interval')
+        collectstatic = options.get('collectstatic')
+        exclude_staticfiles = options.get('exclude_staticfiles')
+        parallel_render = options.get('parallel_render')
+        manifest_path = options.get('manifest')
+        if quiet:
+            stdout = self._quiet
+        else:
+            stdout = self.stdout.write
+        if not output_dir:
+            output_dir = getattr(settings, 'DISTILL_DIR', None)
+            if not output_dir:
+                e = 'Usage: ./manage.py distill-watch [directory]'
+                raise CommandError(e)
+        if not exclude_staticfiles and not os.path.isdir(settings.STATIC_ROOT):
+            e = 'Static source directory does not exist, run collectstatic'
+            raise CommandError(e)
+        output_dir = os.path.abspath(os.path.expanduser(output_dir))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        stdout('')
+        stdout('Watching for changes to update the static site in:')
+        stdout('')
+        stdout('    Distill output path: {}'.format(output_dir))
+        stdout('')
+        try:
+            watcher = SiteWatcher(output_dir, urls_to_distill, stdout,
+                                  manifest_path=manifest_path,
+                                  watch_db=watch_db,
+                                  db_interval=db_interval,
+                                  watch_static=not exclude_staticfiles,
+                                  collectstatic=collectstatic,
+                                  parallel_render=parallel_render)
+            watcher.run(interval)
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        except KeyboardInterrupt:
+            stdout('')
+            stdout('Stopped watching.')
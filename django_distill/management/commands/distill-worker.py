@@ -0,0 +1,77 @@
+import os
+from django.core.management.base import (BaseCommand, CommandError)
+from django_distill.distill import urls_to_distill
+from django_distill.renderer import allow_all_hosts, get_renderer, load_urls
+from django_distill.workqueue import WorkQueue, QueueWorker
+from django_distill.errors import DistillError
+
+
+class Command(BaseCommand):
+
+    help = 'Renders pages from a work queue filled by distill-enqueue until it is empty'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue_path', type=str)
+        parser.add_argument('--output-dir', dest='output_dir', type=str, default=None)
+        parser.add_argument('--quiet', dest='quiet', action='store_true')
+        parser.add_argument('--parallel-render', dest='parallel_render', type=int, default=1)
+        parser.add_argument('--batch-size', dest='batch_size', type=int, default=1)
+        parser.add_argument('--lease-time', dest='lease_time', type=float, default=600)
+        parser.add_argument('--max-attempts', dest='max_attempts', type=int, default=3)
+        parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=1)
+
+    def _quiet(self, *args, **kwargs):
+        pass
+
+    def handle(self, *args, **options):
+        allow_all_hosts()
+        queue_path = os.path.abspath(os.path.expanduser(options.get('queue_path')))
+        output_dir = options.get('output_dir')
+        quiet = options.get('quiet')
+        parallel_render = options.get('parallel_render')
+        batch_size = options.get('batch_size')
+        lease_time = options.get('lease_time')
+        max_attempts = options.get('max_attempts')
+        poll_interval = options.get('poll_interval')
+        if quiet:
+            stdout = self._quiet
+        else:
+            stdout = self.stdout.write
+        if not os.path.isfile(queue_path):
+            raise CommandError('Work queue does not exist: {}'.format(queue_path))
+        work_queue = WorkQueue(queue_path, lease_time=lease_time, max_attempts=max_attempts)
+        if not output_dir:
+            output_dir = work_queue.get_meta('output_dir')
+            if not output_dir:
+                raise CommandError('The work queue has no output directory, set one '
+                                   'with --output-dir')
+        output_dir = os.path.abspath(os.path.expanduser(output_dir))
+        stdout('')
+        stdout('Rendering pages from the work queue:')
+        stdout('')
+        stdout('    Work queue:          {}'.format(queue_path))
+        stdout('    Distill output path: {}'.format(output_dir))
+        stdout('')
+        try:
+            load_urls(stdout)
+            renderer = get_renderer(urls_to_distill)
+            worker = QueueWorker(work_queue, renderer, output_dir, stdout,
+                                 parallel_render=parallel_render,
+                                 batch_size=batch_size,
+                                 poll_interval=poll_interval)
+            rendered = worker.run()
+        except DistillError as err:
+            raise CommandError(str(err)) from err
+        counts = work_queue.counts()
+        errors = work_queue.errors()
+        work_queue.close()
+        stdout('')
+        stdout('Rendered {} page(s), the work queue has {} done and {} failed '
+               'page(s).'.format(rendered, counts['done'], counts['failed']))
+        if errors:
+            shown = errors[:20]
+            err = '{} page(s) failed to render:\n{}'.format(
+                len(errors), '\n'.join('{}: {}'.format(uri, e) for uri, e in shown))
+            if len(errors) > len(shown):
+                err += '\n... and {} more'.format(len(errors) - len(shown))
+            raise CommandError(err)
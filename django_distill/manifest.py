@@ -0,0 +1,199 @@
+import json
+import os
+import time
+from hashlib import sha256
+from django_distill.errors import DistillError
+
+
+MANIFEST_NAME = '.distill-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def content_hash(content):
+    return sha256(content).hexdigest()
+
+
+class BuildManifest(object):
+    '''
+        Records every file written into an output directory by a build, keyed by
+        the path of the file relative to the output directory. Pages record their
+        URI, content hash, size and when they were rendered, static and media
+        files record their size and modification time. The manifest from the
+        previous build is used to skip writing files which have not changed and
+        to find orphaned files which are no longer part of the site. Pages can
+        also record the tables and templates they depend on, with the state of
+        each dependency at the time of the build stored in dependencies.
+    '''
+
+    def __init__(self, output_dir, path=None, files=None, dependencies=None):
+        self.output_dir = output_dir
+        self.path = path if path else os.path.join(output_dir, MANIFEST_NAME)
+        # files and dependency state recorded by the previous build
+        self.files = files if files else {}
+        self.dependencies = dependencies if dependencies else {}
+        # files and dependency state recorded by this build
+        self.new_files = {}
+        self.new_dependencies = {}
+        self._files_by_uri = None
+
+    @classmethod
+    def load(cls, output_dir, path=None):
+        manifest = cls(output_dir, path)
+        try:
+            with open(manifest.path, 'rt') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return manifest
+        except (ValueError, OSError) as e:
+            raise DistillError(f'Failed to load build manifest {manifest.path}: {e}') from e
+        if data.get('version') != MANIFEST_VERSION:
+            # an unknown manifest version is treated as no previous build
+            return manifest
+        manifest.files = data.get('files', {})
+        manifest.dependencies = data.get('dependencies', {})
+        return manifest
+
+    def save(self):
+        data = {'version': MANIFEST_VERSION, 'files': self.new_files,
+                'dependencies': self.new_dependencies}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wt') as f:
+            json.dump(data, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def local_path(self, full_path):
+        return os.path.relpath(full_path, self.output_dir).replace(os.sep, '/')
+
+    def get(self, full_path):
+        return self.files.get(self.local_path(full_path))
+
+    def get_by_uri(self, uri):
+        if self._files_by_uri is None:
+            self._files_by_uri = {entry['uri']: (local_path, entry)
+                                  for local_path, entry in self.files.items() if 'uri' in entry}
+        return self._files_by_uri.get(uri, (None, None))
+
+    def conditional_headers(self, uri):
+        '''
+            Returns the request headers, in WSGI environ form, to conditionally
+            request a page with the ETag and Last-Modified validators it was
+            served with in the previous build. Returns None if the page has no
+            validators or its file no longer exists.
+        '''
+        local_path, entry = self.get_by_uri(uri)
+        if entry is None:
+            return None
+        headers = {}
+        if entry.get('etag'):
+            headers['HTTP_IF_NONE_MATCH'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['HTTP_IF_MODIFIED_SINCE'] = entry['last_modified']
+        if not headers:
+            return None
+        if not os.path.isfile(os.path.join(self.output_dir, *local_path.split('/'))):
+            return None
+        return headers
+
+    def page_unchanged(self, full_path, digest, size):
+        previous = self.get(full_path)
+        if not previous or previous.get('hash') != digest or previous.get('size') != size:
+            return False
+        try:
+            return os.path.getsize(full_path) == size
+        except OSError:
+            return False
+
+    def record_page(self, full_path, uri, digest, size, dependencies=None, **extra):
+        entry = {'uri': uri, 'hash': digest, 'size': size, 'rendered': time.time()}
+        if dependencies is not None:
+            entry['tables'], entry['templates'] = dependencies
+        entry.update(extra)
+        self.new_files[self.local_path(full_path)] = entry
+        return entry
+
+    def keep_page(self, full_path):
+        '''
+            Records a page which was not rendered in this build, such as one
+            skipped as unchanged, with its entry from the previous build.
+        '''
+        local_path = self.local_path(full_path)
+        if local_path in self.files:
+            self.new_files[local_path] = self.files[local_path]
+
+    def render_durations(self):
+        '''
+            Returns how long each page took to render in the previous build as
+            {uri: (view_name, seconds)}.
+        '''
+        return {entry['uri']: (entry.get('view'), entry['duration'])
+                for entry in self.files.values() if 'uri' in entry and 'duration' in entry}
+
+    def stale_uris(self, get_ttl, now=None):
+        '''
+            Returns the URIs of pages rendered longer ago than their time to live,
+            get_ttl is called with the name of the view of each page and returns
+            its time to live in seconds, or None if it never goes stale.
+        '''
+        now = time.time() if now is None else now
+        ttls = {}
+        uris = set()
+        for entry in self.files.values():
+            if 'uri' not in entry:
+                continue
+            view_name = entry.get('view')
+            if view_name not in ttls:
+                ttls[view_name] = get_ttl(view_name)
+            ttl = ttls[view_name]
+            if ttl is not None and now - entry.get('rendered', 0) > ttl:
+                uris.add(entry['uri'])
+        return uris
+
+    def static_unchanged(self, from_path, to_path):
+        try:
+            from_stat, to_stat = os.stat(from_path), os.stat(to_path)
+        except OSError:
+            return False
+        return (from_stat.st_size == to_stat.st_size and
+                int(from_stat.st_mtime) == int(to_stat.st_mtime))
+
+    def record_static(self, to_path):
+        to_stat = os.stat(to_path)
+        self.new_files[self.local_path(to_path)] = {'size': to_stat.st_size,
+                                                    'mtime': int(to_stat.st_mtime)}
+
+    def keep_static(self):
+        '''
+            Records the static and media files from the previous build, used when
+            static files are not copied so they are not removed as orphans.
+        '''
+        for local_path, entry in self.files.items():
+            if 'uri' not in entry:
+                self.new_files.setdefault(local_path, entry)
+
+    def keep_unvisited(self):
+        '''
+            Records every file from the previous build which was not recorded by
+            this build, used when only part of the site was built.
+        '''
+        for local_path, entry in self.files.items():
+            self.new_files.setdefault(local_path, entry)
+
+    def orphans(self):
+        for local_path in self.files:
+            if local_path not in self.new_files:
+                yield os.path.join(self.output_dir, *local_path.split('/'))
+
+    def remove_orphans(self, stdout):
+        for full_path in self.orphans():
+            if not os.path.isfile(full_path):
+                continue
+            stdout('Removing orphaned file: {}'.format(full_path))
+            os.unlink(full_path)
+            # tidy up any directories left empty
+            dirname = os.path.dirname(full_path)
+            while dirname != self.output_dir and dirname.startswith(self.output_dir):
+                try:
+                    os.rmdir(dirname)
+                except OSError:
+                    break
+                dirname = os.path.dirname(dirname)
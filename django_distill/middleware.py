@@ -0,0 +1,228 @@
+import json
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse
+from django.urls import resolve
+from django.urls.exceptions import Resolver404
+from django_distill.errors import DistillError
+from django_distill.normalize import load_normalizers, normalize_content
+from django_distill.renderer import get_renderer, get_filepath, write_file
+
+
+CONTENT_TYPES_NAME = '.distill-content-types.json'
+
+
+class DistillISRMiddleware(object):
+    '''
+        Incremental static regeneration. Serves pages of distill_url() views
+        from the distill output directory when they have already been rendered.
+        Pages which have not been rendered yet are rendered on demand with the
+        distill renderer, written into the output directory and served. Pages
+        older than settings.DISTILL_ISR_TTL seconds are served as they are while
+        they are rendered again in the background. Other requests are handled
+        by Django as normal. The Content-Type each page was rendered with is
+        kept in a CONTENT_TYPES_NAME file in the output directory so it is
+        served with the same Content-Type from the file.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        output_dir = getattr(settings, 'DISTILL_ISR_DIR', None)
+        if not output_dir:
+            output_dir = getattr(settings, 'DISTILL_DIR', None)
+        if not output_dir:
+            raise MiddlewareNotUsed('No DISTILL_ISR_DIR or DISTILL_DIR set')
+        self.output_dir = os.path.abspath(os.path.expanduser(str(output_dir)))
+        self.real_output_dir = os.path.realpath(self.output_dir)
+        self.content_types_path = os.path.join(self.output_dir, CONTENT_TYPES_NAME)
+        self.ttl = getattr(settings, 'DISTILL_ISR_TTL', None)
+        self.executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'DISTILL_ISR_WORKERS', 1))
+        self._renderer = None
+        self._normalizers = None
+        self._content_types = {}
+        self._content_types_mtime = None
+        self._regenerating = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        if (getattr(request, 'distill_render', False) or
+                request.method not in ('GET', 'HEAD') or request.GET):
+            return self.get_response(request)
+        page = self.get_page(request)
+        if page is None:
+            return self.get_response(request)
+        full_path = page[-1]
+        try:
+            age = time.time() - os.path.getmtime(full_path)
+        except OSError:
+            age = None
+        if age is None:
+            # not rendered yet, render it now
+            try:
+                response = self.render_page(*page)
+            except DistillError:
+                return self.get_response(request)
+            if response.status_code != 200:
+                # only pages which were written are served from the renderer
+                return self.get_response(request)
+            return response
+        if self.is_stale(page[0], age):
+            self.regenerate(page)
+        return self.serve_file(full_path)
+
+    def get_view_details(self, match):
+        '''
+            Returns the registered distill URL for the URL pattern a request
+            resolved to, several patterns may be registered with the same name.
+        '''
+        urls_to_distill = self.get_renderer().urls_to_distill
+        tried = getattr(match, 'tried', None)
+        if not tried:
+            # older versions of Django do not record the pattern which matched
+            return self.get_renderer().get_view_details(match.view_name)
+        pattern = tried[-1][-1]
+        if hasattr(urls_to_distill, 'by_url'):
+            return urls_to_distill.by_url.get(pattern)
+        for view_details in urls_to_distill:
+            if view_details[0] is pattern:
+                return view_details
+        return None
+
+    def is_output_path(self, full_path):
+        '''
+            Returns True if full_path, with any ".." or symlinks resolved, is
+            inside the output directory. URIs and distill_file names are built
+            from the request path so they must not be able to escape it.
+        '''
+        real_path = os.path.realpath(full_path)
+        if real_path in (self.real_output_dir, os.path.realpath(self.content_types_path)):
+            return False
+        return os.path.commonpath([self.real_output_dir, real_path]) == self.real_output_dir
+
+    def get_renderer(self):
+        if self._renderer is None:
+            from django_distill.distill import urls_to_distill
+            self._renderer = get_renderer(urls_to_distill)
+            self._normalizers = load_normalizers()
+        return self._renderer
+
+    def get_page(self, request):
+        '''
+            Returns the registered distill URL, URI, parameters and output file
+            path for a request, or None if it is not for a distilled page.
+        '''
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        if not match.url_name:
+            return None
+        renderer = self.get_renderer()
+        view_details = self.get_view_details(match)
+        if not view_details:
+            return None
+        uri = request.path
+        param_set = match.kwargs if match.kwargs else tuple(match.args)
+        file_name = renderer._get_filename(view_details[2], uri, param_set)
+        full_path, local_uri = get_filepath(self.output_dir, file_name, uri)
+        if not self.is_output_path(full_path):
+            return None
+        return view_details, uri, param_set, full_path
+
+    def get_ttl(self, view_details):
+        urls_to_distill = self.get_renderer().urls_to_distill
+        revalidate = None
+        if hasattr(urls_to_distill, 'get_revalidate'):
+            revalidate = urls_to_distill.get_revalidate(view_details)
+        return revalidate if revalidate is not None else self.ttl
+
+    def is_stale(self, view_details, age):
+        ttl = self.get_ttl(view_details)
+        return ttl is not None and age > ttl
+
+    def render_page(self, view_details, uri, param_set, full_path):
+        '''
+            Renders a page, writes it into the output directory if it rendered
+            successfully and returns the response.
+        '''
+        renderer = self.get_renderer()
+        url, distill_func, file_name, status_codes, view_name, args, kwargs = view_details
+        response = renderer.render_view(uri, status_codes, param_set, args, kwargs)
+        if response.status_code == 200:
+            content = normalize_content(response.content, response.get('Content-Type'),
+                                        response.charset, self._normalizers)
+            # write to a temporary file first so a partly written page is never served
+            tmp_path = '{}.{}.tmp'.format(full_path, threading.get_ident())
+            write_file(tmp_path, content)
+            os.replace(tmp_path, full_path)
+            self.set_content_type(full_path, response.get('Content-Type'))
+        return response
+
+    def load_content_types(self):
+        # other server processes may have written pages since it was loaded
+        try:
+            mtime = os.stat(self.content_types_path).st_mtime_ns
+        except OSError:
+            return self._content_types
+        if mtime != self._content_types_mtime:
+            try:
+                with open(self.content_types_path, 'rt') as f:
+                    self._content_types = json.load(f)
+            except (OSError, ValueError):
+                pass
+            self._content_types_mtime = mtime
+        return self._content_types
+
+    def set_content_type(self, full_path, content_type):
+        local_path = os.path.relpath(full_path, self.output_dir).replace(os.sep, '/')
+        with self._lock:
+            content_types = self.load_content_types()
+            if not content_type or content_types.get(local_path) == content_type:
+                return
+            content_types[local_path] = content_type
+            tmp_path = '{}.{}.tmp'.format(self.content_types_path, threading.get_ident())
+            with open(tmp_path, 'wt') as f:
+                json.dump(content_types, f, sort_keys=True)
+            os.replace(tmp_path, self.content_types_path)
+
+    def get_content_type(self, full_path):
+        local_path = os.path.relpath(full_path, self.output_dir).replace(os.sep, '/')
+        with self._lock:
+            content_type = self.load_content_types().get(local_path)
+        if content_type:
+            return content_type
+        content_type, encoding = mimetypes.guess_type(full_path)
+        if not content_type:
+            # pages are written without a file extension
+            content_type = 'text/html; charset=utf-8'
+        return content_type
+
+    def regenerate(self, page):
+        full_path = page[-1]
+        with self._lock:
+            if full_path in self._regenerating:
+                return
+            self._regenerating.add(full_path)
+        self.executor.submit(self._regenerate, page)
+
+    def _regenerate(self, page):
+        try:
+            self.render_page(*page)
+        except DistillError:
+            # keep serving the stale page
+            pass
+        finally:
+            connections.close_all()
+            with self._lock:
+                self._regenerating.discard(page[-1])
+
+    def serve_file(self, full_path):
+        return FileResponse(open(full_path, 'rb'),
+                            content_type=self.get_content_type(full_path))
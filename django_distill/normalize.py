@@ -0,0 +1,85 @@
+import re
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django_distill.errors import DistillError
+
+
+CSRF_TOKEN_INPUT = re.compile(
+    r'<input\b[^>]*\bname\s*=\s*["\']csrfmiddlewaretoken["\'][^>]*>', re.IGNORECASE)
+VOLATILE_REGION = re.compile(
+    r'<!--\s*distill:volatile\s*-->.*?<!--\s*/distill:volatile\s*-->', re.DOTALL)
+TEXT_CONTENT_TYPES = ('application/json', 'application/javascript',
+                      'application/xml', 'application/xhtml+xml', 'application/rss+xml',
+                      'application/atom+xml')
+
+
+def strip_csrf_tokens(text):
+    '''
+        Removes hidden csrfmiddlewaretoken form inputs, the token is different
+        for every render and is of no use on a static site.
+    '''
+    return CSRF_TOKEN_INPUT.sub('', text)
+
+
+def strip_volatile_regions(text):
+    '''
+        Removes regions a template has marked as not part of the content of the
+        page, anything between <!-- distill:volatile --> and
+        <!-- /distill:volatile --> including the markers.
+    '''
+    return VOLATILE_REGION.sub('', text)
+
+
+def substitute(pattern, replacement, flags=0):
+    '''
+        Returns a rule which replaces every match of the regular expression
+        pattern with replacement, for example to pin a build timestamp.
+    '''
+    regex = re.compile(pattern, flags)
+    def _substitute(text):
+        return regex.sub(replacement, text)
+    return _substitute
+
+
+def load_normalizers():
+    '''
+        Returns the normalisation rules listed in settings.DISTILL_NORMALIZE,
+        each either a callable or the import path of one. Rules are called with
+        the text of a page and return the normalised text.
+    '''
+    normalizers = []
+    for rule in getattr(settings, 'DISTILL_NORMALIZE', ()):
+        if isinstance(rule, str):
+            try:
+                rule = import_string(rule)
+            except ImportError as e:
+                raise DistillError(f'Failed to import normalisation rule: {e}') from e
+        if not callable(rule):
+            raise DistillError(f'Normalisation rule is not callable: {rule!r}')
+        normalizers.append(rule)
+    return normalizers
+
+
+def is_text_content(content_type):
+    if not content_type:
+        return False
+    mime = content_type.split(';', 1)[0].strip().lower()
+    return mime.startswith('text/') or mime in TEXT_CONTENT_TYPES
+
+
+def normalize_content(content, content_type, charset, normalizers):
+    '''
+        Applies normalizers to the content of a text page so volatile content
+        which changes on every render does not change the written file. Other
+        content is returned unchanged.
+    '''
+    if not normalizers or not is_text_content(content_type):
+        return content
+    charset = charset or 'utf-8'
+    try:
+        text = content.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        return content
+    for rule in normalizers:
+        text = rule(text)
+    return text.encode(charset)
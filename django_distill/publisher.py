@@ -2,7 +2,8 @@ from concurrent.futures import ThreadPoolExecutor
 from django_distill.errors import DistillPublishError
 
 
-def publish_dir(backend, stdout, verify=True, parallel_publish=1, ignore_remote_content=False):
+def publish_dir(backend, stdout, verify=True, parallel_publish=1, ignore_remote_content=False,
+                delete_orphans=True):
     stdout('Authenticating')
     backend.authenticate()
     stdout('Getting file indexes')
@@ -25,9 +26,9 @@ def publish_dir(backend, stdout, verify=True, parallel_publish=1, ignore_remote_
                 to_upload.add(f)
             else:
                 stdout(f'File fresh: {remote_f}')
-    # check for remote files to delete
+    # check for remote files to delete, unless only part of the site was built
     for f in remote_files:
-        if f not in local_files_r:
+        if delete_orphans and f not in local_files_r:
             to_delete.add(f)
     with ThreadPoolExecutor(max_workers=parallel_publish) as executor:
         # upload any new or changed files
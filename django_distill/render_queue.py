@@ -0,0 +1,204 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import connections, transaction
+from django_distill.normalize import load_normalizers, normalize_content
+from django_distill.renderer import get_renderer, get_filepath, load_urls, write_file
+
+
+logger = logging.getLogger(__name__)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class QueuedPage(object):
+
+    __slots__ = ('view_name', 'args', 'kwargs', 'status_codes', 'first_queued', 'due')
+
+    def __init__(self, view_name, args, kwargs, status_codes, first_queued, due):
+        self.view_name = view_name
+        self.args = args
+        self.kwargs = kwargs
+        self.status_codes = status_codes
+        self.first_queued = first_queued
+        self.due = due
+
+
+class RenderQueue(object):
+    '''
+        Renders single files into an output directory in a background thread.
+        Requests for the same page are merged and a page is only rendered once
+        no request for it has arrived for delay seconds, or max_delay seconds
+        after it was first requested. Due pages are rendered in batches of up
+        to batch_size with one renderer which is kept loaded between batches.
+    '''
+
+    def __init__(self, output_dir, delay=2, max_delay=30, batch_size=100):
+        self.output_dir = output_dir
+        self.delay = delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self._pending = {}
+        self._rendering = 0
+        self._flushing = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._renderer = None
+        self._normalizers = ()
+
+    def add(self, view_name, args=(), kwargs=None, status_codes=None):
+        view_name = str(view_name)
+        args = tuple(args)
+        kwargs = dict(kwargs or {})
+        status_codes = tuple(status_codes or (200,))
+        key = (view_name, args, tuple(sorted(kwargs.items())), status_codes)
+        now = time.monotonic()
+        with self._condition:
+            page = self._pending.get(key)
+            if page is None:
+                self._pending[key] = QueuedPage(view_name, args, kwargs, status_codes,
+                                                now, now + self.delay)
+            else:
+                page.due = min(now + self.delay, page.first_queued + self.max_delay)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='distill-render-queue')
+                self._thread.start()
+            self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending) + self._rendering
+
+    def flush(self, timeout=None):
+        '''
+            Renders every queued page without waiting for it to be due and blocks
+            until they have all been rendered. Returns False on a timeout.
+        '''
+        with self._condition:
+            self._flushing += 1
+            self._condition.notify_all()
+            try:
+                return self._condition.wait_for(
+                    lambda: not self._pending and not self._rendering, timeout)
+            finally:
+                self._flushing -= 1
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                due = sorted((page.due, key) for key, page in self._pending.items()
+                             if self._flushing or page.due <= now)
+                if due:
+                    batch = [self._pending.pop(key) for _, key in due[:self.batch_size]]
+                    self._rendering = len(batch)
+                    return batch
+                timeout = None
+                if self._pending:
+                    timeout = min(page.due for page in self._pending.values()) - now
+                self._condition.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.render_batch(batch)
+            finally:
+                with self._condition:
+                    self._rendering = 0
+                    self._condition.notify_all()
+
+    def get_renderer(self):
+        if self._renderer is None:
+            from django_distill.distill import urls_to_distill
+            load_urls()
+            self._renderer = get_renderer(urls_to_distill)
+            self._normalizers = load_normalizers()
+        return self._renderer
+
+    def render_batch(self, batch):
+        try:
+            renderer = self.get_renderer()
+            for page in batch:
+                try:
+                    self.render_page(renderer, page)
+                except Exception:
+                    # one broken page must not stop the queue
+                    logger.exception('Failed to render queued page %r args=%r kwargs=%r',
+                                     page.view_name, page.args, page.kwargs)
+        except Exception:
+            # nor must a renderer which fails to load, later batches try again
+            logger.exception('Failed to render a batch of %d queued page(s)', len(batch))
+        finally:
+            connections.close_all()
+
+    def render_page(self, renderer, page):
+        page_uri, file_name, http_response = renderer.render(
+            page.view_name, page.status_codes, page.args, page.kwargs)
+        full_path, local_uri = get_filepath(self.output_dir, file_name, page_uri)
+        content = normalize_content(http_response.content, http_response.get('Content-Type'),
+                                    http_response.charset, self._normalizers)
+        write_file(full_path, content)
+
+
+def get_render_queue(output_dir):
+    '''
+        Returns the render queue for an output directory, one is shared by every
+        caller in the process and is flushed when the process exits.
+    '''
+    output_dir = os.path.abspath(os.path.expanduser(str(output_dir)))
+    with _queues_lock:
+        render_queue = _queues.get(output_dir)
+        if render_queue is None:
+            render_queue = RenderQueue(
+                output_dir,
+                delay=getattr(settings, 'DISTILL_QUEUE_DELAY', 2),
+                max_delay=getattr(settings, 'DISTILL_QUEUE_MAX_DELAY', 30),
+                batch_size=getattr(settings, 'DISTILL_QUEUE_BATCH_SIZE', 100))
+            _queues[output_dir] = render_queue
+    return render_queue
+
+
+def flush_render_queues(timeout=None):
+    '''
+        Flushes every render queue in the process, waiting at most timeout
+        seconds for all of them. Returns False on a timeout.
+    '''
+    with _queues_lock:
+        render_queues = list(_queues.values())
+    deadline = None if timeout is None else time.monotonic() + timeout
+    flushed = True
+    for render_queue in render_queues:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        flushed = render_queue.flush(remaining) and flushed
+    return flushed
+
+
+def _flush_render_queues_at_exit():
+    # a page which hangs must not stop the process from exiting
+    timeout = getattr(settings, 'DISTILL_QUEUE_EXIT_TIMEOUT', 30)
+    if not flush_render_queues(timeout):
+        logger.warning('Gave up waiting for queued pages to render after %s seconds',
+                       timeout)
+
+
+atexit.register(_flush_render_queues_at_exit)
+
+
+def queue_single_file(output_dir, view_name, *args, **kwargs):
+    '''
+        Queues a single file to be written by render_single_file() in the
+        background. Takes the same arguments. The page is queued once the current
+        database transaction commits so it is rendered with the saved data.
+    '''
+    status_codes = kwargs.pop('status_codes', None)
+    render_queue = get_render_queue(output_dir)
+    transaction.on_commit(
+        lambda: render_queue.add(view_name, args, kwargs, status_codes))
+    return render_queue
@@ -1,40 +1,61 @@
+import asyncio
 import errno
 import inspect
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
+import re
+import sys
 import types
+from collections import deque
+from contextlib import contextmanager, ExitStack
+from fnmatch import translate as glob_to_regex
+from itertools import islice
 from shutil import copy2
-from concurrent.futures import ThreadPoolExecutor
-from django.utils.translation import activate as activate_lang
+from urllib.parse import urlsplit
+from concurrent.futures import (Future, ThreadPoolExecutor, wait, FIRST_COMPLETED,
+                                TimeoutError as FutureTimeoutError)
+from django.utils.translation import activate as activate_lang, get_language, override
 from django.conf import settings, global_settings
 from django.urls import include as include_urls, get_resolver
 from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
 from django.utils.module_loading import import_string
 from django.test import RequestFactory
 from django.test.client import ClientHandler
-from django.urls import reverse, ResolverMatch
-from django.urls.exceptions import NoReverseMatch
+from django.urls import reverse, resolve, ResolverMatch
+from django.urls.exceptions import NoReverseMatch, Resolver404
 from django.core.management import call_command
+from django.db import connections
+from django.http import HttpResponse
 from django_distill.errors import DistillError
+from django_distill.urlbuilder import get_url_builders
+from django_distill.manifest import content_hash
+from django_distill.dependencies import record_dependencies
+from django_distill.normalize import load_normalizers, normalize_content
+from django_distill.shards import uri_shard
 
 
 logger = logging.getLogger(__name__)
 urlconf = get_resolver()
+RENDER_ENGINES = ('thread', 'process', 'async')
+SCHEDULES = ('registration', 'longest-first')
+# The renderer inherited by forked render processes, see DistillRender._map_processes()
+_process_renderer = None
 
 
-def iter_resolved_urls(url_patterns, namespace_path=[]):
-    url_patterns_resolved = []
+def iter_resolved_urls(url_patterns, namespace_path=()):
     for entry in url_patterns:
         if hasattr(entry, 'url_patterns'):
             if getattr(entry, 'namespace', None) is not None:
-                url_patterns_resolved += iter_resolved_urls(
-                    entry.url_patterns, namespace_path + [entry.namespace])
+                yield from iter_resolved_urls(entry.url_patterns,
+                                              namespace_path + (entry.namespace,))
             else:
-                url_patterns_resolved += iter_resolved_urls(
-                    entry.url_patterns, namespace_path)
+                yield from iter_resolved_urls(entry.url_patterns, namespace_path)
         else:
-            url_patterns_resolved.append((namespace_path, entry))
-    return url_patterns_resolved
+            yield namespace_path, entry
 
 
 def load_namespace_map():
@@ -52,6 +73,20 @@ def load_namespace_map():
     return namespace_map
 
 
+_namespace_map = None
+
+
+def get_namespace_map():
+    '''
+        Returns the namespace map for the project URLs. The URLs do not change once
+        loaded so the map is only built once per process.
+    '''
+    global _namespace_map
+    if _namespace_map is None:
+        _namespace_map = load_namespace_map()
+    return _namespace_map
+
+
 class DistillHandler(ClientHandler):
     '''
         Overload ClientHandler's resolve_request(...) to return the already known
@@ -74,12 +109,16 @@ class DistillHandler(ClientHandler):
         self.view_args = view_args
 
     def resolve_request(self, request):
-        for arg in self.view_args:
-            self.view_uri_kwargs.update(**arg)
+        # Requests rendered concurrently by the async engine carry their own view
+        view_func, view_uri_args, view_uri_kwargs, view_args = getattr(
+            request, 'distill_view',
+            (self.view_func, self.view_uri_args, self.view_uri_kwargs, self.view_args))
+        for arg in view_args:
+            view_uri_kwargs.update(**arg)
         request.resolver_match = ResolverMatch(
-            self.view_func,
-            self.view_uri_args,
-            self.view_uri_kwargs,
+            view_func,
+            view_uri_args,
+            view_uri_kwargs,
         )
         return request.resolver_match
 
@@ -152,25 +191,215 @@ class DistillHandler(ClientHandler):
         self._middleware_chain = handler
 
 
+class RenderView(object):
+    '''
+        The details shared by every page rendered for one registered URL. Render
+        tasks point at a RenderView rather than copying the URL details.
+    '''
+
+    __slots__ = ('index', 'url', 'distill_func', 'file_name', 'status_codes',
+                 'view_name', 'args', 'kwargs', 'i18n', 'timeout', 'max_concurrency')
+
+    def __init__(self, index, view_details, i18n, timeout=None, max_concurrency=None):
+        self.index = index
+        (self.url, self.distill_func, self.file_name, self.status_codes,
+         self.view_name, self.args, self.kwargs) = view_details
+        self.i18n = i18n
+        # seconds a page may take to render and how many pages may render at once
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+
+
+class ViewLimits(object):
+    '''
+        Counts the pages of each view being rendered against the max_concurrency
+        of their view. A page which times out stops counting when its timeout
+        fires, even though its abandoned render may still be running, so a
+        render which never returns cannot hold its view's slot forever.
+    '''
+
+    def __init__(self):
+        self._running = {}
+        self._condition = threading.Condition()
+
+    def available(self, view):
+        if not view.max_concurrency:
+            return True
+        with self._condition:
+            running = self._running.get(view.index, 0)
+        return running < view.max_concurrency
+
+    def start(self, view):
+        with self._condition:
+            self._running[view.index] = self._running.get(view.index, 0) + 1
+
+    def finish(self, view):
+        with self._condition:
+            self._running[view.index] -= 1
+            self._condition.notify_all()
+
+    def wait(self, predicate, timeout=0.1):
+        '''
+            Waits until a render finishes and predicate returns True, or for at
+            most timeout seconds.
+        '''
+        with self._condition:
+            self._condition.wait_for(predicate, timeout)
+
+    @contextmanager
+    def slot(self, view):
+        '''
+            Blocks until a page of view may be rendered, for callers rendering
+            tasks themselves rather than through a renderer's scheduler.
+        '''
+        with self._condition:
+            while not self.available(view):
+                self._condition.wait(0.1)
+            self.start(view)
+        try:
+            yield
+        finally:
+            self.finish(view)
+
+
+class TimeoutHelper(object):
+    '''
+        A daemon thread which renders pages with a timeout for one render worker.
+        Python threads cannot be stopped so a render which hangs is abandoned
+        along with its helper and the worker starts a new helper. A stopped
+        helper finishes its current render, closes its database connections
+        and exits.
+    '''
+
+    def __init__(self):
+        self.jobs = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, daemon=True,
+                                       name='distill-timeout-helper')
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    return
+                func, args, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(func(*args))
+                except BaseException as err:
+                    future.set_exception(err)
+        finally:
+            connections.close_all()
+
+    def submit(self, func, *args):
+        future = Future()
+        self.jobs.put((func, args, future))
+        return future
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+class RenderTask(object):
+    '''
+        A single page to render, a RenderView and one set of parameters for it.
+    '''
+
+    __slots__ = ('view', 'param_set', 'lang', 'do_render', 'uri')
+
+    def __init__(self, view, param_set, lang, do_render=True, uri=None):
+        self.view = view
+        self.param_set = param_set
+        self.lang = lang
+        self.do_render = do_render
+        # set if the URI was already generated when the task was created
+        self.uri = uri
+
+
 class DistillRender(object):
     '''
         Renders a complete static site from all urls registered with
         distill_url() and then copies over all static media.
     '''
 
-    def __init__(self, urls_to_distill, parallel_render=1):
+    def __init__(self, urls_to_distill, parallel_render=1, render_engine='thread',
+                 max_tasks_per_worker=None, queue_size=None, ordered=True,
+                 continue_on_error=False, canary=False, track_dependencies=False,
+                 uri_filter=None, conditional_headers=None, only_views=None,
+                 only_urls=None, only_url_globs=None, shard=None, schedule='registration',
+                 durations=None, concurrency=None):
+        if render_engine not in RENDER_ENGINES:
+            raise DistillError(f'Invalid render engine: {render_engine} (expected one '
+                               f'of {RENDER_ENGINES})')
+        if schedule not in SCHEDULES:
+            raise DistillError(f'Invalid schedule: {schedule} (expected one of {SCHEDULES})')
+        if concurrency is not None and render_engine != 'thread':
+            raise DistillError('Adaptive render concurrency requires the thread render engine')
+        if track_dependencies and render_engine == 'async':
+            # queries run in sync_to_async threads outside of the recorded connections
+            raise DistillError('Dependency tracking is not supported by the async '
+                               'render engine')
         self.urls_to_distill = urls_to_distill
         self.parallel_render = parallel_render
-        self.namespace_map = load_namespace_map()
-        # set allowed hosts to '*', static rendering shouldn't care about the hostname
-        settings.ALLOWED_HOSTS = ['*']
+        self.render_engine = render_engine
+        self.max_tasks_per_worker = max_tasks_per_worker
+        # maximum number of tasks submitted to the render workers at once, this
+        # includes rendered tasks waiting to be consumed
+        self.queue_size = queue_size if queue_size else max(parallel_render * 4, 1)
+        # yield results in submission order, or as soon as each one completes
+        self.ordered = ordered
+        # collect render errors and raise them once all pages are rendered rather
+        # than cancelling all pending work on the first error
+        self.continue_on_error = continue_on_error
+        self.errors = []
+        # render the first page of every view one at a time before rendering
+        # everything else in parallel
+        self.canary = canary
+        # record the tables and templates each page depends on, see
+        # django_distill.dependencies
+        self.track_dependencies = track_dependencies
+        # pages whose URI this returns False for are not rendered and are
+        # yielded with a response of None
+        self.uri_filter = uri_filter
+        # returns extra request headers for a URI, used to send If-None-Match and
+        # If-Modified-Since headers with the validators from a previous build
+        self.conditional_headers = conditional_headers
+        self.select(only_views, only_urls, only_url_globs)
+        # only render the pages whose URIs hash to this (index, count) shard
+        self.shard = shard
+        # the order tasks are rendered in, and the {uri: (view_name, seconds)}
+        # render durations from a previous build used to estimate them
+        self.schedule = schedule
+        self.durations = durations
+        # an AdaptiveConcurrency limiting how many of the parallel_render threads
+        # render at once, see django_distill.concurrency
+        self.concurrency = concurrency
+        # a ThreadPoolExecutor kept between renders by long running callers, such
+        # as distill-watch, so the render threads keep their handlers
+        self.executor = None
+        self.namespace_map = get_namespace_map()
+        self.url_builders = get_url_builders()
+        if hasattr(self.urls_to_distill, 'index_namespaces'):
+            self.urls_to_distill.index_namespaces(self.namespace_map)
+        self._render_views = []
+        # each render worker thread owns one handler and request factory, see
+        # get_handler(), and one TimeoutHelper
+        self._local = threading.local()
+        self._timeout_helpers = []
+        self._timeout_helpers_lock = threading.Lock()
 
-    def render_file(self, view_name, status_codes, view_args, view_kwargs):
-        view_details = []
+    def get_view_details(self, view_name):
+        if hasattr(self.urls_to_distill, 'by_name'):
+            return self.urls_to_distill.get(view_name)
         for params in self.urls_to_distill:
             if view_name == params[4]:
-                view_details = params
-                break
+                return params
+        return None
+
+    def render_file(self, view_name, status_codes, view_args, view_kwargs):
+        view_details = self.get_view_details(view_name)
         if not view_details:
             raise DistillError(f'No view exists with the name: {view_name}')
         url, distill_func, file_name, status_codes, view_name, a, k = view_details
@@ -184,35 +413,479 @@ class DistillRender(object):
         file_name = self._get_filename(file_name, uri, args)
         return uri, file_name, render
 
+    def render_task(self, task):
+        view = task.view
+        # workers are fed tasks grouped by language so this rarely changes
+        if get_language() != task.lang:
+            activate_lang(task.lang)
+        uri = task.uri or self.generate_uri(view.url, view.view_name, task.param_set)
+        if task.do_render and self.should_render(uri):
+            with ExitStack() as stack:
+                if self.concurrency is not None:
+                    stack.enter_context(self.concurrency.slot())
+                started = time.perf_counter()
+                if view.timeout:
+                    render = self.render_view_with_timeout(uri, view, task)
+                else:
+                    render = self.render_view(uri, view.status_codes, task.param_set,
+                                              view.args, view.kwargs)
+                render.distill_duration = time.perf_counter() - started
+            render.distill_lang = task.lang
+            render.distill_view = view.view_name
+        else:
+            render = None
+        file_name = self._get_filename(view.file_name, uri, task.param_set)
+        return uri, file_name, render
+
+    def render_view_with_timeout(self, uri, view, task):
+        '''
+            Renders a page in this worker's TimeoutHelper and raises a DistillError
+            if it does not finish within its view's timeout.
+        '''
+        helper = getattr(self._local, 'timeout_helper', None)
+        if helper is None:
+            helper = TimeoutHelper()
+            self._local.timeout_helper = helper
+            with self._timeout_helpers_lock:
+                self._timeout_helpers.append(helper)
+        future = helper.submit(self._render_view_in_lang, task.lang, uri, view.status_codes,
+                               task.param_set, view.args, view.kwargs)
+        try:
+            return future.result(view.timeout)
+        except FutureTimeoutError:
+            # the helper is still stuck rendering the page, it exits once it is done
+            self._local.timeout_helper = None
+            helper.stop()
+            raise DistillError(f'Rendering "{uri}" timed out after {view.timeout} seconds')
+
+    def stop_timeout_helpers(self):
+        with self._timeout_helpers_lock:
+            helpers, self._timeout_helpers = self._timeout_helpers, []
+        for helper in helpers:
+            helper.stop()
+
+    def _render_view_in_lang(self, lang, *args):
+        if get_language() != lang:
+            activate_lang(lang)
+        return self.render_view(*args)
+
+    def select(self, only_views=None, only_urls=None, only_url_globs=None):
+        '''
+            Only render the views with these names and the pages with these URIs
+            or URIs matching these glob patterns, anything else is never rendered
+            or yielded. Can be changed between renders.
+        '''
+        self.only_views = list(only_views) if only_views else None
+        self.only_urls = set(only_urls) if only_urls is not None else None
+        self.only_url_globs = list(only_url_globs) if only_url_globs else None
+        self._only_url_regex = None
+        if self.only_url_globs:
+            self._only_url_regex = re.compile(
+                '|'.join(glob_to_regex(g) for g in self.only_url_globs))
+
+    def should_render(self, uri):
+        return self.uri_filter is None or self.uri_filter(uri)
+
+    def is_selective(self):
+        return (self.only_views is not None or self.only_urls is not None or
+                self.only_url_globs is not None)
+
+    def is_selected_uri(self, uri):
+        if self.shard is not None and uri_shard(uri, self.shard[1]) != self.shard[0]:
+            return False
+        if self.only_urls is None and self._only_url_regex is None:
+            return True
+        if self.only_urls is not None and uri in self.only_urls:
+            return True
+        return self._only_url_regex is not None and bool(self._only_url_regex.match(uri))
+
+    def get_selected_views(self):
+        '''
+            Returns the indexes of the views selected with only_views, or which
+            the URIs in only_urls resolve to, or None if every view is selected.
+            Views which are not selected never have their distill_func called.
+        '''
+        selected = None
+        if self.only_views is not None:
+            selected = set()
+            for view_name in self.only_views:
+                # every URL registered with the name is selected, not just the
+                # first, as the manifest only records view names
+                matches = set(i for i, d in enumerate(self.urls_to_distill)
+                              if view_name in self._view_names(d))
+                if not matches:
+                    raise DistillError(f'No view exists with the name: {view_name}')
+                selected.update(matches)
+        if self.only_urls is not None and self.only_url_globs is None:
+            resolved = self._resolve_views(self.only_urls)
+            if resolved is not None:
+                selected = resolved if selected is None else selected & resolved
+        return selected
+
+    def _view_names(self, view_details):
+        url, view_name = view_details[0], view_details[4]
+        namespace = self.namespace_map.get(url)
+        if namespace:
+            return (view_name, f'{namespace}:{view_name}')
+        return (view_name,)
+
+    def _resolve_views(self, uris):
+        '''
+            Returns the indexes of every view sharing a name with a view the URIs
+            resolve to, or None if any URI cannot be resolved.
+        '''
+        names = set()
+        for uri in uris:
+            match = self._resolve(uri)
+            if match is None or not match.url_name:
+                return None
+            names.add(match.url_name)
+        return set(i for i, d in enumerate(self.urls_to_distill) if d[4] in names)
+
+    def _resolve(self, uri):
+        try:
+            return resolve(uri)
+        except Resolver404:
+            pass
+        # language prefixed URIs only resolve with their language active
+        for lang in self.get_langs():
+            with override(lang):
+                try:
+                    return resolve(uri)
+                except Resolver404:
+                    pass
+        return None
+
+    def is_i18n_url(self, url):
+        '''
+            Returns True if the URL is language prefixed with i18n_patterns(...)
+            and so needs rendering once per language. URLs which cannot be
+            checked are assumed to be prefixed.
+        '''
+        url_builder = self.url_builders.get(url)
+        return url_builder.i18n if url_builder is not None else True
+
+    def get_render_views(self):
+        '''
+            Returns a RenderView for every registered URL, built once and then
+            shared by every task rendered for that URL.
+        '''
+        if len(self._render_views) != len(self.urls_to_distill):
+            get_timeout = getattr(self.urls_to_distill, 'get_timeout', lambda entry: None)
+            get_max_concurrency = getattr(self.urls_to_distill, 'get_max_concurrency',
+                                          lambda entry: None)
+            self._render_views = [
+                RenderView(view_index, view_details, self.is_i18n_url(view_details[0]),
+                           get_timeout(view_details), get_max_concurrency(view_details))
+                for view_index, view_details in enumerate(self.urls_to_distill)]
+        return self._render_views
+
+    def iter_render_tasks(self, do_render=True):
+        '''
+            Lazily yields the tasks to render. distill_func generators are only
+            consumed as the render workers need more work. Language prefixed
+            URLs are yielded once per language in chunks of queue_size tasks per
+            language, other URLs are only rendered once in the default language.
+        '''
+        tasks = self._iter_view_tasks(do_render)
+        if (self.only_urls is not None or self.only_url_globs is not None or
+                self.shard is not None):
+            tasks = self._iter_selected_tasks(tasks)
+        if self.schedule == 'longest-first' and do_render:
+            tasks = self._schedule_longest_first(tasks)
+        return tasks
+
+    def _iter_view_tasks(self, do_render):
+        langs = self.get_langs()
+        default_lang = str(getattr(settings, 'LANGUAGE_CODE', 'en'))
+        selected_views = self.get_selected_views() if self.is_selective() else None
+        for view in self.get_render_views():
+            if selected_views is not None and view.index not in selected_views:
+                continue
+            param_sets = self._iter_param_sets(view.distill_func, view.view_name)
+            if not view.i18n:
+                for param_set in param_sets:
+                    yield RenderTask(view, param_set, default_lang, do_render)
+                continue
+            while True:
+                chunk = list(islice(param_sets, self.queue_size))
+                if not chunk:
+                    break
+                for lang in langs:
+                    for param_set in chunk:
+                        yield RenderTask(view, param_set, lang, do_render)
+
+    def _iter_selected_tasks(self, tasks):
+        '''
+            Generates each task's URI up front and drops tasks whose URI was not
+            selected before they are sent to the render workers.
+        '''
+        for task in tasks:
+            view = task.view
+            with override(task.lang):
+                task.uri = self.generate_uri(view.url, view.view_name, task.param_set)
+            if self.is_selected_uri(task.uri):
+                yield task
+
+    def estimate_durations(self):
+        '''
+            Returns the render durations from a previous build by URI, the
+            average duration of each view's pages by view name, and the average
+            duration of every page.
+        '''
+        durations = {}
+        by_view = {}
+        for uri, (view_name, duration) in (self.durations or {}).items():
+            durations[uri] = duration
+            by_view.setdefault(view_name, []).append(duration)
+        view_averages = {view_name: sum(d) / len(d) for view_name, d in by_view.items()}
+        average = sum(durations.values()) / len(durations) if durations else 0
+        return durations, view_averages, average
+
+    def _schedule_longest_first(self, tasks):
+        '''
+            Orders every task by its estimated render time, longest first, so the
+            slowest pages are not left until last with one worker busy while the
+            others are idle. Pages new since the previous build are estimated with
+            the average of their view's pages. This consumes every distill_func
+            before rendering starts.
+        '''
+        durations, view_averages, average = self.estimate_durations()
+        tasks = list(tasks)
+        estimates = {}
+        for task in tasks:
+            if task.uri is None:
+                view = task.view
+                with override(task.lang):
+                    task.uri = self.generate_uri(view.url, view.view_name, task.param_set)
+            estimate = durations.get(task.uri)
+            if estimate is None:
+                estimate = view_averages.get(task.view.view_name, average)
+            estimates[id(task)] = estimate
+        # sorted() is stable so equal estimates stay in registration order
+        return iter(sorted(tasks, key=lambda task: estimates[id(task)], reverse=True))
+
+    def _iter_param_sets(self, distill_func, view_name):
+        for param_set in self.get_uri_values(distill_func, view_name):
+            if not param_set:
+                param_set = ()
+            elif self._is_str(param_set):
+                param_set = (param_set,)
+            yield param_set
+
+    def render_canaries(self):
+        '''
+            Renders the first page of every view one at a time so broken views
+            and templates fail the build before the full parallel render starts.
+        '''
+        default_lang = str(getattr(settings, 'LANGUAGE_CODE', 'en'))
+        selected_views = self.get_selected_views() if self.is_selective() else None
+        for view in self.get_render_views():
+            if selected_views is not None and view.index not in selected_views:
+                continue
+            for param_set in self._iter_param_sets(view.distill_func, view.view_name):
+                try:
+                    self.render_task(RenderTask(view, param_set, default_lang, True))
+                except DistillError as err:
+                    e = 'Canary render of view "{}" failed: {}'.format(view.view_name, err)
+                    raise DistillError(e) from err
+                break
+
     def render_all_urls(self, do_render=True):
+        if do_render and self.canary:
+            self.render_canaries()
+        self.errors = []
+        to_render = self.iter_render_tasks(do_render)
+        if do_render and self.render_engine == 'process':
+            results = self._map_processes(to_render)
+        elif do_render and self.render_engine == 'async':
+            results = self._map_async(to_render)
+        else:
+            results = self._map_threads(to_render)
+        for uri, file_name, render in results:
+            yield uri, file_name, render
+        if self.errors:
+            shown = self.errors[:20]
+            err = '{} page(s) failed to render:\n{}'.format(
+                len(self.errors), '\n'.join(str(e) for e in shown))
+            if len(self.errors) > len(shown):
+                err += '\n... and {} more'.format(len(self.errors) - len(shown))
+            raise DistillError(err)
+
+    def _bounded_map(self, submit, to_render):
+        '''
+            Submits tasks as they are needed with at most queue_size tasks pending
+            at once and yields the results in submission order, or in completion
+            order if the renderer is not ordered. Tasks of a view already
+            rendering its max_concurrency pages are held back, up to queue_size
+            of them, while the tasks of other views are submitted. Once any task
+            fails no more tasks are submitted and pending tasks after the failure
+            are cancelled, unless continue_on_error is set.
+        '''
+        failed = threading.Event()
+        limits = ViewLimits()
+        held = deque()
+
+        def _submit(task):
+            view = task.view
+            limits.start(view)
+            future = submit(task)
+            future.add_done_callback(lambda f: limits.finish(view))
+            future.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is None or failed.set())
+            return future
 
-        def _render(item):
-            rtn = []
-            for lang in self.get_langs():
-                activate_lang(lang)
-                url, view_name, param_set, status_codes, file_name_base, a, k, do_render = item
-                uri = self.generate_uri(url, view_name, param_set)
-                if do_render:
-                    render = self.render_view(uri, status_codes, param_set, a, k)
+        pending = deque() if self.ordered else set()
+        add_pending = pending.append if self.ordered else pending.add
+
+        def _submit_held():
+            # held tasks are submitted in the order they were held
+            for i in range(len(held)):
+                task = held.popleft()
+                if limits.available(task.view):
+                    add_pending(_submit(task))
+                else:
+                    held.append(task)
+
+        def _ready():
+            if self.ordered:
+                return bool(pending) and pending[0].done()
+            return any(future.done() for future in pending)
+
+        def _wait():
+            if pending and (not held or len(pending) >= self.queue_size or _ready()):
+                yield from self._pop_results(pending, failed)
+            else:
+                limits.wait(lambda: _ready() or any(limits.available(task.view)
+                                                    for task in held))
+            if failed.is_set() and not self.continue_on_error:
+                held.clear()
+            _submit_held()
+
+        try:
+            for task in to_render:
+                if failed.is_set() and not self.continue_on_error:
+                    break
+                held.append(task)
+                _submit_held()
+                while len(pending) >= self.queue_size or len(held) >= self.queue_size:
+                    yield from _wait()
+            if failed.is_set() and not self.continue_on_error:
+                held.clear()
+            while pending or held:
+                yield from _wait()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _pop_results(self, pending, failed):
+        if self.ordered:
+            if failed.is_set() and not self.continue_on_error:
+                # nothing submitted after the first failure needs rendering
+                first_failed = None
+                for i, future in enumerate(pending):
+                    if future.done() and not future.cancelled() and future.exception():
+                        first_failed = i
+                        break
+                if first_failed is not None:
+                    for i in range(first_failed + 1, len(pending)):
+                        pending[i].cancel()
+            done = (pending.popleft(),)
+        else:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            pending -= done
+        for future in done:
+            try:
+                yield future.result()
+            except Exception as err:
+                if not self.continue_on_error:
+                    raise
+                self.errors.append(err)
+
+    def _map_threads(self, to_render):
+        if self.executor is not None:
+            submit = lambda task: self.executor.submit(self.render_task, task)
+            yield from self._bounded_map(submit, to_render)
+            return
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel_render) as executor:
+                submit = lambda task: executor.submit(self.render_task, task)
+                yield from self._bounded_map(submit, to_render)
+        finally:
+            self.stop_timeout_helpers()
+
+    def _map_processes(self, to_render):
+        '''
+            Renders tasks in a pool of forked processes to avoid sharing a single
+            GIL. Django and the URLs are already loaded in this process so each
+            worker inherits them, only the tasks and rendered responses are sent
+            between processes. Workers are replaced after max_tasks_per_worker
+            tasks if set.
+        '''
+        global _process_renderer
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError as e:
+            raise DistillError(f'The process render engine is not supported on this '
+                               f'platform: {e}') from e
+        # Forked workers must not share the database connections of this process
+        connections.close_all()
+        _process_renderer = self
+        try:
+            with context.Pool(self.parallel_render,
+                              maxtasksperchild=self.max_tasks_per_worker) as pool:
+                submit = lambda task: _submit_to_pool(pool, task)
+                for uri, file_name, render in self._bounded_map(submit, to_render):
+                    yield uri, file_name, _unpack_response(render)
+        finally:
+            _process_renderer = None
+
+    def _map_async(self, to_render):
+        '''
+            Renders tasks as coroutines on an event loop running in its own thread
+            with at most parallel_render pages being rendered at once. The async
+            middleware chain is built once and shared by every page.
+        '''
+        loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+        loop_thread.start()
+        try:
+            semaphore = asyncio.run_coroutine_threadsafe(
+                _new_semaphore(self.parallel_render), loop).result()
+            submit = lambda task: asyncio.run_coroutine_threadsafe(
+                self.render_task_async(task, semaphore), loop)
+            yield from self._bounded_map(submit, to_render)
+        finally:
+            asyncio.run_coroutine_threadsafe(_cancel_tasks(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+
+    async def render_task_async(self, task, semaphore):
+        view = task.view
+        # each coroutine runs in its own context so the language is per page
+        activate_lang(task.lang)
+        uri = task.uri or self.generate_uri(view.url, view.view_name, task.param_set)
+        if not self.should_render(uri):
+            render = None
+        else:
+            async with semaphore:
+                started = time.perf_counter()
+                render_view = self.render_view_async(
+                    uri, view.status_codes, task.param_set, view.args, view.kwargs)
+                if view.timeout:
+                    try:
+                        render = await asyncio.wait_for(render_view, view.timeout)
+                    except asyncio.TimeoutError:
+                        raise DistillError(f'Rendering "{uri}" timed out after '
+                                           f'{view.timeout} seconds')
                 else:
-                    render = None
-                file_name = self._get_filename(file_name_base, uri, param_set)
-                rtn.append((uri, file_name, render))
-            return rtn
-
-        to_render = []
-        for url, distill_func, file_name_base, status_codes, view_name, a, k in self.urls_to_distill:
-            for param_set in self.get_uri_values(distill_func, view_name):
-                if not param_set:
-                    param_set = ()
-                elif self._is_str(param_set):
-                    param_set = (param_set,)
-                to_render.append((url, view_name, param_set, status_codes, file_name_base, a, k, do_render))
-        with ThreadPoolExecutor(max_workers=self.parallel_render) as executor:
-            results = executor.map(_render, to_render)
-            for i18n_result in results:
-                for uri, file_name, render in i18n_result:
-                    yield uri, file_name, render
+                    render = await render_view
+                render.distill_duration = time.perf_counter() - started
+            render.distill_lang = task.lang
+            render.distill_view = view.view_name
+        file_name = self._get_filename(view.file_name, uri, task.param_set)
+        return uri, file_name, render
 
     def render(self, view_name=None, status_codes=None, view_args=None, view_kwargs=None):
         if view_name:
@@ -282,12 +955,22 @@ class DistillRender(object):
         elif isinstance(v, (list, tuple)):
             return v
         elif isinstance(v, types.GeneratorType):
-            return list(v)
+            return v
         else:
             err = 'Distill function returned an invalid type: {}'
             raise DistillError(err.format(type(v)))
 
     def generate_uri(self, url, view_name, param_set):
+        if not isinstance(param_set, (list, tuple, dict)):
+            err = 'Distill function returned an invalid type: {}'
+            raise DistillError(err.format(type(param_set)))
+        url_builder = self.url_builders.get(url)
+        if url_builder is None:
+            return self.reverse_uri(url, view_name, param_set)
+        return url_builder.build(
+            param_set, lambda: self.reverse_uri(url, view_name, param_set))
+
+    def reverse_uri(self, url, view_name, param_set):
         namespace = self.namespace_map.get(url, '')
         view_name_ns = namespace + ':' + view_name if namespace else view_name
         if isinstance(param_set, (list, tuple)):
@@ -305,7 +988,21 @@ class DistillRender(object):
             raise DistillError(err.format(type(param_set)))
         return uri
 
-    def render_view(self, uri, status_codes, param_set, args, kwargs={}):
+    def get_handler(self):
+        '''
+            Returns the DistillHandler for the current render worker. The handler
+            and its middleware chain are built once per worker and reused for
+            every page it renders, only the set_view() state changes per page.
+        '''
+        handler = getattr(self._local, 'handler', None)
+        if handler is None:
+            handler = DistillHandler()
+            handler.load_middleware()
+            self._local.handler = handler
+            self._local.request_factory = RequestFactory()
+        return handler
+
+    def _get_view(self, status_codes, param_set, args, kwargs):
         view_path, view_func = None, None
         try:
             view_path, view_func = args[0], args[1]
@@ -324,27 +1021,134 @@ class DistillRender(object):
                 status_codes = (200,)
                 break
         view_args = args[2:] if len(args) > 2 else ()
-        request_factory = RequestFactory()
-        request = request_factory.get(uri)
-        handler = DistillHandler()
-        handler.load_middleware()
         if isinstance(param_set, dict):
             a, k = (), param_set
         else:
             a, k = param_set, {}
+        return view_func, a, k, view_args, status_codes
+
+    def get_request(self, request_factory, uri):
+        '''
+            Returns the request to render uri with and whether it is a conditional
+            request.
+        '''
+        headers = self.conditional_headers(uri) if self.conditional_headers else None
+        extra = dict(headers) if headers else {}
+        host = get_render_host()
+        if host:
+            extra['HTTP_HOST'] = host
+        request, conditional = request_factory.get(uri, **extra), bool(headers)
+        # lets middleware tell pages being rendered by distill apart
+        request.distill_render = True
+        return request, conditional
+
+    def _check_status_code(self, uri, response, status_codes, conditional=False):
+        if conditional and response.status_code == 304:
+            # the page has not changed since it was last rendered
+            response.distill_not_modified = True
+            return response
+        if response.status_code not in status_codes:
+            err = 'View "{}" returned an invalid status code: {} (expected one of {})'
+            raise DistillError(err.format(uri, response.status_code, status_codes))
+        return response
+
+    def render_view(self, uri, status_codes, param_set, args, kwargs={}):
+        view_func, a, k, view_args, status_codes = self._get_view(
+            status_codes, param_set, args, kwargs)
+        handler = self.get_handler()
+        request, conditional = self.get_request(self._local.request_factory, uri)
         try:
             handler.set_view(view_func, a, k, view_args)
-            response = handler.get_response(request)
+            if self.track_dependencies:
+                with record_dependencies() as recorder:
+                    response = handler.get_response(request)
+                response.distill_dependencies = recorder.dependencies()
+            else:
+                response = handler.get_response(request)
         except Exception as err:
             e = 'Failed to render view "{}": {}'.format(uri, err)
             raise DistillError(e) from err
-        if response.status_code not in status_codes:
-            err = 'View returned an invalid status code: {} (expected one of {})'
-            raise DistillError(err.format(response.status_code, status_codes))
-        return response
+        return self._check_status_code(uri, response, status_codes, conditional)
+
+    def get_async_handler(self):
+        '''
+            Returns the DistillHandler with an async middleware chain shared by
+            all pages rendered by the async engine.
+        '''
+        handler = getattr(self, '_async_handler', None)
+        if handler is None:
+            handler = DistillHandler()
+            handler.load_middleware(is_async=True)
+            self._async_handler = handler
+            self._async_request_factory = RequestFactory()
+        return handler
+
+    async def render_view_async(self, uri, status_codes, param_set, args, kwargs={}):
+        view_func, a, k, view_args, status_codes = self._get_view(
+            status_codes, param_set, args, kwargs)
+        handler = self.get_async_handler()
+        request, conditional = self.get_request(self._async_request_factory, uri)
+        request.distill_view = (view_func, a, k, view_args)
+        try:
+            response = await handler.get_response_async(request)
+        except Exception as err:
+            e = 'Failed to render view "{}": {}'.format(uri, err)
+            raise DistillError(e) from err
+        return self._check_status_code(uri, response, status_codes, conditional)
 
 
-def copy_static(dir_from, dir_to):
+def _pack_response(response):
+    if response is None:
+        return None
+    # distill_* attributes set on the response by the renderer are kept
+    attrs = {k: v for k, v in vars(response).items() if k.startswith('distill_')}
+    return response.status_code, list(response.items()), response.content, attrs
+
+
+def _unpack_response(packed):
+    if packed is None:
+        return None
+    status_code, headers, content, attrs = packed
+    response = HttpResponse(content, status=status_code)
+    for header, value in headers:
+        response[header] = value
+    for attr, value in attrs.items():
+        setattr(response, attr, value)
+    return response
+
+
+def _render_task_in_process(view_index, param_set, lang, do_render, uri):
+    view = _process_renderer.get_render_views()[view_index]
+    task = RenderTask(view, param_set, lang, do_render, uri)
+    uri, file_name, render = _process_renderer.render_task(task)
+    return uri, file_name, _pack_response(render)
+
+
+async def _new_semaphore(value):
+    # Semaphores must be created inside the event loop that uses them
+    return asyncio.Semaphore(value)
+
+
+async def _cancel_tasks():
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _submit_to_pool(pool, task):
+    # tasks are sent to the forked workers by view index as the views themselves
+    # are not always picklable
+    future = Future()
+    future.set_running_or_notify_cancel()
+    pool.apply_async(_render_task_in_process,
+                     (task.view.index, task.param_set, task.lang, task.do_render,
+                      task.uri),
+                     callback=future.set_result, error_callback=future.set_exception)
+    return future
+
+
+def copy_static(dir_from, dir_to, manifest=None):
     # we need to ignore some static dirs such as 'admin' so this is a
     # little more complex than a straight shutil.copytree()
     if not dir_from.endswith(os.sep):
@@ -358,25 +1162,30 @@ def copy_static(dir_from, dir_to):
             base_path = from_path[len(dir_from):]
             to_path = os.path.join(dir_to, base_path)
             to_path_dir = os.path.dirname(to_path)
+            if manifest is not None and manifest.static_unchanged(from_path, to_path):
+                manifest.record_static(to_path)
+                continue
             if not os.path.isdir(to_path_dir):
                 os.makedirs(to_path_dir)
             copy2(from_path, to_path)
+            if manifest is not None:
+                manifest.record_static(to_path)
             yield from_path, to_path
 
 
-def copy_static_and_media_files(output_dir, stdout):
+def copy_static_and_media_files(output_dir, stdout, manifest=None):
     static_url = str(settings.STATIC_URL)
     static_root = str(settings.STATIC_ROOT)
     static_url = static_url[1:] if static_url.startswith('/') else static_url
     static_output_dir = os.path.join(output_dir, static_url)
-    for file_from, file_to in copy_static(static_root, static_output_dir):
+    for file_from, file_to in copy_static(static_root, static_output_dir, manifest):
         stdout('Copying static: {} -> {}'.format(file_from, file_to))
     media_url = str(settings.MEDIA_URL)
     media_root = str(settings.MEDIA_ROOT)
     if media_root:
         media_url = media_url[1:] if media_url.startswith('/') else media_url
         media_output_dir = os.path.join(output_dir, media_url)
-        for file_from, file_to in copy_static(media_root, media_output_dir):
+        for file_from, file_to in copy_static(media_root, media_output_dir, manifest):
             stdout('Copying media: {} -> {}'.format(file_from, file_to))
     return True
 
@@ -407,6 +1216,27 @@ def filter_dirs(dirs):
     return [d for d in dirs if d not in _ignore_dirs]
 
 
+def allow_all_hosts():
+    '''
+        Sets allowed hosts to '*', static rendering shouldn't care about the
+        hostname. Only for the management commands, which own their process,
+        never for renderers running inside a web server.
+    '''
+    settings.ALLOWED_HOSTS = ['*']
+
+
+def get_render_host():
+    '''
+        Returns the host to render pages for when ALLOWED_HOSTS would refuse
+        the "testserver" host of Django's RequestFactory, the first allowed
+        host, or None to keep "testserver".
+    '''
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if not allowed_hosts or '*' in allowed_hosts or 'testserver' in allowed_hosts:
+        return None
+    return allowed_hosts[0].lstrip('.')
+
+
 def load_urls(stdout=None):
     if stdout:
         stdout('Loading site URLs')
@@ -443,29 +1273,157 @@ def write_file(full_path, content):
             raise
 
 
-def get_renderer(urls_to_distill, parallel_render=1):
+def get_render_option_defaults():
+    parameters = inspect.signature(DistillRender.__init__).parameters
+    return {name: p.default for name, p in parameters.items()
+            if p.default is not inspect.Parameter.empty}
+
+
+def get_renderer(urls_to_distill, parallel_render=1, **render_options):
     import_path = getattr(settings, 'DISTILL_RENDERER', None)
     if import_path:
         render_cls = import_string(import_path)
     else:
         render_cls = DistillRender
-    return render_cls(urls_to_distill, parallel_render)
+    # only pass options which are set so DISTILL_RENDERER classes with their own
+    # __init__(urls_to_distill, parallel_render=1) work unless the options are used
+    defaults = get_render_option_defaults()
+    render_options = {name: value for name, value in render_options.items()
+                      if name not in defaults or value != defaults[name]}
+    if render_options and render_cls is not DistillRender:
+        parameters = inspect.signature(render_cls.__init__).parameters.values()
+        if not any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters):
+            accepted = {p.name for p in parameters}
+            unsupported = sorted(set(render_options) - accepted)
+            if unsupported:
+                raise DistillError(f'Renderer {import_path} does not accept the render '
+                                   f'options: {", ".join(unsupported)}, add them to its '
+                                   f'__init__() or pass **kwargs to DistillRender')
+    return render_cls(urls_to_distill, parallel_render, **render_options)
 
 
-def render_to_dir(output_dir, urls_to_distill, stdout, parallel_render=1):
-    load_urls(stdout)
-    renderer = get_renderer(urls_to_distill, parallel_render)
-    for page_uri, file_name, http_response in renderer.render():
-        full_path, local_uri = get_filepath(output_dir, file_name, page_uri)
-        content = http_response.content
-        mime = http_response.get('Content-Type')
-        renamed = ' (renamed from "{}")'.format(page_uri) if file_name else ''
-        msg = 'Rendering page: {} -> {} ["{}", {} bytes] {}'
-        stdout(msg.format(local_uri, full_path, mime, len(content), renamed))
+def get_validators(response):
+    '''
+        Returns the ETag and Last-Modified headers of a response in the form
+        recorded in the build manifest.
+    '''
+    validators = {}
+    if response.has_header('ETag'):
+        validators['etag'] = response['ETag']
+    if response.has_header('Last-Modified'):
+        validators['last_modified'] = response['Last-Modified']
+    return validators
+
+
+def write_build_file(manifest, full_path, uri, content, dependencies=None, **extra):
+    '''
+        Writes a rendered file and records it in the build manifest, if there is
+        one. Files whose content has not changed since the last build recorded in
+        the manifest are not rewritten. Returns True if the file was written.
+    '''
+    if manifest is None:
+        write_file(full_path, content)
+        return True
+    digest = content_hash(content)
+    unchanged = manifest.page_unchanged(full_path, digest, len(content))
+    if not unchanged:
         write_file(full_path, content)
+    manifest.record_page(full_path, uri, digest, len(content), dependencies, **extra)
+    return not unchanged
+
+
+def render_to_dir(output_dir, urls_to_distill, stdout, parallel_render=1, manifest=None,
+                  journal=None, **render_options):
+    load_urls(stdout)
+    renderer = get_renderer(urls_to_distill, parallel_render, **render_options)
+    normalizers = load_normalizers()
+    try:
+        for page_uri, file_name, http_response in renderer.render():
+            write_page(output_dir, page_uri, file_name, http_response, stdout, manifest,
+                       journal, normalizers)
+            # release the rendered response as soon as it is written
+            del http_response
+    finally:
+        if journal is not None:
+            journal.flush()
+    if getattr(renderer, 'concurrency', None) is not None:
+        stdout(renderer.concurrency.describe())
     return True
 
 
+def write_page(output_dir, page_uri, file_name, http_response, stdout, manifest=None,
+               journal=None, normalizers=()):
+    '''
+        Writes one rendered page into output_dir, recording it in the build
+        manifest and journal if there are any.
+    '''
+    full_path, local_uri = get_filepath(output_dir, file_name, page_uri)
+    if http_response is None:
+        # not rendered as the renderer's uri_filter excluded it
+        entry = journal.get(page_uri) if journal is not None else None
+        if manifest is not None and entry is not None:
+            # written by the build being resumed
+            manifest.record_page(full_path, page_uri, entry['hash'], entry['size'])
+        elif manifest is not None:
+            manifest.keep_page(full_path)
+        stdout('Skipping page: {} -> {}'.format(local_uri, full_path))
+        return
+    lang = getattr(http_response, 'distill_lang', None)
+    if getattr(http_response, 'distill_not_modified', False):
+        # the view returned 304 Not Modified to a conditional request
+        if manifest is not None:
+            manifest.keep_page(full_path)
+        if journal is not None and os.path.isfile(full_path):
+            with open(full_path, 'rb') as f:
+                journal.record_content(page_uri, lang, full_path, f.read())
+        stdout('Not modified page: {} -> {}'.format(local_uri, full_path))
+        return
+    mime = http_response.get('Content-Type')
+    content = normalize_content(http_response.content, mime, http_response.charset,
+                                normalizers)
+    renamed = ' (renamed from "{}")'.format(page_uri) if file_name else ''
+    dependencies = getattr(http_response, 'distill_dependencies', None)
+    extra = get_validators(http_response)
+    view_name = getattr(http_response, 'distill_view', None)
+    if view_name:
+        extra['view'] = view_name
+    duration = getattr(http_response, 'distill_duration', None)
+    if duration is not None:
+        extra['duration'] = round(duration, 6)
+    if write_build_file(manifest, full_path, page_uri, content, dependencies, **extra):
+        msg = 'Rendering page: {} -> {} ["{}", {} bytes] {}'
+    else:
+        msg = 'Unchanged page: {} -> {} ["{}", {} bytes] {}'
+    stdout(msg.format(local_uri, full_path, mime, len(content), renamed))
+    if journal is not None:
+        journal.record_content(page_uri, lang, full_path, content)
+
+
+def read_url_list(f):
+    '''
+        Reads a list of URLs, one per line, from an open file. Blank lines and
+        lines starting with # are ignored and full URLs are reduced to their path.
+    '''
+    urls = set()
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parsed = urlsplit(line)
+        urls.add(parsed.path if parsed.scheme else line)
+    return urls
+
+
+def load_url_list(path):
+    if path == '-':
+        return read_url_list(sys.stdin)
+    try:
+        with open(path, 'rt') as f:
+            return read_url_list(f)
+    except OSError as e:
+        raise DistillError(f'Failed to read URLs from {path}: {e}') from e
+
+
 def render_single_file(output_dir, view_name, *args, **kwargs):
     from django_distill.distill import urls_to_distill
     status_codes = None
@@ -480,7 +1438,8 @@ def render_single_file(output_dir, view_name, *args, **kwargs):
     page_uri, file_name, http_response = renderer.render(
         view_name, status_codes, args, kwargs)
     full_path, local_uri = get_filepath(output_dir, file_name, page_uri)
-    content = http_response.content
+    content = normalize_content(http_response.content, http_response.get('Content-Type'),
+                                http_response.charset, load_normalizers())
     write_file(full_path, content)
     return True
 
@@ -508,7 +1467,7 @@ def render_static_redirect(destination_url):
     return '\n'.join(redir).encode()
 
 
-def render_redirects(output_dir, stdout):
+def render_redirects(output_dir, stdout, manifest=None):
     from django.contrib.redirects.models import Redirect
     for redirect in Redirect.objects.all():
         redirect_path = redirect.old_path.lstrip('/')
@@ -520,5 +1479,5 @@ def render_redirects(output_dir, stdout):
         content = render_static_redirect(redirect.new_path)
         msg = 'Rendering redirect: {} -> {}'
         stdout(msg.format(local_uri, redirect.new_path))
-        write_file(full_path, content)
+        write_build_file(manifest, full_path, redirect.old_path, content)
     return True
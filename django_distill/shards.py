@@ -0,0 +1,78 @@
+import os
+import hashlib
+import shutil
+from django_distill.errors import DistillError
+from django_distill.manifest import BuildManifest, MANIFEST_NAME, content_hash
+from django_distill.journal import JOURNAL_NAME
+
+
+def parse_shard(value):
+    '''
+        Parses a shard in the form INDEX/COUNT, such as 2/4, where INDEX counts
+        from 1. Returns a tuple of (index, count).
+    '''
+    try:
+        index, count = (int(v) for v in str(value).split('/'))
+    except ValueError:
+        raise DistillError(f'Invalid shard "{value}", expected INDEX/COUNT such as 1/4')
+    if count < 1 or not 1 <= index <= count:
+        raise DistillError(f'Invalid shard "{value}", INDEX must be from 1 to COUNT')
+    return index, count
+
+
+def uri_shard(uri, count):
+    '''
+        Returns the shard, from 1 to count, a URI is rendered by. This only
+        depends on the URI so every build splits the site the same way.
+    '''
+    digest = hashlib.sha1(uri.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+def file_hash(full_path):
+    with open(full_path, 'rb') as f:
+        return content_hash(f.read())
+
+
+def merge_build_dirs(output_dir, input_dirs, stdout):
+    '''
+        Copies the files of several shard output directories into output_dir
+        and combines their build manifests, if they have them, into a single
+        manifest. Files written by more than one shard must be identical.
+    '''
+    input_dirs = [os.path.abspath(input_dir) for input_dir in input_dirs]
+    os.makedirs(output_dir, exist_ok=True)
+    skip = (MANIFEST_NAME, JOURNAL_NAME)
+    copied = {}
+    for input_dir in input_dirs:
+        stdout('Merging: {}'.format(input_dir))
+        for root, dirs, files in os.walk(input_dir):
+            dirs.sort()
+            for f in sorted(files):
+                if root == input_dir and f.startswith(skip):
+                    continue
+                from_path = os.path.join(root, f)
+                local_path = os.path.relpath(from_path, input_dir)
+                to_path = os.path.join(output_dir, local_path)
+                if local_path in copied:
+                    if file_hash(from_path) != file_hash(copied[local_path]):
+                        raise DistillError(f'File {local_path} differs between {input_dir} '
+                                           f'and {copied[local_path]}, were the shards '
+                                           f'built from the same site?')
+                    continue
+                os.makedirs(os.path.dirname(to_path), exist_ok=True)
+                shutil.copy2(from_path, to_path)
+                copied[local_path] = from_path
+    manifests = [BuildManifest.load(input_dir) for input_dir in input_dirs]
+    manifests = [m for m in manifests if m.files]
+    if not manifests:
+        return None
+    merged = BuildManifest(output_dir)
+    tables, templates = {}, {}
+    for manifest in manifests:
+        merged.new_files.update(manifest.files)
+        tables.update(manifest.dependencies.get('tables', {}))
+        templates.update(manifest.dependencies.get('templates', {}))
+    merged.new_dependencies = {'tables': tables, 'templates': templates}
+    merged.save()
+    return merged
@@ -0,0 +1,160 @@
+import re
+from urllib.parse import quote
+from django.urls import get_resolver, get_script_prefix
+from django.utils.http import RFC3986_SUBDELIMS, escape_leading_slashes
+from django.utils.regex_helper import normalize
+
+
+try:
+    from django.urls.resolvers import LocalePrefixPattern
+except ImportError:
+    LocalePrefixPattern = None
+
+
+urlconf = get_resolver()
+
+
+def iter_url_chains(url_patterns, parents=()):
+    '''
+        Yields every URL pattern along with the include()ed resolvers it is
+        nested in, outermost first.
+    '''
+    for entry in url_patterns:
+        if hasattr(entry, 'url_patterns'):
+            yield from iter_url_chains(entry.url_patterns, parents + (entry,))
+        else:
+            yield parents, entry
+
+
+def is_locale_pattern(pattern):
+    return LocalePrefixPattern is not None and isinstance(pattern, LocalePrefixPattern)
+
+
+class URLBuilder(object):
+    '''
+        Builds URIs for a single URL pattern without calling reverse(). The full
+        pattern, including any include()ed prefixes, is compiled once into format
+        strings in the same way Django's URL resolver does. URIs are then built
+        with the same argument matching, converters, validation and quoting as
+        reverse(). Patterns with an i18n language prefix are compiled once per
+        language. The first URI built for each language and argument style is
+        compared against reverse() and the builder falls back to reverse() for
+        good if they ever differ.
+    '''
+
+    def __init__(self, url, parents=()):
+        self.patterns = tuple(p.pattern for p in parents) + (url.pattern,)
+        self.converters = {}
+        self.defaults = {}
+        for p in parents:
+            self.converters.update(getattr(p.pattern, 'converters', {}))
+            self.defaults.update(getattr(p, 'default_kwargs', {}))
+        self.converters.update(getattr(url.pattern, 'converters', {}))
+        self.defaults.update(getattr(url, 'default_args', {}))
+        self.i18n = any(is_locale_pattern(p) for p in self.patterns)
+        self._compiled = {}
+        self._verified = set()
+        self.disabled = False
+
+    def _pattern_key(self):
+        return get_script_prefix(), tuple(
+            p.language_prefix for p in self.patterns if is_locale_pattern(p))
+
+    def _compile(self, key):
+        script_prefix, language_prefixes = key
+        language_prefixes = iter(language_prefixes)
+        regex = ''
+        for p in self.patterns:
+            if is_locale_pattern(p):
+                regex += re.escape(next(language_prefixes))
+            else:
+                pattern = p.regex.pattern
+                regex += pattern[1:] if pattern.startswith('^') else pattern
+        candidate_prefix = script_prefix.replace('%', '%%')
+        possibilities = [(candidate_prefix + result, params)
+                         for result, params in normalize(regex)]
+        check = re.compile('^%s%s' % (re.escape(script_prefix), regex))
+        self._compiled[key] = (possibilities, check)
+        return self._compiled[key]
+
+    def _candidate_subs(self, params, args, kwargs):
+        if args:
+            if len(args) != len(params):
+                return None
+            return dict(zip(params, args))
+        if set(kwargs).symmetric_difference(params).difference(self.defaults):
+            return None
+        for k, v in self.defaults.items():
+            if k not in params and kwargs.get(k, v) != v:
+                return None
+        return kwargs
+
+    def _build(self, key, args, kwargs):
+        try:
+            possibilities, check = self._compiled[key]
+        except KeyError:
+            possibilities, check = self._compile(key)
+        for candidate_pat, params in possibilities:
+            candidate_subs = self._candidate_subs(params, args, kwargs)
+            if candidate_subs is None:
+                continue
+            text_candidate_subs = {}
+            try:
+                for k, v in candidate_subs.items():
+                    if k in self.converters:
+                        text_candidate_subs[k] = self.converters[k].to_url(v)
+                    else:
+                        text_candidate_subs[k] = str(v)
+            except ValueError:
+                continue
+            candidate = candidate_pat % text_candidate_subs
+            if check.search(candidate):
+                url = quote(candidate, safe=RFC3986_SUBDELIMS + '/~:@')
+                return escape_leading_slashes(url)
+        return None
+
+    def build(self, param_set, reverse_uri):
+        '''
+            Returns the URI for param_set, reverse_uri() is called to build the
+            URI with reverse() if it cannot be built here.
+        '''
+        if self.disabled:
+            return reverse_uri()
+        if isinstance(param_set, dict):
+            args, kwargs = (), param_set
+        else:
+            args, kwargs = tuple(param_set), {}
+        key = self._pattern_key()
+        uri = self._build(key, args, kwargs)
+        if uri is None:
+            return reverse_uri()
+        verify_key = (key, bool(args))
+        if verify_key not in self._verified:
+            expected = reverse_uri()
+            if expected != uri:
+                self.disabled = True
+                return expected
+            self._verified.add(verify_key)
+        return uri
+
+
+def load_url_builders():
+    url_builders = {}
+    for parents, url in iter_url_chains(urlconf.url_patterns):
+        if hasattr(url, 'pattern') and all(hasattr(p, 'pattern') for p in parents):
+            url_builders[url] = URLBuilder(url, parents)
+    return url_builders
+
+
+_url_builders = None
+
+
+def get_url_builders():
+    '''
+        Returns a URLBuilder for every URL pattern in the project, keyed by the
+        pattern. Builders are created once per process.
+    '''
+    global _url_builders
+    if _url_builders is None:
+        _url_builders = load_url_builders()
+    return _url_builders
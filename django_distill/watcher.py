@@ -0,0 +1,261 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management import call_command
+from django_distill.errors import DistillError
+from django_distill.manifest import BuildManifest, MANIFEST_NAME
+from django_distill.dependencies import DependencyState
+from django_distill.renderer import (get_renderer, load_urls, load_normalizers, write_page,
+                                     copy_static_and_media_files)
+
+
+try:
+    from django.template.autoreload import reset_loaders
+except ImportError:
+    def reset_loaders():
+        pass
+
+
+def snapshot_files(dirs):
+    '''
+        Returns the modification time and size of every file under dirs.
+    '''
+    files = {}
+    for dir_path in dirs:
+        for root, dirnames, filenames in os.walk(dir_path):
+            for f in filenames:
+                path = os.path.join(root, f)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (st.st_mtime, st.st_size)
+    return files
+
+
+def static_source_files():
+    '''
+        Returns the modification time and size of every file found by the
+        staticfiles finders, the sources collectstatic copies from.
+    '''
+    if 'django.contrib.staticfiles' not in settings.INSTALLED_APPS:
+        return {}
+    from django.contrib.staticfiles.finders import get_finders
+    files = {}
+    for finder in get_finders():
+        for path, storage in finder.list([]):
+            try:
+                full_path = storage.path(path)
+                st = os.stat(full_path)
+            except (NotImplementedError, OSError):
+                continue
+            files[full_path] = (st.st_mtime, st.st_size)
+    return files
+
+
+class SiteWatcher(object):
+    '''
+        Keeps a renderer loaded and re-renders the pages affected by changes to
+        templates and, optionally, database tables into an output directory built
+        with a build manifest. Changed templates and tables are found with the
+        dependency graph recorded in the manifest. Views whose pages depend on a
+        change are selected so new pages are found, but only their affected and
+        new pages are rendered. Changes to STATIC_ROOT and MEDIA_ROOT are copied
+        and changes to static sources optionally run collectstatic first. The
+        manifest is kept in memory and the render threads, with their handlers,
+        are kept between renders. Tables are fingerprinted at most every
+        db_interval seconds as fingerprinting reads every row.
+    '''
+
+    def __init__(self, output_dir, urls_to_distill, stdout, manifest_path=None,
+                 watch_db=False, watch_static=True, collectstatic=False,
+                 parallel_render=1, db_interval=10, **render_options):
+        self.output_dir = output_dir
+        self.urls_to_distill = urls_to_distill
+        self.stdout = stdout
+        self.manifest_path = manifest_path
+        self.watch_db = watch_db
+        self.db_interval = db_interval
+        self.watch_static = watch_static
+        self.collectstatic = collectstatic
+        load_urls(stdout)
+        self.renderer = get_renderer(urls_to_distill, parallel_render,
+                                     track_dependencies=True, **render_options)
+        self.executor = ThreadPoolExecutor(max_workers=max(parallel_render, 1))
+        self.renderer.executor = self.executor
+        self.normalizers = load_normalizers()
+        self._manifest = None
+        self._manifest_stat = None
+        self._tables_checked = None
+        self._static_files = self.static_files() if watch_static else {}
+        self._static_sources = static_source_files() if collectstatic else {}
+
+    def manifest_stat(self):
+        path = self.manifest_path or os.path.join(self.output_dir, MANIFEST_NAME)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def load_manifest(self):
+        '''
+            Returns the build manifest, only loading it again if it has changed
+            on disk since it was last loaded or saved.
+        '''
+        stat = self.manifest_stat()
+        if self._manifest is None or stat != self._manifest_stat:
+            self._manifest = BuildManifest.load(self.output_dir, self.manifest_path)
+            self._manifest_stat = stat
+        return self._manifest
+
+    def save_manifest(self, manifest):
+        manifest.save()
+        # what was just saved is the previous build of the next check
+        self._manifest = BuildManifest(self.output_dir, manifest.path, manifest.new_files,
+                                       manifest.new_dependencies)
+        self._manifest_stat = self.manifest_stat()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if hasattr(self.renderer, 'stop_timeout_helpers'):
+            self.renderer.stop_timeout_helpers()
+
+    def needs_full_build(self, manifest):
+        pages = [entry for entry in manifest.files.values() if 'uri' in entry]
+        if not pages:
+            return True
+        return any('view' not in entry or 'tables' not in entry for entry in pages)
+
+    def static_files(self):
+        dirs = [str(settings.STATIC_ROOT)]
+        if settings.MEDIA_ROOT:
+            dirs.append(str(settings.MEDIA_ROOT))
+        return snapshot_files(d for d in dirs if d and os.path.isdir(d))
+
+    def dependency_state(self, manifest, check_tables=False):
+        state = DependencyState()
+        if not check_tables:
+            # tables which are not checked keep the fingerprints they were last
+            # rendered with rather than querying the database
+            state.tables.update(manifest.dependencies.get('tables', {}))
+        state.preload(manifest.dependencies)
+        return state
+
+    def affected_pages(self, manifest, state, check_tables=False):
+        '''
+            Returns the names of the views with pages affected by changes since
+            the manifest was saved and the URIs of those pages.
+        '''
+        dependencies = dict(manifest.dependencies)
+        if not check_tables:
+            dependencies['tables'] = {}
+        changed_tables, changed_templates = state.changed(dependencies)
+        views, uris = set(), set()
+        if not changed_tables and not changed_templates:
+            return views, uris
+        for entry in manifest.files.values():
+            if 'uri' not in entry or 'view' not in entry:
+                continue
+            if (changed_tables.intersection(entry.get('tables', ())) or
+                    changed_templates.intersection(entry.get('templates', ()))):
+                views.add(entry['view'])
+                uris.add(entry['uri'])
+        return views, uris
+
+    def render(self, manifest, only_views=None, uri_filter=None):
+        self.renderer.select(only_views=only_views)
+        self.renderer.uri_filter = uri_filter
+        for page_uri, file_name, http_response in self.renderer.render():
+            write_page(self.output_dir, page_uri, file_name, http_response, self.stdout,
+                       manifest, normalizers=self.normalizers)
+            del http_response
+
+    def build(self):
+        '''
+            Renders every page, writing only the pages which changed, so the
+            manifest has a complete dependency graph to watch.
+        '''
+        self.stdout('Rendering all pages to record their dependencies')
+        manifest = self.load_manifest()
+        state = DependencyState()
+        state.preload(manifest.dependencies)
+        try:
+            self.render(manifest)
+            if self.watch_static:
+                copy_static_and_media_files(self.output_dir, self.stdout, manifest)
+            else:
+                manifest.keep_static()
+        except BaseException:
+            # the manifest now holds part of a build, load it again next time
+            self._manifest = None
+            raise
+        manifest.remove_orphans(self.stdout)
+        manifest.new_dependencies = state.snapshot(manifest.new_files)
+        self.save_manifest(manifest)
+
+    def check(self):
+        '''
+            Re-renders any pages affected by changes since the last check and
+            copies any changed static and media files. Returns True if anything
+            changed.
+        '''
+        changed = False
+        if self.collectstatic:
+            static_sources = static_source_files()
+            if static_sources != self._static_sources:
+                self.stdout('Static sources changed, running collectstatic')
+                call_command('collectstatic', '--noinput', verbosity=0)
+                self._static_sources = static_sources
+        manifest = self.load_manifest()
+        now = time.monotonic()
+        check_tables = self.watch_db and (self._tables_checked is None or
+                                          now - self._tables_checked >= self.db_interval)
+        if check_tables:
+            self._tables_checked = now
+        state = self.dependency_state(manifest, check_tables)
+        views, uris = self.affected_pages(manifest, state, check_tables)
+        try:
+            if views:
+                self.stdout('Re-rendering {} page(s) of {} view(s)'.format(len(uris),
+                                                                           len(views)))
+                known_uris = set(entry['uri'] for entry in manifest.files.values()
+                                 if 'uri' in entry)
+                # cached template loaders would otherwise keep the old templates
+                reset_loaders()
+                # render affected pages and any new pages of the affected views
+                self.render(manifest, only_views=sorted(views),
+                            uri_filter=lambda uri: uri in uris or uri not in known_uris)
+                changed = True
+            if self.watch_static:
+                static_files = self.static_files()
+                if static_files != self._static_files:
+                    copy_static_and_media_files(self.output_dir, self.stdout, manifest)
+                    self._static_files = static_files
+                    changed = True
+        except BaseException:
+            # the manifest now holds part of an update, load it again next time
+            self._manifest = None
+            raise
+        if changed:
+            manifest.keep_unvisited()
+            manifest.new_dependencies = state.snapshot(manifest.new_files)
+            self.save_manifest(manifest)
+        return changed
+
+    def run(self, interval=1):
+        try:
+            if self.needs_full_build(self.load_manifest()):
+                self.build()
+            self.stdout('Watching for changes, press Ctrl+C to stop')
+            while True:
+                try:
+                    if self.check():
+                        self.stdout('Site updated, watching for changes')
+                except DistillError as err:
+                    # keep watching so the error can be fixed
+                    self.stdout('Failed to update site: {}'.format(err))
+                time.sleep(interval)
+        finally:
+            self.close()
@@ -0,0 +1,336 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from django.db import connections
+from django.utils.translation import override
+from django_distill.errors import DistillError
+from django_distill.renderer import RenderTask, ViewLimits, load_normalizers, write_page
+
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    uri TEXT NOT NULL UNIQUE,
+    view_index INTEGER NOT NULL,
+    view_name TEXT NOT NULL,
+    param_set TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def default_worker_id():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+def encode_param_set(uri, param_set):
+    '''
+        Encodes the parameters of a page as JSON, which unlike pickle cannot
+        run code in the workers reading the queue. Positional and keyword
+        parameters are tagged so they are decoded as a tuple or a dict.
+    '''
+    if isinstance(param_set, dict):
+        tagged = {'kwargs': param_set}
+    else:
+        tagged = {'args': list(param_set)}
+    try:
+        return json.dumps(tagged, sort_keys=True)
+    except (TypeError, ValueError) as e:
+        raise DistillError(f'Parameters of {uri} cannot be queued, only strings, '
+                           f'numbers, booleans and None are supported: {e}') from e
+
+
+def decode_param_set(uri, encoded):
+    try:
+        tagged = json.loads(encoded)
+        if 'kwargs' in tagged:
+            return dict(tagged['kwargs'])
+        return tuple(tagged['args'])
+    except (TypeError, ValueError, KeyError, AttributeError) as e:
+        raise DistillError(f'Parameters of {uri} in the work queue cannot be read, was '
+                           f'it created by an older version? Queue the site again '
+                           f'with distill-enqueue --reset') from e
+
+
+class WorkQueue(object):
+    '''
+        A queue of render tasks in a SQLite database shared by any number of
+        worker processes, on one host or several with a shared volume. Workers
+        claim tasks with a lease. A task whose lease expires, because its worker
+        died, can be claimed by another worker until it has been attempted
+        max_attempts times. Each thread has its own database connection.
+    '''
+
+    def __init__(self, path, lease_time=600, max_attempts=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.executescript(SCHEMA)
+            self._local.connection = conn
+        return conn
+
+    def _transaction(self, func, *args):
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def close(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is not None:
+            conn.close()
+            self._local.connection = None
+
+    def reset(self):
+        self._transaction(lambda conn: (conn.execute('DELETE FROM tasks'),
+                                        conn.execute('DELETE FROM meta')))
+
+    def set_meta(self, key, value):
+        self._transaction(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value)))
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?',
+                                      (key,)).fetchone()
+        return row[0] if row else default
+
+    def add(self, tasks, chunk_size=500):
+        '''
+            Adds (uri, view_index, view_name, param_set, lang) tasks, ignoring any
+            URI which is already queued. Returns the number of tasks added.
+        '''
+        def _insert(conn, rows):
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO tasks (uri, view_index, view_name, param_set, lang, '
+                'status) VALUES (?, ?, ?, ?, ?, ?)', rows)
+            return conn.total_changes - before
+        added = 0
+        rows = []
+        for uri, view_index, view_name, param_set, lang in tasks:
+            rows.append((uri, view_index, view_name, encode_param_set(uri, param_set), lang,
+                         PENDING))
+            if len(rows) >= chunk_size:
+                added += self._transaction(_insert, rows)
+                rows = []
+        if rows:
+            added += self._transaction(_insert, rows)
+        return added
+
+    def claim(self, worker, limit=1):
+        '''
+            Leases up to limit pending tasks, or tasks whose lease has expired, to
+            a worker. Returns a list of (id, uri, view_index, view_name, param_set,
+            lang) tuples, empty if there is nothing to claim.
+        '''
+        def _claim(conn):
+            now = time.time()
+            # tasks abandoned by dead workers too many times are given up on
+            conn.execute(
+                'UPDATE tasks SET status = ?, error = ? WHERE status = ? AND '
+                'lease_expires < ? AND attempts >= ?',
+                (FAILED, 'Lease expired, the worker rendering this page stopped',
+                 LEASED, now, self.max_attempts))
+            rows = conn.execute(
+                'SELECT id, uri, view_index, view_name, param_set, lang FROM tasks '
+                'WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT ?',
+                (PENDING, LEASED, now, limit)).fetchall()
+            conn.executemany(
+                'UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, '
+                'attempts = attempts + 1 WHERE id = ?',
+                [(LEASED, worker, now + self.lease_time, row[0]) for row in rows])
+            return [row[:4] + (decode_param_set(row[1], row[4]), row[5]) for row in rows]
+        return self._transaction(_claim)
+
+    def renew(self, worker):
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE tasks SET lease_expires = ? WHERE status = ? AND worker = ?',
+            (time.time() + self.lease_time, LEASED, worker)))
+
+    def complete(self, task_id, worker):
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE tasks SET status = ?, error = NULL WHERE id = ? AND worker = ?',
+            (DONE, task_id, worker)))
+
+    def fail(self, task_id, worker, error):
+        '''
+            Records a failed render. The task is retried by any worker until it
+            has been attempted max_attempts times.
+        '''
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+            'error = ? WHERE id = ? AND worker = ?',
+            (self.max_attempts, FAILED, PENDING, str(error), task_id, worker)))
+
+    def counts(self):
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for status, count in self.connection.execute(
+                'SELECT status, COUNT(*) FROM tasks GROUP BY status'):
+            counts[status] = count
+        return counts
+
+    def errors(self):
+        return self.connection.execute(
+            'SELECT uri, error FROM tasks WHERE status = ? ORDER BY id', (FAILED,)).fetchall()
+
+
+def enqueue_site(work_queue, renderer):
+    '''
+        Adds a task to the work queue for every page the renderer would render.
+        Returns the number of tasks added.
+    '''
+    def _tasks():
+        for task in renderer.iter_render_tasks():
+            view = task.view
+            uri = task.uri
+            if uri is None:
+                with override(task.lang):
+                    uri = renderer.generate_uri(view.url, view.view_name, task.param_set)
+            if not renderer.should_render(uri):
+                continue
+            yield uri, view.index, view.view_name, task.param_set, task.lang
+    return work_queue.add(_tasks())
+
+
+class QueueWorker(object):
+    '''
+        Claims tasks from a work queue, renders them and writes them into an
+        output directory until the queue is drained. Runs parallel_render
+        threads which each claim their own tasks. A heartbeat thread renews the
+        leases of claimed tasks while they render so a render which takes
+        longer than the lease time is not claimed by another worker.
+    '''
+
+    def __init__(self, work_queue, renderer, output_dir, stdout, parallel_render=1,
+                 batch_size=1, poll_interval=1):
+        self.work_queue = work_queue
+        self.renderer = renderer
+        self.output_dir = output_dir
+        self.stdout = stdout
+        self.parallel_render = parallel_render
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.normalizers = load_normalizers()
+        # each thread renders the tasks it claims so views at their
+        # max_concurrency make the thread wait
+        self.limits = ViewLimits()
+        self.rendered = 0
+        self._errors = []
+        self._lock = threading.Lock()
+        self._workers = set()
+        self._stopped = threading.Event()
+
+    def get_task(self, view_index, view_name, param_set, lang, uri):
+        render_views = self.renderer.get_render_views()
+        if view_index >= len(render_views) or render_views[view_index].view_name != view_name:
+            raise DistillError(f'View "{view_name}" of {uri} is not at the same position in '
+                               f'this site\'s URLs, was it queued from a different version?')
+        return RenderTask(render_views[view_index], param_set, lang, True, uri)
+
+    def render_claimed(self, worker, claimed):
+        for task_id, uri, view_index, view_name, param_set, lang in claimed:
+            try:
+                task = self.get_task(view_index, view_name, param_set, lang, uri)
+                with self.limits.slot(task.view):
+                    page_uri, file_name, http_response = self.renderer.render_task(task)
+                write_page(self.output_dir, page_uri, file_name, http_response, self.stdout,
+                           normalizers=self.normalizers)
+            except Exception as err:
+                # record every failure in the queue, a worker must keep working
+                self.stdout('Failed to render page: {}: {}'.format(uri, err))
+                self.work_queue.fail(task_id, worker, err)
+                continue
+            self.work_queue.complete(task_id, worker)
+            with self._lock:
+                self.rendered += 1
+
+    def work(self):
+        worker = default_worker_id()
+        with self._lock:
+            self._workers.add(worker)
+        try:
+            while True:
+                claimed = self.work_queue.claim(worker, self.batch_size)
+                if claimed:
+                    self.render_claimed(worker, claimed)
+                    continue
+                if not self.work_queue.counts()[LEASED]:
+                    return
+                # other workers are still rendering, their tasks are claimed
+                # again if their leases expire
+                time.sleep(self.poll_interval)
+        finally:
+            with self._lock:
+                self._workers.discard(worker)
+            self.work_queue.close()
+            connections.close_all()
+
+    def heartbeat(self):
+        interval = self.work_queue.lease_time / 3
+        try:
+            while not self._stopped.wait(interval):
+                with self._lock:
+                    workers = list(self._workers)
+                for worker in workers:
+                    try:
+                        self.work_queue.renew(worker)
+                    except sqlite3.Error:
+                        # try again on the next beat, leases outlast several beats
+                        pass
+        finally:
+            self.work_queue.close()
+
+    def run(self):
+        threads = [threading.Thread(target=self._work, daemon=True)
+                   for i in range(max(self.parallel_render, 1))]
+        heartbeat = None
+        if self.work_queue.lease_time > 0:
+            heartbeat = threading.Thread(target=self.heartbeat, daemon=True)
+            heartbeat.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._stopped.set()
+        if heartbeat is not None:
+            heartbeat.join()
+        if self._errors:
+            raise self._errors[0]
+        return self.rendered
+
+    def _work(self):
+        try:
+            self.work()
+        except Exception as err:
+            self._errors.append(err)
@@ -0,0 +1,41 @@
+import threading
+from django_distill.distill import urls_to_distill
+
+
+def null(*args, **kwargs):
+    pass
+
+
+def get_view(name):
+    for u in urls_to_distill:
+        if u[4] == name:
+            return u
+    return False
+
+
+def get_views(*names):
+    return [get_view(name) for name in names]
+
+
+def get_view_with_params(name, param_sets):
+    '''
+        Returns a registered view with its distill_func replaced by a generator
+        over param_sets, and a list each parameter set is appended to as the
+        generator is consumed.
+    '''
+    consumed = []
+    def _param_gen():
+        for param_set in param_sets:
+            consumed.append(param_set)
+            yield param_set
+    return get_view(name)._replace(distill_func=_param_gen), consumed
+
+
+def join_timeout_helpers(timeout=5):
+    '''
+        Waits for the helper threads of renders abandoned after timing out to
+        finish, so they do not render pages during later tests.
+    '''
+    for thread in threading.enumerate():
+        if thread.name == 'distill-timeout-helper':
+            thread.join(timeout)
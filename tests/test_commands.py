@@ -1,5 +1,10 @@
+import os
 from importlib import import_module
-from django.test import TestCase
+from tempfile import TemporaryDirectory
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django_distill.journal import JOURNAL_NAME
 
 
 class DjangoDistillCommandTestSuite(TestCase):
@@ -12,3 +17,53 @@ class DjangoDistillCommandTestSuite(TestCase):
 
     def test_command_imports_distill_test_publish(self):
         import_module('django_distill.management.commands.distill-test-publish')
+
+    def test_command_imports_distill_watch(self):
+        import_module('django_distill.management.commands.distill-watch')
+
+    def test_command_imports_distill_refresh(self):
+        import_module('django_distill.management.commands.distill-refresh')
+
+    def test_command_imports_distill_merge(self):
+        import_module('django_distill.management.commands.distill-merge')
+
+    def test_command_imports_distill_enqueue(self):
+        import_module('django_distill.management.commands.distill-enqueue')
+
+    def test_command_imports_distill_worker(self):
+        import_module('django_distill.management.commands.distill-worker')
+
+    # the command allows every host, keep that out of the other tests
+    @override_settings(ALLOWED_HOSTS=[])
+    def test_distill_local_resume_rejects_selective_options(self):
+        for option in (['--only-view', 'path-positional-param'],
+                       ['--only-url-glob', '/path/*'],
+                       ['--urls-from-file', 'urls.txt']):
+            with TemporaryDirectory() as tempdir:
+                output_dir = os.path.join(tempdir, 'site')
+                with self.assertRaises(CommandError):
+                    call_command('distill-local', output_dir, '--resume', '--force',
+                                 '--quiet', '--exclude-staticfiles', *option)
+                self.assertFalse(os.path.exists(output_dir))
+
+    @override_settings(ALLOWED_HOSTS=[])
+    def test_distill_local_selective_build_keeps_journal(self):
+        with TemporaryDirectory() as tempdir:
+            journal_path = os.path.join(tempdir, JOURNAL_NAME)
+            with open(journal_path, 'wt') as f:
+                f.write('{"uri": "/path/12345", "lang": null, "path": "path/12345", '
+                        '"hash": "", "size": 0}\n')
+            call_command('distill-local', tempdir, '--only-view', 'path-positional-param',
+                         '--force', '--quiet', '--exclude-staticfiles')
+            self.assertTrue(os.path.exists(os.path.join(tempdir, 'path', '67890')))
+            # the journal of the interrupted full build is left to resume it
+            self.assertTrue(os.path.exists(journal_path))
+
+    @override_settings(ALLOWED_HOSTS=[])
+    def test_distill_local_async_rejects_incremental_options(self):
+        for option in ('--incremental', '--changed-only', '--conditional-requests'):
+            with TemporaryDirectory() as tempdir:
+                with self.assertRaises(CommandError):
+                    call_command('distill-local', tempdir, option, '--render-engine',
+                                 'async', '--force', '--quiet', '--exclude-staticfiles')
+                self.assertEqual(os.listdir(tempdir), [])
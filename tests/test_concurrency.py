@@ -0,0 +1,52 @@
+from django.test import TestCase
+from django_distill.concurrency import AdaptiveConcurrency, parse_parallel_render
+from django_distill.errors import DistillError
+from django_distill.renderer import DistillRender
+from tests.helpers import get_views
+
+
+class DjangoDistillConcurrencyTestSuite(TestCase):
+
+    def test_hill_climbing(self):
+        concurrency = AdaptiveConcurrency(minimum=1, maximum=8)
+        # throughput keeps improving up to 4 then drops off
+        throughput = {1: 10, 2: 19, 3: 27, 4: 30, 5: 29, 6: 28, 7: 27, 8: 26}
+        for i in range(20):
+            concurrency.adjust(throughput[concurrency.limit], 0.1)
+        self.assertIn(concurrency.limit, (3, 4, 5))
+        self.assertEqual(concurrency.settled(), 4)
+        self.assertIn('settled on 4', concurrency.describe())
+
+    def test_backs_off_when_db_latency_grows(self):
+        concurrency = AdaptiveConcurrency(minimum=1, maximum=8, initial=4)
+        concurrency.adjust(40, 0.1, db_latency=0.001)
+        self.assertEqual(concurrency.limit, 5)
+        # throughput still improved but database queries got much slower
+        concurrency.adjust(45, 0.1, db_latency=0.01)
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_stays_within_bounds(self):
+        concurrency = AdaptiveConcurrency(minimum=2, maximum=3)
+        self.assertEqual(concurrency.limit, 2)
+        for i in range(10):
+            concurrency.adjust(10 * (i + 1), 0.1)
+            self.assertIn(concurrency.limit, (2, 3))
+
+    def test_parse_parallel_render(self):
+        self.assertEqual(parse_parallel_render('4'), (4, None))
+        parallel_render, concurrency = parse_parallel_render('auto', 2, 6)
+        self.assertEqual(parallel_render, 6)
+        self.assertEqual((concurrency.minimum, concurrency.maximum), (2, 6))
+        with self.assertRaises(DistillError):
+            parse_parallel_render('lots')
+
+    def test_adaptive_render(self):
+        views = get_views('path-positional-param', 'path-named-param')
+        concurrency = AdaptiveConcurrency(minimum=1, maximum=4, window_time=0)
+        renderer = DistillRender(views, parallel_render=4, concurrency=concurrency)
+        rendered = {uri: render.content for uri, file_name, render in renderer.render_all_urls()}
+        self.assertEqual(rendered, {'/path/12345': b'test12345', '/path/67890': b'test67890',
+                                    '/path/test': b'testtest'})
+        self.assertTrue(concurrency.history)
+        with self.assertRaises(DistillError):
+            DistillRender(views, render_engine='async', concurrency=concurrency)
@@ -0,0 +1,127 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from django.conf import settings
+from django.test import TestCase, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.core.exceptions import MiddlewareNotUsed
+from django_distill.distill import urls_to_distill, DistillRegistry
+from django_distill.middleware import DistillISRMiddleware, CONTENT_TYPES_NAME
+from django_distill.renderer import DistillRender
+
+
+def fallback_view(request):
+    return HttpResponse(b'fallback')
+
+
+def read_response(response):
+    return b''.join(response.streaming_content) if response.streaming else response.content
+
+
+class DjangoDistillMiddlewareTestSuite(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @override_settings(DISTILL_DIR=None, DISTILL_ISR_DIR=None)
+    def test_middleware_not_used_without_output_dir(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            DistillISRMiddleware(fallback_view)
+
+    def test_render_on_miss_then_serve_file(self):
+        with TemporaryDirectory() as tempdir:
+            with override_settings(DISTILL_ISR_DIR=tempdir):
+                middleware = DistillISRMiddleware(fallback_view)
+            response = middleware(self.factory.get('/re_path/x/abc'))
+            self.assertEqual(read_response(response), b'testabc')
+            # pages are written to their distill_file path
+            full_path = os.path.join(tempdir, 're_path', 'x', 'abc.html')
+            with open(full_path, 'rb') as f:
+                self.assertEqual(f.read(), b'testabc')
+            # once written the file is served without rendering
+            with open(full_path, 'wb') as f:
+                f.write(b'from file')
+            response = middleware(self.factory.get('/re_path/x/abc'))
+            self.assertEqual(read_response(response), b'from file')
+            # with the Content-Type the view rendered it with
+            self.assertEqual(response['Content-Type'], 'application/octet-stream')
+            response.close()
+            self.assertTrue(os.path.exists(os.path.join(tempdir, CONTENT_TYPES_NAME)))
+            # requests which are not for distilled pages are passed through
+            response = middleware(self.factory.get('/re_path/x/abc?page=2'))
+            self.assertEqual(response.content, b'fallback')
+            response = middleware(self.factory.get('/not-a-distill-url'))
+            self.assertEqual(response.content, b'fallback')
+            response = middleware(self.factory.get('/path/broken'))
+            self.assertEqual(response.content, b'fallback')
+
+    def test_pages_which_are_not_written_are_passed_on(self):
+        with TemporaryDirectory() as tempdir:
+            with override_settings(DISTILL_ISR_DIR=tempdir):
+                middleware = DistillISRMiddleware(fallback_view)
+            # a 404 in the view's distill_status_codes renders without an error
+            with patch.object(DistillRender, 'render_view',
+                              return_value=HttpResponse(b'404', status=404)):
+                response = middleware(self.factory.get('/path/test'))
+            self.assertEqual(response.content, b'fallback')
+            self.assertEqual(os.listdir(tempdir), [])
+
+    def test_stale_pages_are_regenerated(self):
+        with TemporaryDirectory() as tempdir:
+            with override_settings(DISTILL_ISR_DIR=tempdir, DISTILL_ISR_TTL=60):
+                middleware = DistillISRMiddleware(fallback_view)
+            full_path = os.path.join(tempdir, 're_path', 'abc')
+            os.makedirs(os.path.dirname(full_path))
+            with open(full_path, 'wb') as f:
+                f.write(b'stale')
+            os.utime(full_path, (0, 0))
+            # the stale page is served while it is rendered again
+            response = middleware(self.factory.get('/re_path/abc'))
+            self.assertEqual(read_response(response), b'stale')
+            response.close()
+            middleware.executor.shutdown(wait=True)
+            with open(full_path, 'rb') as f:
+                self.assertEqual(f.read(), b'testabc')
+
+    def test_paths_outside_output_dir_are_refused(self):
+        with TemporaryDirectory() as tempdir:
+            output_dir = os.path.join(tempdir, 'site')
+            os.makedirs(os.path.join(output_dir, 're_path', 'flatpage'))
+            secret_path = os.path.join(tempdir, 'secret.txt')
+            with open(secret_path, 'wb') as f:
+                f.write(b'secret')
+            with override_settings(DISTILL_ISR_DIR=output_dir):
+                middleware = DistillISRMiddleware(fallback_view)
+            # reading a file outside the output directory
+            request = self.factory.get('/re_path/flatpage/../../../secret.txt')
+            self.assertEqual(request.path, '/re_path/flatpage/../../../secret.txt')
+            response = middleware(request)
+            self.assertEqual(response.content, b'fallback')
+            # writing a file outside the output directory
+            os.makedirs(os.path.join(output_dir, 're_path', 'x'))
+            response = middleware(self.factory.get('/re_path/x/../../../abc'))
+            self.assertEqual(response.content, b'fallback')
+            self.assertEqual(sorted(os.listdir(tempdir)), ['secret.txt', 'site'])
+
+    def test_view_is_found_by_matched_pattern(self):
+        named = {u.name: u for u in urls_to_distill}
+        # two URLs registered with the same name
+        views = DistillRegistry([named['path-no-param']._replace(name='same-name'),
+                                 named['re_path-named-param']._replace(name='same-name')])
+        with TemporaryDirectory() as tempdir:
+            with override_settings(DISTILL_ISR_DIR=tempdir):
+                middleware = DistillISRMiddleware(fallback_view)
+            middleware._renderer = DistillRender(views)
+            page = middleware.get_page(self.factory.get('/re_path/abc'))
+            self.assertIs(page[0], views[1])
+            page = middleware.get_page(self.factory.get('/path/'))
+            self.assertIs(page[0], views[0])
+
+    def test_allowed_hosts_are_not_changed(self):
+        with TemporaryDirectory() as tempdir:
+            with override_settings(DISTILL_ISR_DIR=tempdir, ALLOWED_HOSTS=['.example.com']):
+                middleware = DistillISRMiddleware(fallback_view)
+                response = middleware(self.factory.get('/re_path/x/abc',
+                                                       HTTP_HOST='www.example.com'))
+                self.assertEqual(read_response(response), b'testabc')
+                self.assertEqual(settings.ALLOWED_HOSTS, ['.example.com'])
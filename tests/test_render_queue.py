@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from django.test import TestCase
+from django_distill.render_queue import (RenderQueue, get_render_queue, queue_single_file,
+                                         flush_render_queues)
+
+
+class DjangoDistillRenderQueueTestSuite(TestCase):
+
+    def test_queued_pages_are_merged(self):
+        with TemporaryDirectory() as tempdir:
+            render_queue = RenderQueue(tempdir, delay=60, max_delay=120)
+            with patch.object(RenderQueue, 'render_page', autospec=True,
+                              side_effect=RenderQueue.render_page) as render_page:
+                for i in range(5):
+                    render_queue.add('path-named-param', kwargs={'param': 'test'})
+                render_queue.add('path-positional-param', args=('12345',))
+                self.assertEqual(render_queue.pending(), 2)
+                # nothing is due for a minute, flushing renders it now
+                self.assertTrue(render_queue.flush(timeout=10))
+            self.assertEqual(render_page.call_count, 2)
+            self.assertEqual(render_queue.pending(), 0)
+            with open(os.path.join(tempdir, 'path', 'test'), 'rb') as f:
+                self.assertEqual(f.read(), b'testtest')
+            with open(os.path.join(tempdir, 'path', '12345'), 'rb') as f:
+                self.assertEqual(f.read(), b'test12345')
+
+    def test_queued_pages_are_debounced(self):
+        with TemporaryDirectory() as tempdir:
+            render_queue = RenderQueue(tempdir, delay=0.2, max_delay=0.4)
+            render_queue.add('path-named-param', kwargs={'param': 'test'})
+            first_queued = time.monotonic()
+            full_path = os.path.join(tempdir, 'path', 'test')
+            self.assertFalse(os.path.exists(full_path))
+            # repeated requests push the render back, but never past max_delay
+            while time.monotonic() - first_queued < 0.3:
+                render_queue.add('path-named-param', kwargs={'param': 'test'})
+                time.sleep(0.05)
+            deadline = time.monotonic() + 10
+            while render_queue.pending() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertTrue(os.path.exists(full_path))
+
+    def test_failed_pages_do_not_stop_the_queue(self):
+        with TemporaryDirectory() as tempdir:
+            render_queue = RenderQueue(tempdir, delay=60)
+            render_queue.add('does-not-exist')
+            render_queue.add('path-named-param', kwargs={'param': 'test'})
+            with self.assertLogs('django_distill.render_queue', level='ERROR'):
+                self.assertTrue(render_queue.flush(timeout=10))
+            self.assertTrue(os.path.exists(os.path.join(tempdir, 'path', 'test')))
+
+    def test_failed_batches_do_not_stop_the_queue(self):
+        with TemporaryDirectory() as tempdir:
+            render_queue = RenderQueue(tempdir, delay=60)
+            render_queue.add('path-named-param', kwargs={'param': 'test'})
+            with patch.object(RenderQueue, 'get_renderer', side_effect=RuntimeError):
+                with self.assertLogs('django_distill.render_queue', level='ERROR'):
+                    self.assertTrue(render_queue.flush(timeout=10))
+            # the queue thread is still running and renders later pages
+            render_queue.add('path-named-param', kwargs={'param': 'test'})
+            self.assertTrue(render_queue.flush(timeout=10))
+            self.assertTrue(os.path.exists(os.path.join(tempdir, 'path', 'test')))
+
+    def test_flushing_render_queues_times_out(self):
+        with TemporaryDirectory() as tempdir:
+            render_queue = get_render_queue(tempdir)
+            hang = threading.Event()
+            try:
+                with patch.object(RenderQueue, 'render_page',
+                                  side_effect=lambda *args: hang.wait()):
+                    render_queue.add('path-named-param', kwargs={'param': 'test'})
+                    self.assertFalse(flush_render_queues(timeout=0.2))
+            finally:
+                hang.set()
+            self.assertTrue(render_queue.flush(timeout=10))
+
+    def test_queue_single_file_on_commit(self):
+        with TemporaryDirectory() as tempdir:
+            with self.captureOnCommitCallbacks() as callbacks:
+                render_queue = queue_single_file(tempdir, 'path-named-param', param='test')
+                self.assertEqual(render_queue.pending(), 0)
+            self.assertIs(render_queue, get_render_queue(tempdir))
+            for callback in callbacks:
+                callback()
+            self.assertEqual(render_queue.pending(), 1)
+            self.assertTrue(render_queue.flush(timeout=10))
+            self.assertTrue(os.path.exists(os.path.join(tempdir, 'path', 'test')))
@@ -1,6 +1,8 @@
 import os
 import sys
 import tempfile
+import threading
+import time
 from datetime import datetime, timedelta
 from unittest.mock import patch
 from django.test import TestCase, override_settings
@@ -9,16 +11,29 @@ from django.contrib.flatpages.models import FlatPage
 from django.apps import apps as django_apps
 from django.utils import timezone
 from django.utils.translation import activate as activate_lang
-from django_distill.distill import urls_to_distill
-from django_distill.renderer import DistillRender, render_to_dir, render_single_file, get_renderer
+from django_distill.distill import urls_to_distill, DistillRegistry
+from django_distill.renderer import (DistillRender, DistillHandler, render_to_dir,
+                                     render_single_file, get_renderer, read_url_list)
+from django_distill.manifest import BuildManifest
+from django_distill.journal import BuildJournal
+from django_distill.dependencies import DependencyState, unchanged_uris
+from django_distill.normalize import (normalize_content, strip_csrf_tokens,
+                                      strip_volatile_regions, substitute)
 from django_distill.errors import DistillError
-from django_distill import distilled_urls
+from django_distill import distilled_urls, distill_path
+from tests.helpers import get_view_with_params, join_timeout_helpers
 
 
 class CustomRender(DistillRender):
     pass
 
 
+class OldStyleRender(DistillRender):
+
+    def __init__(self, urls_to_distill, parallel_render=1):
+        super().__init__(urls_to_distill, parallel_render)
+
+
 class DjangoDistillRendererTestSuite(TestCase):
 
     def setUp(self):
@@ -84,6 +99,21 @@ class DjangoDistillRendererTestSuite(TestCase):
             with self.assertRaises(DistillError):
                 self.renderer.get_uri_values(lambda: invalid, None)
 
+    def test_distill_func_generators_are_lazy(self):
+        lazy_view, consumed = get_view_with_params('path-positional-param',
+                                                   [str(i) for i in range(100)])
+        self.assertIsInstance(self.renderer.get_uri_values(lazy_view.distill_func,
+                                                           lazy_view.name),
+                              type(lazy_view.distill_func()))
+        renderer = DistillRender([lazy_view], parallel_render=2)
+        results = renderer.render_all_urls()
+        uri, file_name, render = next(results)
+        self.assertEqual(uri, '/path/0')
+        self.assertEqual(render.content, b'test0')
+        self.assertLessEqual(len(consumed), renderer.queue_size + 1)
+        self.assertEqual(len(list(results)), 99)
+        self.assertEqual(len(consumed), 100)
+
     def test_re_path_no_param(self):
         if not settings.HAS_RE_PATH:
             self._skip('django.urls.re_path')
@@ -247,6 +277,24 @@ class DjangoDistillRendererTestSuite(TestCase):
                 self.assertIn(filepath, written_files)
         #self.assertEqual(render_view_spy.call_count, 34)
 
+    @override_settings(DISTILL_RENDERER='tests.test_renderer.OldStyleRender')
+    def test_render_custom_renderer_without_render_options(self):
+        views = [self._get_view('path-named-param')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            # the options distill-local passes when none of its flags are used
+            render_to_dir(tmpdirname, views, lambda msg: None, parallel_render=1,
+                          concurrency=None, render_engine='thread',
+                          max_tasks_per_worker=None, queue_size=None, ordered=True,
+                          continue_on_error=False, canary=False,
+                          track_dependencies=False, uri_filter=None,
+                          conditional_headers=None, only_views=None, only_urls=None,
+                          only_url_globs=None, shard=None, schedule='registration',
+                          durations=None)
+            with open(os.path.join(tmpdirname, 'path', 'test'), 'rb') as f:
+                self.assertEqual(f.read(), b'testtest')
+            with self.assertRaisesRegex(DistillError, 'continue_on_error'):
+                render_to_dir(tmpdirname, views, lambda msg: None, continue_on_error=True)
+
     def test_sessions_are_ignored(self):
         if settings.HAS_PATH:
             view = self._get_view('path-ignore-sessions')
@@ -348,14 +396,62 @@ class DjangoDistillRendererTestSuite(TestCase):
         self.assertEqual(render.content, expected_content)
         self.assertEqual(render.status_code, 200)
 
+    def test_registry_indexes(self):
+        view = urls_to_distill.get('path-named-param')
+        self.assertEqual(view, self._get_view('path-named-param'))
+        self.assertEqual(view.name, 'path-named-param')
+        self.assertIsNone(urls_to_distill.get('does-not-exist'))
+        # namespaces are indexed when a renderer is created
+        view = urls_to_distill.get('test_namespace:sub_test_namespace:test_url_in_namespace')
+        self.assertEqual(view.distill_file, 'test_url_in_sub_namespace')
+        view = urls_to_distill.get('test_namespace:test_url_in_namespace')
+        self.assertEqual(view.distill_file, 'test_url_in_namespace')
+        self.assertIs(self.renderer.namespace_map, DistillRender(urls_to_distill).namespace_map)
+
+    def test_url_builder(self):
+        settings.DISTILL_LANGUAGES = ['en', 'fr']
+        try:
+            for lang in self.renderer.get_langs():
+                activate_lang(lang)
+                for view in urls_to_distill:
+                    view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+                    url_builder = self.renderer.url_builders[view_url]
+                    for param_set in self.renderer.get_uri_values(view_func, view_name):
+                        if not param_set:
+                            param_set = ()
+                        elif isinstance(param_set, str):
+                            param_set = (param_set,)
+                        uri = self.renderer.generate_uri(view_url, view_name, param_set)
+                        expected = self.renderer.reverse_uri(view_url, view_name, param_set)
+                        self.assertEqual(uri, expected)
+                        self.assertFalse(url_builder.disabled)
+        finally:
+            settings.DISTILL_LANGUAGES = []
+            activate_lang(settings.LANGUAGE_CODE)
+        view = self._get_view('path-named-param')
+        view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+        url_builder = self.renderer.url_builders[view_url]
+        with patch('django_distill.renderer.reverse') as reverse_spy:
+            uri = self.renderer.generate_uri(view_url, view_name, {'param': 'a b'})
+            self.assertEqual(uri, '/path/a%20b')
+            reverse_spy.assert_not_called()
+        # patterns which cannot be matched fall back to reverse()
+        with patch('django_distill.renderer.reverse', return_value='/reversed') as reverse_spy:
+            uri = self.renderer.generate_uri(view_url, view_name, {'other': 'test'})
+            self.assertEqual(uri, '/reversed')
+            reverse_spy.assert_called_once()
+
     def test_render_single_file(self):
         expected_files = (
             ('path', '12345'),
             ('path', 'test'),
+            ('test_url_in_sub_namespace',),
         )
         with tempfile.TemporaryDirectory() as tmpdirname:
             render_single_file(tmpdirname, 'path-positional-param', 12345)
             render_single_file(tmpdirname, 'path-named-param', param='test')
+            render_single_file(tmpdirname,
+                               'test_namespace:sub_test_namespace:test_url_in_namespace')
             written_files = []
             for (root, dirs, files) in os.walk(tmpdirname):
                 for f in files:
@@ -415,6 +511,23 @@ class DjangoDistillRendererTestSuite(TestCase):
                 self.assertIn(filepath, written_files)
         settings.DISTILL_LANGUAGES = []
 
+    def test_i18n_unprefixed_urls_render_once(self):
+        settings.DISTILL_LANGUAGES = ['en', 'fr', 'de']
+        try:
+            views = [self._get_view('path-named-param'), self._get_view('test-url-i18n')]
+            renderer = DistillRender(views, parallel_render=2)
+            self.assertFalse(renderer.is_i18n_url(views[0][0]))
+            self.assertTrue(renderer.is_i18n_url(views[1][0]))
+            uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+            self.assertEqual(sorted(uris), sorted([
+                '/path/test',
+                '/en/path/i18n/sub-url-with-i18n-prefix',
+                '/fr/path/i18n/sub-url-with-i18n-prefix',
+                '/de/path/i18n/sub-url-with-i18n-prefix',
+            ]))
+        finally:
+            settings.DISTILL_LANGUAGES = []
+
     def test_kwargs(self):
         if not settings.HAS_PATH:
             self._skip('django.urls.path')
@@ -469,6 +582,20 @@ class DjangoDistillRendererTestSuite(TestCase):
         render = self.renderer.render_view(uri, status_codes, param_set, args, kwargs)
         self.assertEqual(render.content, b"test_request_has_resolver_match")
 
+    @patch.object(DistillHandler, 'load_middleware', side_effect=DistillHandler.load_middleware, autospec=True)
+    def test_handler_is_reused(self, load_middleware_spy):
+        view = self._get_view('path-positional-param')
+        assert view
+        view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+        handler = self.renderer.get_handler()
+        for param in ('12345', '67890'):
+            param_set = (param,)
+            uri = self.renderer.generate_uri(view_url, view_name, param_set)
+            render = self.renderer.render_view(uri, status_codes, param_set, args)
+            self.assertEqual(render.content, b'test' + param.encode())
+            self.assertIs(self.renderer.get_handler(), handler)
+        self.assertEqual(load_middleware_spy.call_count, 1)
+
     def test_parallel_rendering(self):
         def _blackhole(_):
             pass
@@ -491,6 +618,455 @@ class DjangoDistillRendererTestSuite(TestCase):
                 filepath = os.path.join(tmpdirname, *expected_file)
                 self.assertIn(filepath, written_files)
 
+    def test_render_tasks_are_compact(self):
+        view = self._get_view('path-positional-param')
+        renderer = DistillRender([view])
+        tasks = list(renderer.iter_render_tasks())
+        self.assertEqual([t.param_set for t in tasks], [('12345',), ('67890',)])
+        self.assertIs(tasks[0].view, tasks[1].view)
+        self.assertEqual(tasks[0].view.view_name, 'path-positional-param')
+        self.assertFalse(hasattr(tasks[0], '__dict__'))
+        self.assertLess(sys.getsizeof(tasks[0]), 100)
+
+    def test_unordered_rendering(self):
+        view = self._get_view('path-positional-param')
+        assert view
+        view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+        param_gen = lambda: (str(i) for i in range(50))
+        unordered_view = (view_url, param_gen, file_name, status_codes, view_name, args, kwargs)
+        renderer = DistillRender([unordered_view], parallel_render=4, queue_size=8,
+                                 ordered=False)
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        self.assertEqual(sorted(uris), sorted(f'/path/{i}' for i in range(50)))
+
+    def test_async_view(self):
+        view = self._get_view('test-async')
+        assert view
+        view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+        uri = self.renderer.generate_uri(view_url, view_name, ())
+        self.assertEqual(uri, '/path/async')
+        render = self.renderer.render_view(uri, status_codes, (), args, kwargs)
+        self.assertEqual(render.content, b'test-async')
+
+    def test_async_rendering_does_not_track_dependencies(self):
+        with self.assertRaises(DistillError):
+            DistillRender(urls_to_distill, render_engine='async', track_dependencies=True)
+
+    def test_async_rendering(self):
+        def _blackhole(_):
+            pass
+        expected_files = (
+            ('test',),
+            ('re_path', '12345'),
+            ('re_path', 'test'),
+            ('re_path', 'x', '12345.html'),
+            ('re_path', 'x', 'test.html'),
+        )
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with self.assertRaises(DistillError):
+                render_to_dir(tmpdirname, urls_to_distill, _blackhole, parallel_render=4,
+                              render_engine='async')
+            written_files = []
+            for (root, dirs, files) in os.walk(tmpdirname):
+                for f in files:
+                    filepath = os.path.join(root, f)
+                    written_files.append(filepath)
+            for expected_file in expected_files:
+                filepath = os.path.join(tmpdirname, *expected_file)
+                self.assertIn(filepath, written_files)
+        view = self._get_view('test-async')
+        renderer = DistillRender([view], parallel_render=4, render_engine='async')
+        results = list(renderer.render_all_urls())
+        self.assertEqual(len(results), 1)
+        uri, file_name, render = results[0]
+        self.assertEqual(uri, '/path/async')
+        self.assertEqual(render.content, b'test-async')
+
+    def test_conditional_requests(self):
+        def _blackhole(_):
+            pass
+        view = self._get_view('test-conditional')
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            manifest = BuildManifest(tmpdirname)
+            render_to_dir(tmpdirname, [view], _blackhole, manifest=manifest)
+            self.assertEqual(manifest.new_files['path/conditional']['etag'], '"test-etag"')
+            manifest.save()
+            manifest = BuildManifest.load(tmpdirname)
+            self.assertEqual(manifest.conditional_headers('/path/conditional'),
+                             {'HTTP_IF_NONE_MATCH': '"test-etag"'})
+            renderer = DistillRender([view], conditional_headers=manifest.conditional_headers)
+            (uri, file_name, render), = renderer.render_all_urls()
+            self.assertEqual(render.status_code, 304)
+            self.assertTrue(render.distill_not_modified)
+            # a 304 keeps the existing file and its manifest entry
+            full_path = os.path.join(tmpdirname, 'path', 'conditional')
+            os.utime(full_path, (0, 0))
+            render_to_dir(tmpdirname, [view], _blackhole, manifest=manifest,
+                          conditional_headers=manifest.conditional_headers)
+            self.assertEqual(os.path.getmtime(full_path), 0)
+            self.assertEqual(manifest.new_files['path/conditional'],
+                             manifest.files['path/conditional'])
+            # pages whose file is missing are requested unconditionally
+            os.unlink(full_path)
+            self.assertIsNone(manifest.conditional_headers('/path/conditional'))
+
+    def test_render_errors_cancel_pending_work(self):
+        view, consumed = get_view_with_params('path-positional-param',
+                                              [str(i) for i in range(100)])
+        views = [self._get_view('path-broken'), view]
+        renderer = DistillRender(views, parallel_render=2, queue_size=4)
+        with self.assertRaises(DistillError):
+            list(renderer.render_all_urls())
+        self.assertLess(len(consumed), 10)
+
+    def test_render_errors_continue(self):
+        def _blackhole(_):
+            pass
+        views = [self._get_view('re_path-broken'), self._get_view('path-404'),
+                 self._get_view('path-broken'), self._get_view('path-named-param')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with self.assertRaises(DistillError) as cm:
+                render_to_dir(tmpdirname, views, _blackhole, parallel_render=4,
+                              continue_on_error=True)
+            self.assertIn('2 page(s) failed to render', str(cm.exception))
+            self.assertIn('/re_path/broken', str(cm.exception))
+            self.assertIn('/path/broken', str(cm.exception))
+            # pages after the broken views are still rendered
+            for expected_file in (('path', '404'), ('path', 'test')):
+                filepath = os.path.join(tmpdirname, *expected_file)
+                self.assertTrue(os.path.exists(filepath))
+
+    def test_incremental_render(self):
+        def _blackhole(_):
+            pass
+        views = [self._get_view('path-positional-param'), self._get_view('path-named-param')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            manifest = BuildManifest(tmpdirname)
+            render_to_dir(tmpdirname, views, _blackhole, manifest=manifest)
+            manifest.save()
+            manifest = BuildManifest.load(tmpdirname)
+            self.assertEqual(manifest.files['path/test']['uri'], '/path/test')
+            self.assertEqual(manifest.files['path/test']['size'], len(b'testtest'))
+            # unchanged pages are not rewritten, changed pages are
+            unchanged_path = os.path.join(tmpdirname, 'path', '12345')
+            changed_path = os.path.join(tmpdirname, 'path', 'test')
+            os.utime(unchanged_path, (0, 0))
+            with open(changed_path, 'wb') as f:
+                f.write(b'old!')
+            manifest.files['path/test']['hash'] = 'old'
+            render_to_dir(tmpdirname, views, _blackhole, manifest=manifest)
+            self.assertEqual(os.path.getmtime(unchanged_path), 0)
+            with open(changed_path, 'rb') as f:
+                self.assertEqual(f.read(), b'testtest')
+            # pages which are no longer part of the site are removed
+            manifest.save()
+            manifest = BuildManifest.load(tmpdirname)
+            render_to_dir(tmpdirname, views[1:], _blackhole, manifest=manifest)
+            manifest.remove_orphans(_blackhole)
+            self.assertFalse(os.path.exists(unchanged_path))
+            self.assertTrue(os.path.exists(changed_path))
+
+    def test_revalidate(self):
+        def _blackhole(_):
+            pass
+        view = self._get_view('path-positional-param')
+        self.assertEqual(urls_to_distill.get_revalidate(view), 300)
+        self.assertIsNone(urls_to_distill.get_revalidate(self._get_view('path-named-param')))
+        with self.assertRaises(DistillError):
+            distill_path('path/revalidate', lambda request: None, name='path-revalidate',
+                         distill_revalidate=-1)
+        views = [view, self._get_view('path-named-param')]
+        ttls = {'path-positional-param': 300}
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            manifest = BuildManifest(tmpdirname)
+            render_to_dir(tmpdirname, views, _blackhole, manifest=manifest)
+            manifest.files = manifest.new_files
+            self.assertEqual(manifest.stale_uris(ttls.get), set())
+            manifest.files['path/12345']['rendered'] -= 301
+            manifest.files['path/test']['rendered'] -= 86400
+            self.assertEqual(manifest.stale_uris(ttls.get), {'/path/12345'})
+            self.assertEqual(manifest.stale_uris(lambda view_name: 3600), {'/path/test'})
+
+    def test_longest_first_schedule(self):
+        def _blackhole(_):
+            pass
+        views = [self._get_view('path-positional-param'), self._get_view('path-named-param')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            manifest = BuildManifest(tmpdirname)
+            render_to_dir(tmpdirname, views, _blackhole, manifest=manifest)
+            manifest.files = manifest.new_files
+            durations = manifest.render_durations()
+            self.assertEqual(set(durations), {'/path/12345', '/path/67890', '/path/test'})
+            self.assertEqual(durations['/path/test'][0], 'path-named-param')
+        durations = {'/path/12345': ('path-positional-param', 1),
+                     '/path/67890': ('path-positional-param', 5)}
+        renderer = DistillRender(views, schedule='longest-first', durations=durations)
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        # unknown pages are estimated with their view's average, or every page's
+        self.assertEqual(uris, ['/path/67890', '/path/test', '/path/12345'])
+        durations['/path/test2'] = ('path-named-param', 10)
+        renderer = DistillRender(views, schedule='longest-first', durations=durations)
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        self.assertEqual(uris, ['/path/test', '/path/67890', '/path/12345'])
+        with self.assertRaises(DistillError):
+            DistillRender(views, schedule='shortest-first')
+
+    def test_view_concurrency_limits_and_timeouts(self):
+        view = self._get_view('path-positional-param')
+        views = DistillRegistry([view])
+        views.max_concurrency[view.url] = 1
+        running, most_running = [0], [0]
+        lock = threading.Lock()
+        render_view = DistillRender.render_view
+        def _slow_render_view(renderer, *args, **kwargs):
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return render_view(renderer, *args, **kwargs)
+        with patch.object(DistillRender, 'render_view', autospec=True,
+                          side_effect=_slow_render_view):
+            renderer = DistillRender(views, parallel_render=4)
+            self.assertEqual(len(list(renderer.render_all_urls())), 2)
+            self.assertEqual(most_running[0], 1)
+            # renders which take longer than their timeout fail rather than hang
+            views.timeouts[view.url] = 0.01
+            renderer = DistillRender(views, parallel_render=2)
+            with self.assertRaisesRegex(DistillError, '/path/12345.*timed out'):
+                list(renderer.render_all_urls())
+            join_timeout_helpers()
+        with self.assertRaises(DistillError):
+            distill_path('path/limited', lambda request: None, name='path-limited',
+                         distill_max_concurrency=0)
+        with self.assertRaises(DistillError):
+            distill_path('path/limited', lambda request: None, name='path-limited',
+                         distill_timeout='soon')
+
+    def test_limited_views_do_not_hold_up_other_views(self):
+        limited, _ = get_view_with_params('re_path-positional-param',
+                                          [(str(i),) for i in range(20)])
+        other, _ = get_view_with_params('re_path-named-param',
+                                        [{'param': 'p{}'.format(i)} for i in range(4)])
+        views = DistillRegistry([limited, other])
+        views.max_concurrency[limited.url] = 1
+        finished = []
+        lock = threading.Lock()
+        render_view = DistillRender.render_view
+        def _slow_render_view(renderer, uri, *args, **kwargs):
+            time.sleep(0.02)
+            render = render_view(renderer, uri, *args, **kwargs)
+            with lock:
+                finished.append(uri)
+            return render
+        with patch.object(DistillRender, 'render_view', autospec=True,
+                          side_effect=_slow_render_view):
+            renderer = DistillRender(views, parallel_render=4)
+            self.assertEqual(len(list(renderer.render_all_urls())), 24)
+        # the other view's pages render alongside the limited view's pages
+        # rather than queueing up behind them
+        last_other = max(finished.index('/re_path/p{}'.format(i)) for i in range(4))
+        self.assertLess(last_other, 12)
+
+    def test_timed_out_renders_release_their_view_limit(self):
+        view, _ = get_view_with_params('re_path-positional-param', [('1',), ('2',)])
+        views = DistillRegistry([view])
+        views.max_concurrency[view.url] = 1
+        views.timeouts[view.url] = 0.2
+        hang = threading.Event()
+        render_view = DistillRender.render_view
+        def _hanging_render_view(renderer, uri, *args, **kwargs):
+            if uri == '/re_path/1':
+                # never returns until the test is done
+                hang.wait()
+            return render_view(renderer, uri, *args, **kwargs)
+        try:
+            with patch.object(DistillRender, 'render_view', autospec=True,
+                              side_effect=_hanging_render_view):
+                for render_engine in ('thread', 'process'):
+                    # recycled process workers exit with the hung render
+                    renderer = DistillRender(views, parallel_render=1,
+                                             continue_on_error=True,
+                                             render_engine=render_engine,
+                                             max_tasks_per_worker=1)
+                    rendered = []
+                    with self.assertRaisesRegex(DistillError, '/re_path/1.*timed out'):
+                        for uri, file_name, render in renderer.render_all_urls():
+                            rendered.append(uri)
+                    # the second page rendered while the first was still hanging
+                    self.assertEqual(rendered, ['/re_path/2'])
+        finally:
+            hang.set()
+        # stopped helpers close their database connections and exit
+        join_timeout_helpers()
+        self.assertFalse([t for t in threading.enumerate()
+                          if t.name == 'distill-timeout-helper'])
+
+    def test_dependency_tracking(self):
+        view = self._get_view('path-flatpage')
+        view_url, view_func, file_name, status_codes, view_name, args, kwargs = view
+        renderer = DistillRender(urls_to_distill, track_dependencies=True)
+        param = {'url': '/flat/page1.html'}
+        uri = renderer.generate_uri(view_url, view_name, param)
+        render = renderer.render_view(uri, status_codes, param, args)
+        tables, templates = render.distill_dependencies
+        self.assertIn('django_flatpage', tables)
+        self.assertTrue(any(t.endswith('flatpage.html') for t in templates))
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            full_path = os.path.join(tmpdirname, 'page1.html')
+            with open(full_path, 'wb') as f:
+                f.write(render.content)
+            manifest = BuildManifest(tmpdirname)
+            manifest.record_page(full_path, uri, 'hash', len(render.content),
+                                 render.distill_dependencies)
+            manifest.files = manifest.new_files
+            manifest.dependencies = DependencyState().snapshot(manifest.files)
+            self.assertEqual(unchanged_uris(manifest, DependencyState()), {uri})
+            # editing a flatpage changes the fingerprint of its table
+            FlatPage.objects.filter(url='/flat/page2.html').update(content='edited')
+            self.assertEqual(unchanged_uris(manifest, DependencyState()), set())
+            manifest.dependencies = DependencyState().snapshot(manifest.files)
+            self.assertEqual(unchanged_uris(manifest, DependencyState()), {uri})
+            # adding a flatpage changes the fingerprint of its table
+            FlatPage.objects.create(url='/flat/page3.html', title='flatpage3')
+            self.assertEqual(unchanged_uris(manifest, DependencyState()), set())
+        # pages excluded by the URI filter are not rendered
+        views = [self._get_view('path-positional-param')]
+        renderer = DistillRender(views, uri_filter=lambda uri: uri != '/path/12345')
+        rendered = {uri: render for uri, file_name, render in renderer.render_all_urls()}
+        self.assertIsNone(rendered['/path/12345'])
+        self.assertEqual(rendered['/path/67890'].content, b'test67890')
+
+    def test_normalize_content(self):
+        html = ('<form><input type="hidden" name="csrfmiddlewaretoken" value="abc123">'
+                '</form><!-- distill:volatile --><p>Built at 12:00</p>'
+                '<!-- /distill:volatile --><p>content</p>')
+        normalizers = [strip_csrf_tokens, strip_volatile_regions]
+        normalized = normalize_content(html.encode(), 'text/html; charset=utf-8', 'utf-8',
+                                       normalizers)
+        self.assertEqual(normalized, b'<form></form><p>content</p>')
+        # non-text content is never changed
+        self.assertEqual(normalize_content(html.encode(), 'image/png', None, normalizers),
+                         html.encode())
+
+    @override_settings(DISTILL_NORMALIZE=[substitute(r'naturaltime: [^<]+', 'naturaltime: -'),
+                                          'django_distill.normalize.strip_csrf_tokens'])
+    def test_render_normalized(self):
+        def _blackhole(_):
+            pass
+        views = [self._get_view('test-humanize'), self._get_view('path-positional-param')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            render_to_dir(tmpdirname, views, _blackhole)
+            with open(os.path.join(tmpdirname, 'path', 'humanize'), 'rb') as f:
+                self.assertEqual(f.read().count(b'naturaltime: -<'), 2)
+            # only text content is normalised
+            with open(os.path.join(tmpdirname, 'path', '12345'), 'rb') as f:
+                self.assertEqual(f.read(), b'test12345')
+
+    @override_settings(DISTILL_NORMALIZE=['django_distill.normalize.does_not_exist'])
+    def test_render_normalized_invalid_rule(self):
+        def _blackhole(_):
+            pass
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with self.assertRaises(DistillError):
+                render_to_dir(tmpdirname, [self._get_view('path-no-param')], _blackhole)
+
+    def test_resume_render(self):
+        def _blackhole(_):
+            pass
+        views = [self._get_view('path-positional-param'), self._get_view('path-broken')]
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            journal = BuildJournal(tmpdirname)
+            with self.assertRaises(DistillError):
+                render_to_dir(tmpdirname, views, _blackhole, journal=journal)
+            # the journal is flushed even though the build failed
+            journal = BuildJournal.load(tmpdirname)
+            self.assertEqual(set(journal.entries), {'/path/12345', '/path/67890'})
+            self.assertEqual(journal.get('/path/12345')['lang'], settings.LANGUAGE_CODE)
+            self.assertEqual(journal.completed_uris(), {'/path/12345', '/path/67890'})
+            # pages whose output is no longer intact are rendered again
+            with open(os.path.join(tmpdirname, 'path', '67890'), 'wb') as f:
+                f.write(b'trunc')
+            completed = journal.completed_uris()
+            self.assertEqual(completed, {'/path/12345'})
+            renderer = DistillRender(views[:1], uri_filter=lambda uri: uri not in completed)
+            rendered = {uri: render for uri, file_name, render in renderer.render_all_urls()}
+            self.assertIsNone(rendered['/path/12345'])
+            self.assertEqual(rendered['/path/67890'].content, b'test67890')
+            journal.remove()
+            self.assertFalse(os.path.exists(journal.path))
+
+    def test_selective_rendering(self):
+        view, called = get_view_with_params('path-named-param', [{'param': 'test'}])
+        views = [self._get_view('path-positional-param'),
+                 self._get_view('path-positional-param-custom'), view]
+        renderer = DistillRender(views, only_views=['path-positional-param'])
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        self.assertEqual(uris, ['/path/12345', '/path/67890'])
+        self.assertEqual(called, [])
+        renderer = DistillRender(views, only_urls={'/path/67890', '/path/x/12345'})
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        self.assertEqual(uris, ['/path/67890', '/path/x/12345'])
+        self.assertEqual(called, [])
+        renderer = DistillRender(views, only_url_globs=['/path/x/*', '/path/te?t'])
+        uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+        self.assertEqual(uris, ['/path/x/12345', '/path/x/67890', '/path/test'])
+        self.assertEqual(called, [{'param': 'test'}])
+        with self.assertRaises(DistillError):
+            list(DistillRender(views, only_views=['does-not-exist']).render_all_urls())
+
+    def test_selective_rendering_of_views_sharing_a_name(self):
+        def _selected_uris(only_views):
+            renderer = DistillRender(urls_to_distill, only_views=only_views)
+            return [uri for uri, file_name, render in renderer.render_all_urls()]
+        both = ['/path/namespace1/sub-url-in-namespace',
+                '/path/namespace1/path/sub-namespace/sub-url-in-sub-namespace']
+        self.assertEqual(_selected_uris(['test_url_in_namespace']), both)
+        self.assertEqual(_selected_uris(['test_namespace:test_url_in_namespace']), both[:1])
+        name = 'test_namespace:sub_test_namespace:test_url_in_namespace'
+        self.assertEqual(_selected_uris([name]), both[1:])
+
+    def test_read_url_list(self):
+        lines = ['/path/12345\n', '\n', '# comment\n',
+                 'https://example.com/path/x/12345?query\n']
+        self.assertEqual(read_url_list(lines), {'/path/12345', '/path/x/12345'})
+
+    def test_canary_render(self):
+        view, consumed = get_view_with_params('path-positional-param',
+                                              [str(i) for i in range(100)])
+        views = [view, self._get_view('path-broken')]
+        renderer = DistillRender(views, parallel_render=2, canary=True)
+        with self.assertRaises(DistillError) as cm:
+            list(renderer.render_all_urls())
+        self.assertIn('Canary render of view "path-broken" failed', str(cm.exception))
+        self.assertEqual(consumed, ['0'])
+
+    def test_process_rendering(self):
+        def _blackhole(_):
+            pass
+        expected_files = (
+            ('test',),
+            ('re_path', '12345'),
+            ('re_path', 'test'),
+            ('re_path', 'x', '12345.html'),
+            ('re_path', 'x', 'test.html'),
+        )
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            with self.assertRaises(DistillError):
+                render_to_dir(tmpdirname, urls_to_distill, _blackhole, parallel_render=2,
+                              render_engine='process', max_tasks_per_worker=4)
+            written_files = []
+            for (root, dirs, files) in os.walk(tmpdirname):
+                for f in files:
+                    filepath = os.path.join(root, f)
+                    written_files.append(filepath)
+            for expected_file in expected_files:
+                filepath = os.path.join(tmpdirname, *expected_file)
+                self.assertIn(filepath, written_files)
+            with open(os.path.join(tmpdirname, 're_path', 'x', '12345.html'), 'rb') as f:
+                self.assertEqual(f.read(), b'test12345')
+
     def test_generate_urls(self):
         urls = distilled_urls()
         generated_urls = []
@@ -530,6 +1106,8 @@ class DjangoDistillRendererTestSuite(TestCase):
             '/path/test-sitemap',
             '/path/kwargs',
             '/path/humanize',
-            '/path/has-resolver-match'
+            '/path/has-resolver-match',
+            '/path/async',
+            '/path/conditional',
         )
         self.assertEqual(sorted(generated_urls), sorted(expected_urls))
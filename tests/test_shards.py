@@ -0,0 +1,63 @@
+import os
+from tempfile import TemporaryDirectory
+from django.test import TestCase
+from django_distill.errors import DistillError
+from django_distill.manifest import BuildManifest
+from django_distill.renderer import DistillRender, render_to_dir
+from django_distill.shards import parse_shard, uri_shard, merge_build_dirs
+from tests.helpers import null, get_views
+
+
+class DjangoDistillShardsTestSuite(TestCase):
+
+    def _get_views(self):
+        return get_views('path-positional-param', 'path-positional-param-custom',
+                         'path-named-param')
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        self.assertEqual(parse_shard('4/4'), (4, 4))
+        for value in ('0/4', '5/4', '1/0', '1', 'a/b', '1/2/3'):
+            with self.assertRaises(DistillError):
+                parse_shard(value)
+        self.assertEqual(uri_shard('/path/12345', 3), uri_shard('/path/12345', 3))
+        self.assertEqual(uri_shard('/path/12345', 1), 1)
+
+    def test_sharded_rendering(self):
+        views = self._get_views()
+        all_uris = [uri for uri, file_name, render in
+                    DistillRender(views).render_all_urls(do_render=False)]
+        shard_uris = []
+        for index in range(1, 4):
+            renderer = DistillRender(views, shard=(index, 3))
+            uris = [uri for uri, file_name, render in renderer.render_all_urls()]
+            self.assertTrue(all(uri_shard(uri, 3) == index for uri in uris))
+            shard_uris.extend(uris)
+        # every page is rendered by exactly one shard
+        self.assertEqual(sorted(shard_uris), sorted(all_uris))
+
+    def test_merge_build_dirs(self):
+        views = self._get_views()
+        with TemporaryDirectory() as tempdir:
+            shard_dirs = []
+            for index in range(1, 3):
+                shard_dir = os.path.join(tempdir, 'shard{}'.format(index))
+                os.makedirs(shard_dir)
+                manifest = BuildManifest(shard_dir)
+                render_to_dir(shard_dir, views, null, manifest=manifest, shard=(index, 2))
+                manifest.save()
+                shard_dirs.append(shard_dir)
+            output_dir = os.path.join(tempdir, 'site')
+            merge_build_dirs(output_dir, shard_dirs, null)
+            manifest = BuildManifest.load(output_dir)
+            self.assertEqual(set(manifest.files),
+                             {'path/12345', 'path/67890', 'path/x/12345.html',
+                              'path/x/67890.html', 'path/test'})
+            for local_path in manifest.files:
+                self.assertTrue(os.path.exists(os.path.join(output_dir, local_path)))
+            # shards rendering the same file differently cannot be merged
+            os.makedirs(os.path.join(shard_dirs[1], 'path'), exist_ok=True)
+            with open(os.path.join(shard_dirs[1], 'path', '12345'), 'wb') as f:
+                f.write(b'different')
+            with self.assertRaises(DistillError):
+                merge_build_dirs(os.path.join(tempdir, 'site2'), shard_dirs, null)
@@ -0,0 +1,53 @@
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from django.test import TestCase
+from django_distill.manifest import BuildManifest
+from django_distill.renderer import DistillRender
+from django_distill.watcher import SiteWatcher
+from tests.helpers import null, get_views
+
+
+class DjangoDistillWatcherTestSuite(TestCase):
+
+    def test_watch_renders_affected_pages(self):
+        views = get_views('test-humanize', 'path-positional-param')
+        handlers = set()
+        get_handler = DistillRender.get_handler
+        def _get_handler(renderer):
+            handler = get_handler(renderer)
+            handlers.add(handler)
+            return handler
+        with TemporaryDirectory() as tempdir, patch.object(
+                DistillRender, 'get_handler', autospec=True, side_effect=_get_handler):
+            watcher = SiteWatcher(tempdir, views, null, watch_static=False)
+            self.addCleanup(watcher.close)
+            manifest = BuildManifest.load(tempdir)
+            self.assertTrue(watcher.needs_full_build(manifest))
+            watcher.build()
+            manifest = BuildManifest.load(tempdir)
+            self.assertFalse(watcher.needs_full_build(manifest))
+            self.assertEqual(manifest.files['path/humanize']['view'], 'test-humanize')
+            self.assertFalse(watcher.check())
+            # the manifest is only loaded again when it changes on disk
+            self.assertIs(watcher.load_manifest(), watcher.load_manifest())
+            # touching a template re-renders only the pages which used it
+            template = next(t for t in manifest.files['path/humanize']['templates']
+                            if t.endswith('humanize.html'))
+            stat = os.stat(template)
+            humanize_path = os.path.join(tempdir, 'path', 'humanize')
+            other_path = os.path.join(tempdir, 'path', '12345')
+            for path in (humanize_path, other_path):
+                os.unlink(path)
+            try:
+                os.utime(template, (stat.st_atime, stat.st_mtime + 10))
+                self.assertTrue(watcher.check())
+            finally:
+                os.utime(template, (stat.st_atime, stat.st_mtime))
+            self.assertTrue(os.path.exists(humanize_path))
+            self.assertFalse(os.path.exists(other_path))
+            # the render thread and its handler are kept between renders
+            self.assertEqual(len(handlers), 1)
+            # unaffected pages are kept in the manifest
+            manifest = BuildManifest.load(tempdir)
+            self.assertIn('path/12345', manifest.files)
@@ -0,0 +1,101 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from django.test import TestCase
+from django_distill.errors import DistillError
+from django_distill.renderer import DistillRender
+from django_distill.workqueue import WorkQueue, QueueWorker, enqueue_site
+from tests.helpers import null, get_views
+
+
+class DjangoDistillWorkQueueTestSuite(TestCase):
+
+    def test_workers_render_queued_pages(self):
+        views = get_views('path-positional-param', 'path-named-param')
+        with TemporaryDirectory() as tempdir:
+            work_queue = WorkQueue(os.path.join(tempdir, 'queue.sqlite3'))
+            self.assertEqual(enqueue_site(work_queue, DistillRender(views)), 3)
+            # pages which are already queued are not added again
+            self.assertEqual(enqueue_site(work_queue, DistillRender(views)), 0)
+            output_dir = os.path.join(tempdir, 'site')
+            worker = QueueWorker(work_queue, DistillRender(views), output_dir, null,
+                                 parallel_render=2)
+            self.assertEqual(worker.run(), 3)
+            self.assertEqual(work_queue.counts(),
+                             {'pending': 0, 'leased': 0, 'done': 3, 'failed': 0})
+            with open(os.path.join(output_dir, 'path', '67890'), 'rb') as f:
+                self.assertEqual(f.read(), b'test67890')
+            with open(os.path.join(output_dir, 'path', 'test'), 'rb') as f:
+                self.assertEqual(f.read(), b'testtest')
+
+    def test_expired_leases_are_claimed_again(self):
+        views = get_views('path-named-param')
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'queue.sqlite3')
+            work_queue = WorkQueue(path, lease_time=-1, max_attempts=2)
+            enqueue_site(work_queue, DistillRender(views))
+            # a worker claims the task and dies
+            self.assertEqual(len(work_queue.claim('dead-worker')), 1)
+            claimed = work_queue.claim('live-worker')
+            self.assertEqual(len(claimed), 1)
+            # stale workers cannot complete tasks claimed by another worker
+            work_queue.complete(claimed[0][0], 'dead-worker')
+            self.assertEqual(work_queue.counts()['done'], 0)
+            # after max_attempts the task is given up on
+            self.assertEqual(work_queue.claim('another-worker'), [])
+            self.assertEqual(work_queue.counts()['failed'], 1)
+            self.assertEqual(work_queue.errors()[0][0], '/path/test')
+
+    def test_failed_renders_are_retried(self):
+        views = get_views('path-broken', 'path-named-param')
+        with TemporaryDirectory() as tempdir:
+            work_queue = WorkQueue(os.path.join(tempdir, 'queue.sqlite3'), max_attempts=2)
+            enqueue_site(work_queue, DistillRender(views))
+            worker = QueueWorker(work_queue, DistillRender(views), tempdir, null)
+            self.assertEqual(worker.run(), 1)
+            counts = work_queue.counts()
+            self.assertEqual((counts['done'], counts['failed']), (1, 1))
+            attempts = work_queue.connection.execute(
+                'SELECT attempts FROM tasks WHERE status = ?', ('failed',)).fetchone()[0]
+            self.assertEqual(attempts, 2)
+
+    def test_parameters_are_stored_as_json(self):
+        with TemporaryDirectory() as tempdir:
+            work_queue = WorkQueue(os.path.join(tempdir, 'queue.sqlite3'))
+            work_queue.add([('/a', 0, 'a', ('1', 2), 'en'),
+                            ('/b', 0, 'b', {'param': 'x'}, 'en')])
+            stored = work_queue.connection.execute(
+                'SELECT param_set FROM tasks ORDER BY id').fetchall()
+            self.assertEqual([row[0] for row in stored],
+                             ['{"args": ["1", 2]}', '{"kwargs": {"param": "x"}}'])
+            claimed = work_queue.claim('worker', limit=2)
+            self.assertEqual([row[4] for row in claimed], [('1', 2), {'param': 'x'}])
+            with self.assertRaises(DistillError):
+                work_queue.add([('/c', 0, 'c', (object(),), 'en')])
+            # anything else in the queue is refused rather than unpickled
+            work_queue.connection.execute(
+                'INSERT INTO tasks (uri, view_index, view_name, param_set, lang, status) '
+                'VALUES (?, ?, ?, ?, ?, ?)', ('/d', 0, 'd', b'\x80\x04N.', 'en', 'pending'))
+            with self.assertRaises(DistillError):
+                work_queue.claim('worker')
+
+    def test_leases_are_renewed_while_rendering(self):
+        views = get_views('path-named-param')
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'queue.sqlite3')
+            work_queue = WorkQueue(path, lease_time=0.3)
+            enqueue_site(work_queue, DistillRender(views))
+            claimed_by_others = []
+            render_task = DistillRender.render_task
+            def _slow_render_task(renderer, task):
+                # another worker tries to claim the page after its first lease expired
+                time.sleep(0.5)
+                claimed_by_others.extend(WorkQueue(path, lease_time=0.3).claim('other'))
+                return render_task(renderer, task)
+            with patch.object(DistillRender, 'render_task', autospec=True,
+                              side_effect=_slow_render_task):
+                worker = QueueWorker(work_queue, DistillRender(views), tempdir, null)
+                self.assertEqual(worker.run(), 1)
+            self.assertEqual(claimed_by_others, [])
+            self.assertEqual(work_queue.counts()['done'], 1)
@@ -4,6 +4,7 @@ from django.http import HttpResponse
 from django.urls import include, path, reverse
 from django.conf.urls.i18n import i18n_patterns
 from django.shortcuts import render
+from django.views.decorators.http import condition
 from django.utils import timezone
 from django.contrib.flatpages.views import flatpage as flatpage_view
 from django.contrib.sitemaps import Sitemap
@@ -74,6 +75,15 @@ def test_humanize_view(request):
     })
 
 
+async def test_async_view(request):
+    return HttpResponse(b'test-async', content_type='application/octet-stream')
+
+
+@condition(etag_func=lambda request: '"test-etag"')
+def test_conditional_view(request):
+    return HttpResponse(b'test-conditional', content_type='application/octet-stream')
+
+
 def test_no_param_func():
     return None
 
@@ -179,7 +189,8 @@ if settings.HAS_PATH:
         distill_path('path/<int>',
             test_positional_param_view,
             name='path-positional-param',
-            distill_func=test_positional_param_func),
+            distill_func=test_positional_param_func,
+            distill_revalidate=timedelta(minutes=5)),
         distill_path('path/x/<int>',
             test_positional_param_view,
             name='path-positional-param-custom',
@@ -227,5 +238,11 @@ if settings.HAS_PATH:
             test_request_has_resolver_match,
             name="test-has-resolver-match",
         ),
+        distill_path('path/async',
+            test_async_view,
+            name='test-async'),
+        distill_path('path/conditional',
+            test_conditional_view,
+            name='test-conditional'),
 
     ]